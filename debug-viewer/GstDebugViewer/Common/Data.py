@@ -56,8 +56,16 @@ class GSourceDispatcher (Dispatcher):
         if self.source_id is not None:
             GObject.source_remove(self.source_id)
 
+        def iterate():
+            if iterator.next():
+                return True
+            # Finished; the source is removed by returning False, so it must
+            # not be removed again when the next iterator is dispatched:
+            self.source_id = None
+            return False
+
         self.source_id = GObject.idle_add(
-            iterator.next, priority=GObject.PRIORITY_LOW)
+            iterate, priority=GObject.PRIORITY_LOW)
 
     def cancel(self):
 
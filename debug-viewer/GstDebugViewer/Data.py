@@ -22,11 +22,67 @@
 import os
 import logging
 import re
+import struct
+import sys
+from array import array
+from bisect import bisect_right
 
 # Nanosecond resolution (like Gst.SECOND)
 SECOND = 1000000000
 
 
+def _unsigned_typecode(itemsize):
+
+    # Python 2 arrays lack the "Q" typecode, so look for the smallest native
+    # type that is wide enough:
+    for typecode in ("B", "H", "I", "L",):
+        if array(typecode).itemsize >= itemsize:
+            return typecode
+
+    return None
+
+
+class _WideOffsetArray (array):
+
+    """Array of 64 bit unsigned integers, for platforms where C long has only
+    4 bytes (so that no array typecode is wide enough).  The values are kept
+    as doubles, which hold integers exactly up to 2 ** 53, and are returned
+    as integers.  This covers file offsets, positions in merged files (with
+    up to 32 files) and timestamps of more than a hundred days."""
+
+    def __new__(cls, initializer=()):
+
+        return array.__new__(cls, "d", initializer)
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            return type(self)(array.__getitem__(self, index))
+
+        return int(array.__getitem__(self, index))
+
+    def __getslice__(self, start, stop):
+
+        return type(self)(array.__getslice__(self, start, stop))
+
+    def __iter__(self):
+
+        from itertools import imap
+
+        return imap(int, array.__iter__(self))
+
+# For file offsets, which can exceed 4 GB, and timestamps:
+OFFSET_TYPECODE = _unsigned_typecode(8)
+if OFFSET_TYPECODE is None:
+    OFFSET_TYPECODE = "d"
+    offset_array = _WideOffsetArray
+else:
+    def offset_array(initializer=()):
+        """Return a new array for file offsets or timestamps."""
+
+        return array(OFFSET_TYPECODE, initializer)
+
+
 def time_args(ts):
 
     secs = ts // SECOND
@@ -120,6 +176,8 @@ debug_level_debug = DebugLevel("DEBUG")
 debug_level_log = DebugLevel("LOG")
 debug_level_fixme = DebugLevel("FIXME")
 debug_level_trace = DebugLevel("TRACE")
+# Indexed by the integer value of the level:
+_debug_levels_by_value = [DebugLevel(i) for i in range(8)]
 debug_levels = [debug_level_none,
                 debug_level_trace,
                 debug_level_fixme,
@@ -129,6 +187,76 @@ debug_levels = [debug_level_none,
                 debug_level_warning,
                 debug_level_error]
 
+
+class LevelArray (object):
+
+    """Compact sequence of debug levels, using one byte per item.
+
+    Items are returned as DebugLevel instances.  The raw level values are
+    available as the array in the values attribute."""
+
+    __slots__ = ("values",)
+
+    def __init__(self, levels=()):
+
+        if isinstance(levels, LevelArray):
+            levels = levels.values
+
+        self.values = array("B", levels)
+
+    @classmethod
+    def from_values(cls, values):
+        """Wrap the given array("B") of level values without copying it."""
+
+        self = cls.__new__(cls)
+        self.values = values
+
+        return self
+
+    def __len__(self):
+
+        return len(self.values)
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return self.from_values(self.values[i])
+
+        return _debug_levels_by_value[self.values[i]]
+
+    def __setitem__(self, i, level):
+
+        self.values[i] = level
+
+    def __delitem__(self, i):
+
+        del self.values[i]
+
+    def __iter__(self):
+
+        from itertools import imap
+
+        return imap(_debug_levels_by_value.__getitem__, self.values)
+
+    def __repr__(self):
+
+        return "<%s %r>" % (type(self).__name__, list(self),)
+
+    def append(self, level):
+
+        self.values.append(level)
+
+    def extend(self, levels):
+
+        if isinstance(levels, LevelArray):
+            levels = levels.values
+
+        self.values.extend(levels)
+
+    def insert(self, i, level):
+
+        self.values.insert(i, level)
+
 # For stripping color codes:
 _escape = re.compile("\x1b\\[[0-9;]*m")
 
@@ -179,6 +307,240 @@ def default_log_line_regex():
     return re.compile("".join(default_log_line_regex_()))
 
 
+def _line_scan_regexes():
+    """Return the tuple (rexp_bare, rexp_ansi, dict_levels) used for the quick
+    scan over all lines of a log file.  The expressions match the thread as
+    group 1 and the level as group 2."""
+
+    dict_levels = {"T": debug_level_trace, "F": debug_level_fixme,
+                   "L": debug_level_log, "D": debug_level_debug,
+                   "I": debug_level_info, "W": debug_level_warning,
+                   "E": debug_level_error, " ": debug_level_none}
+    ANSI = "(?:\x1b\\[[0-9;]*m)?"
+    ANSI_PATTERN = (r"\d:\d\d:\d\d\.\d+ " + ANSI +
+                    r" *\d+" + ANSI +
+                    r" +(0x[0-9a-f]+) +" + ANSI +
+                    r"([TFLDIEW ])")
+    BARE_PATTERN = ANSI_PATTERN.replace(ANSI, "")
+    rexp_bare = re.compile(BARE_PATTERN)
+    rexp_ansi = re.compile(ANSI_PATTERN)
+
+    return (rexp_bare, rexp_ansi, dict_levels,)
+
+
+class _SortedRuns (object):
+
+    """Collects lines that are out of order with respect to the lines before
+    them.  Since lines only get out of order across threads, the lines of each
+    thread form sorted runs (a thread starts a new run whenever its own lines
+    are out of order).  Merging these runs in the end is O(n log k) for k runs,
+    instead of O(n) per line for inserting into the sorted sequence."""
+
+    def __init__(self):
+
+        self.runs = []
+        self.__thread_runs = {}
+
+    def add(self, thread, key, offset, level):
+
+        run = self.__thread_runs.get(thread)
+        if run is None or key < run[0]:
+            run = [key, offset_array(), array("B")]
+            self.__thread_runs[thread] = run
+            self.runs.append(run)
+        else:
+            run[0] = key
+        run[1].append(offset)
+        run[2].append(level)
+
+    def iter_runs(self):
+
+        for key, offsets, levels in self.runs:
+            yield (offsets, levels,)
+
+
+def _merge_sorted_runs(data, offsets, levels, runs):
+    """Merge runs of lines into the sorted arrays offsets and levels.  Each run
+    is a pair of offset and level value arrays sorted by timestamp.  Lines with
+    equal timestamps are kept in file order.  data is the content of the log
+    file, needed to look up the timestamps.  This is a generator that yields
+    periodically while merging."""
+
+    import heapq
+    from itertools import izip
+
+    YIELD_LIMIT = 50000
+
+    runs = [run for run in runs if run[0]]
+    if not runs:
+        return
+
+    time_len = len(time_args(0))
+
+    # All lines that sort before the start of the earliest run are already in
+    # place, so we only need to merge the tail:
+    first_key = min((data[run_offsets[0]:run_offsets[0] + time_len]
+                     for run_offsets, run_levels in runs))
+    lo = 0
+    hi = len(offsets)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if data[offsets[mid]:offsets[mid] + time_len] < first_key:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    if lo == len(offsets) and len(runs) == 1:
+        offsets.extend(runs[0][0])
+        levels.extend(runs[0][1])
+        return
+
+    def keyed(run_offsets, run_levels):
+        for offset, level in izip(run_offsets, run_levels):
+            yield (data[offset:offset + time_len], offset, level,)
+
+    merged = heapq.merge(keyed(offsets[lo:], levels[lo:]),
+                         *[keyed(*run) for run in runs])
+    tail_offsets = offset_array()
+    tail_levels = array("B")
+    offsets_append = tail_offsets.append
+    levels_append = tail_levels.append
+    i = YIELD_LIMIT
+    for key, offset, level in merged:
+        offsets_append(offset)
+        levels_append(level)
+        i -= 1
+        if i == 0:
+            i = YIELD_LIMIT
+            yield True
+
+    del offsets[lo:]
+    del levels[lo:]
+    offsets.extend(tail_offsets)
+    levels.extend(tail_levels)
+
+
+def _find_unsorted_spans(offsets, descents, spans):
+    """Fill the list spans with the (start, stop) ranges of offsets that are
+    not in file order.  descents are the ascending positions i where
+    offsets[i - 1] is greater than offsets[i].  All lines outside of the
+    ranges are at their place in file order already, so sorting each range on
+    its own puts the whole of offsets in file order.  Since lines only get out
+    of order across threads, the ranges are usually short.  This is a
+    generator that yields periodically."""
+
+    YIELD_LIMIT = 5000
+
+    n_descents = len(descents)
+    for i, descent in enumerate(descents):
+        if i % YIELD_LIMIT == YIELD_LIMIT - 1:
+            yield True
+        if i + 1 < n_descents:
+            next_descent = descents[i + 1]
+        else:
+            next_descent = len(offsets)
+        start = descent - 1
+        low = offsets[descent]
+        high = offsets[start]
+        while True:
+            # Lines from the end of the previous range up to here are
+            # ascending; take in those that are greater than our lowest:
+            if spans:
+                base = spans[-1][1]
+            else:
+                base = 0
+            if start > base:
+                start = bisect_right(offsets, low, base, start)
+            if not spans or start > base or spans[-1][3] < low:
+                break
+            # Overlaps the previous range:
+            prev_start, prev_stop, prev_low, prev_high = spans.pop()
+            start = prev_start
+            low = min(low, prev_low)
+            high = max(high, prev_high)
+        # Likewise, lines up to the next descent are ascending:
+        stop = bisect_right(offsets, high, descent + 1, next_descent)
+        spans.append((start, stop, low, high,))
+
+    spans[:] = [(start, stop,) for start, stop, low, high in spans]
+
+
+def _scan_chunk(args):
+    """Scan the lines of the log file between the file positions start and stop
+    (which must be at line boundaries) and return the sorted offsets and level
+    values as strings of packed arrays.  This runs in worker processes."""
+
+    import mmap
+
+    path, start, stop = args
+
+    with open(path, "rb") as real_fileobj:
+        fileobj = mmap.mmap(real_fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        offsets, levels = _scan_range(fileobj, start, stop)
+    finally:
+        fileobj.close()
+
+    return (offsets.tostring(), levels.tostring(),)
+
+
+def _scan_range(fileobj, start, stop):
+    """Scan the lines of the mapped log file between the file positions start
+    and stop (which must be at line boundaries) and return the sorted offsets
+    and level values as arrays."""
+
+    rexp_bare, rexp_ansi, dict_levels = _line_scan_regexes()
+    rexp = rexp_bare
+    time_len = len(time_args(0))
+
+    offsets = offset_array()
+    levels = array("B")
+    sorted_runs = _SortedRuns()
+
+    readline = fileobj.readline
+    rexp_match = rexp.match
+    offsets_append = offsets.append
+    levels_append = levels.append
+    add_out_of_order = sorted_runs.add
+    dict_levels_get = dict_levels.get
+
+    last_line = ""
+    fileobj.seek(start)
+    offset = start
+    while offset < stop:
+        line = readline()
+        if not line:
+            break
+        line_offset = offset
+        offset += len(line)
+        match = rexp_match(line)
+        if match is None:
+            if rexp is rexp_ansi or not "\x1b" in line:
+                continue
+
+            match = rexp_ansi.match(line)
+            if match is None:
+                continue
+            rexp = rexp_ansi
+            rexp_match = rexp.match
+
+        level = dict_levels_get(match.group(2), debug_level_none)
+        if line >= last_line:
+            offsets_append(line_offset)
+            levels_append(level)
+            last_line = line
+        else:
+            add_out_of_order(match.group(1), line[:time_len],
+                             line_offset, level)
+
+    for x in _merge_sorted_runs(fileobj, offsets, levels,
+                                list(sorted_runs.iter_runs())):
+        pass
+
+    return (offsets, levels,)
+
+
 class Producer (object):
 
     def __init__(self):
@@ -196,293 +558,2379 @@ class Producer (object):
             consumer.handle_load_finished()
 
 
-class SortHelper (object):
+class _GzipReader (object):
 
-    def __init__(self, fileobj, offsets):
+    """Decompresses a gzip file forward from a checkpoint.  Checkpoints are
+    tuples (offset, state, skip), where offset is the position in the
+    compressed file and state a copy of the decompressor after reading up to
+    there (None at the start of the file)."""
+
+    start_checkpoint = (0, None, 0,)
 
-        self._gen = self.__gen(fileobj, offsets)
-        self._gen.next()
+    _read_size = 64 * 1024
 
-        # Override in the instance, for performance (this gets called in an
-        # inner loop):
-        self.find_insert_position = self._gen.send
+    def __init__(self, fileobj, checkpoint):
+
+        self.__fileobj = fileobj
+        self.offset, state, skip = checkpoint
+        if state is None:
+            self.__decompressor = self.__new_decompressor()
+        else:
+            self.__decompressor = state.copy()
 
     @staticmethod
-    def find_insert_position(insert_time_string):
+    def __new_decompressor():
 
-        # Stub for documentary purposes.
+        import zlib
 
-        pass
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
 
-    @staticmethod
-    def __gen(fileobj, offsets):
+    def read(self):
+        """Return the next piece of decompressed data, or an empty string at
+        the end of the file."""
 
-        from math import floor
-        tell = fileobj.tell
-        seek = fileobj.seek
-        read = fileobj.read
-        time_len = len(time_args(0))
+        while self.__decompressor is not None:
+            self.__fileobj.seek(self.offset)
+            compressed = self.__fileobj.read(self._read_size)
+            if not compressed:
+                data = self.__decompressor.flush()
+                self.__decompressor = None
+                return data
 
-        # We remember the previous insertion point. This gives a nice speed up
-        # for larger bubbles which are already sorted. TODO: In practice, log
-        # lines only get out of order across threads. Need to check if it pays
-        # to parse the thread here and maintain multiple insertion points for
-        # heavily interleaved parts of the log.
-        pos = 0
-        pos_time_string = ""
+            self.offset += len(compressed)
+            data = self.__decompressor.decompress(compressed)
+            while self.__decompressor.unused_data:
+                # Concatenated gzip members (as written by e.g. pigz):
+                rest = self.__decompressor.unused_data
+                if not rest.strip("\0"):
+                    # Padding after the last member.
+                    break
+                self.__decompressor = self.__new_decompressor()
+                data += self.__decompressor.decompress(rest)
+            if data:
+                return data
 
-        insert_pos = None
-        while True:
-            insert_time_string = (yield insert_pos)
+        return ""
+
+    def checkpoint(self):
+
+        return (self.offset, self.__decompressor.copy(), 0,)
+
+
+class _ZstdReader (object):
+
+    """Decompresses a zstd file forward from a checkpoint.  zstd frames are
+    independent, but the decompressor state cannot be saved within a frame.
+    Checkpoints are tuples (offset, None, skip), where offset is the position
+    of a frame in the compressed file and skip the number of bytes of its
+    decompressed data that come before the checkpoint.  Random access is
+    therefore only fast for files made of many small frames (e.g. written by
+    pzstd or in the zstd seekable format)."""
+
+    start_checkpoint = (0, None, 0,)
+
+    _read_size = 64 * 1024
+
+    frame_magic = 0xFD2FB528
+    skippable_magic_mask = 0xFFFFFFF0
+    skippable_magic = 0x184D2A50
+
+    def __init__(self, fileobj, checkpoint):
+
+        import zstandard
+
+        self.__zstandard = zstandard
+        self.__fileobj = fileobj
+        self.__frame_offset, state, self.__skip = checkpoint
+        self.__frame_position = 0
+        self.__start_frame(self.__frame_offset)
+
+    def __start_frame(self, offset):
 
-            save_offset = tell()
+        self.__decompressor = None
+        self.offset = offset
+        self.__frame_offset = offset
+        self.__frame_position = 0
 
-            if pos_time_string <= insert_time_string:
-                lo = pos
-                hi = len(offsets)
+        while True:
+            frame_size, is_skippable = self.__get_frame_size(offset)
+            if frame_size is None or not is_skippable:
+                break
+            offset += frame_size
+
+        self.offset = offset
+        self.__frame_offset = offset
+        if frame_size is None:
+            self.__frame_end = None
+        else:
+            self.__frame_end = offset + frame_size
+            self.__decompressor = self.__zstandard.ZstdDecompressor(
+            ).decompressobj()
+
+    def __get_frame_size(self, offset):
+        """Return the tuple (size, is_skippable) for the frame at offset, or
+        (None, False) at the end of the file."""
+
+        fileobj = self.__fileobj
+
+        def read(position, size):
+            fileobj.seek(position)
+            data = fileobj.read(size)
+            if len(data) < size:
+                raise ValueError("truncated zstd frame at offset %i" %
+                                 (offset,))
+            return data
+
+        fileobj.seek(offset)
+        if not fileobj.read(1):
+            return (None, False,)
+
+        magic, = struct.unpack("<I", read(offset, 4))
+        if magic & self.skippable_magic_mask == self.skippable_magic:
+            size, = struct.unpack("<I", read(offset + 4, 4))
+            return (8 + size, True,)
+        elif magic != self.frame_magic:
+            raise ValueError("invalid zstd frame at offset %i" % (offset,))
+
+        descriptor = ord(read(offset + 4, 1))
+        content_size_flag = descriptor >> 6
+        single_segment = descriptor & 0x20
+        has_checksum = descriptor & 0x04
+        header_size = (1 +
+                       (0 if single_segment else 1) +
+                       (0, 1, 2, 4)[descriptor & 0x03] +
+                       (1 if single_segment else 0, 2, 4, 8)[content_size_flag])
+
+        position = offset + 4 + header_size
+        while True:
+            block_header = read(position, 3)
+            value = (ord(block_header[0]) | ord(block_header[1]) << 8 |
+                     ord(block_header[2]) << 16)
+            is_last = value & 1
+            block_type = (value >> 1) & 3
+            if block_type == 1:
+                # RLE block, stores a single byte.
+                block_size = 1
+            elif block_type == 3:
+                raise ValueError("invalid zstd block at offset %i" %
+                                 (position,))
             else:
-                lo = 0
-                hi = pos
-
-            # This is a bisection search, except we don't cut the range in the
-            # middle each time, but at the 90th percentile. This is because
-            # logs are "mostly sorted", so the insertion point is much more
-            # likely to be at the end anyways:
-            while lo < hi:
-                mid = int(floor(lo * 0.1 + hi * 0.9))
-                seek(offsets[mid])
-                mid_time_string = read(time_len)
-                if insert_time_string < mid_time_string:
-                    hi = mid
-                else:
-                    lo = mid + 1
-            pos = lo
-            # Caller will replace row at pos with the new one, so this is
-            # correct:
-            pos_time_string = insert_time_string
+                block_size = value >> 3
+            position += 3 + block_size
+            if is_last:
+                break
 
-            insert_pos = pos
+        if has_checksum:
+            position += 4
 
-            seek(save_offset)
+        return (position - offset, False,)
 
+    def read(self):
+        """Return the next piece of decompressed data, or an empty string at
+        the end of the file."""
 
-class LineCache (Producer):
-    """
-    offsets: file position for each line
-    levels: the debug level for each line
-    """
+        while self.__frame_end is not None:
+            if self.offset >= self.__frame_end:
+                self.__start_frame(self.__frame_end)
+                continue
 
-    _lines_per_iteration = 50000
+            self.__fileobj.seek(self.offset)
+            compressed = self.__fileobj.read(
+                min(self._read_size, self.__frame_end - self.offset))
+            if not compressed:
+                raise ValueError("truncated zstd frame at offset %i" %
+                                 (self.__frame_offset,))
+            self.offset += len(compressed)
+            data = self.__decompressor.decompress(compressed)
+            self.__frame_position += len(data)
+            if self.__skip:
+                skipped = min(self.__skip, len(data))
+                data = data[skipped:]
+                self.__skip -= skipped
+            if data:
+                return data
 
-    def __init__(self, fileobj, dispatcher):
+        return ""
 
-        Producer.__init__(self)
+    def checkpoint(self):
+
+        if self.offset >= self.__frame_end:
+            return (self.__frame_end, None, 0,)
+
+        return (self.__frame_offset, None, self.__frame_position,)
 
-        self.logger = logging.getLogger("linecache")
-        self.dispatcher = dispatcher
+
+class CompressedFile (object):
+
+    """Random access to the decompressed contents of a gzip or zstd compressed
+    log file, providing the parts of the mmap interface that the log file
+    classes use.
+
+    The decompressed data is split into blocks of about block_size bytes, each
+    starting at a checkpoint from which decompression can resume.  The block
+    index is built while reading forward through the file, which the first
+    LineCache scan does anyways.  Only the most recently used blocks are kept
+    in memory."""
+
+    block_size = 16 * 1024 * 1024
+    n_cached_blocks = 4
+
+    _readers = (("\x1f\x8b", _GzipReader,),
+                ("\x28\xb5\x2f\xfd", _ZstdReader,),)
+
+    @classmethod
+    def open(cls, fileobj):
+        """Return a CompressedFile for fileobj, or None if it is not
+        compressed."""
+
+        fileobj.seek(0)
+        head = fileobj.read(4)
+        fileobj.seek(0)
+
+        for magic, reader_class in cls._readers:
+            if not head.startswith(magic):
+                continue
+            if reader_class is _ZstdReader:
+                try:
+                    import zstandard
+                except ImportError:
+                    raise IOError("Reading zstd compressed files requires the "
+                                  "zstandard module")
+            return cls(fileobj, reader_class)
+
+        return None
+
+    def __init__(self, fileobj, reader_class):
 
         self.__fileobj = fileobj
         self.__fileobj.seek(0, 2)
-        self.__file_size = self.__fileobj.tell()
-        self.__fileobj.seek(0)
+        self.__compressed_size = self.__fileobj.tell()
+        self.__reader_class = reader_class
 
-        self.offsets = []
-        self.levels = []  # FIXME
+        # Decompressed start position of each block, plus the end of the last
+        # block once the size is known:
+        self.__starts = [0]
+        self.__checkpoints = [reader_class.start_checkpoint]
+        self.__size = None
+        # Reader positioned at the start of the first block that is not in the
+        # index yet:
+        self.__frontier = None
 
-    def start_loading(self):
+        self.__cache = {}
+        self.__cache_order = []
+        self.__position = 0
 
-        self.logger.debug("dispatching load process")
-        self.have_load_started()
-        self.dispatcher(self.__process())
+    def close(self):
+
+        self.__fileobj.close()
+        self.__cache.clear()
+        del self.__cache_order[:]
+
+    def is_indexed(self):
+
+        return self.__size is not None
+
+    def index_blocks(self):
+        """Generator that adds the remaining blocks to the index, one per
+        iteration."""
+
+        while self.__size is None:
+            self.__index_next_block()
+            yield True
 
     def get_progress(self):
+        """Return the fraction of the compressed file that is indexed."""
 
-        return float(self.__fileobj.tell()) / self.__file_size
+        if self.__size is not None or self.__compressed_size == 0:
+            return 1.
 
-    def __process(self):
+        return float(self.__checkpoints[-1][0]) / self.__compressed_size
 
-        offsets = self.offsets
-        levels = self.levels
-
-        dict_levels = {"T": debug_level_trace, "F": debug_level_fixme,
-                       "L": debug_level_log, "D": debug_level_debug,
-                       "I": debug_level_info, "W": debug_level_warning,
-                       "E": debug_level_error, " ": debug_level_none}
-        ANSI = "(?:\x1b\\[[0-9;]*m)?"
-        ANSI_PATTERN = (r"\d:\d\d:\d\d\.\d+ " + ANSI +
-                        r" *\d+" + ANSI +
-                        r" +0x[0-9a-f]+ +" + ANSI +
-                        r"([TFLDIEW ])")
-        BARE_PATTERN = ANSI_PATTERN.replace(ANSI, "")
-        rexp_bare = re.compile(BARE_PATTERN)
-        rexp_ansi = re.compile(ANSI_PATTERN)
-        rexp = rexp_bare
+    def __index_next_block(self):
 
-        # Moving attribute lookups out of the loop:
-        readline = self.__fileobj.readline
-        tell = self.__fileobj.tell
-        rexp_match = rexp.match
-        levels_append = levels.append
-        offsets_append = offsets.append
-        dict_levels_get = dict_levels.get
+        block_index = len(self.__starts) - 1
+        if self.__frontier is None:
+            reader = self.__reader_class(self.__fileobj,
+                                         self.__checkpoints[block_index])
+        else:
+            reader = self.__frontier
+            self.__frontier = None
+
+        chunks = []
+        length = 0
+        while length < self.block_size:
+            data = reader.read()
+            if not data:
+                break
+            chunks.append(data)
+            length += len(data)
+
+        block = "".join(chunks)
+        block_start = self.__starts[block_index]
+        self.__starts.append(block_start + length)
+        if length < self.block_size:
+            self.__size = block_start + length
+        else:
+            self.__checkpoints.append(reader.checkpoint())
+            self.__frontier = reader
 
-        self.__fileobj.seek(0)
-        limit = self._lines_per_iteration
-        last_line = ""
-        i = 0
-        sort_helper = SortHelper(self.__fileobj, offsets)
-        find_insert_position = sort_helper.find_insert_position
-        while True:
-            i += 1
-            if i >= limit:
-                i = 0
-                yield True
+        self.__cache_block(block_index, block)
 
-            offset = tell()
-            line = readline()
-            if not line:
+    def __cache_block(self, block_index, block):
+
+        self.__cache[block_index] = block
+        self.__cache_order.append(block_index)
+        if len(self.__cache_order) > self.n_cached_blocks:
+            del self.__cache[self.__cache_order.pop(0)]
+
+    def __get_block(self, block_index):
+
+        try:
+            block = self.__cache[block_index]
+        except KeyError:
+            pass
+        else:
+            if self.__cache_order[-1] != block_index:
+                self.__cache_order.remove(block_index)
+                self.__cache_order.append(block_index)
+            return block
+
+        reader = self.__reader_class(self.__fileobj,
+                                     self.__checkpoints[block_index])
+        length = self.__starts[block_index + 1] - self.__starts[block_index]
+        chunks = []
+        remaining = length
+        while remaining > 0:
+            data = reader.read()
+            if not data:
+                raise ValueError("compressed file changed while reading")
+            chunks.append(data)
+            remaining -= len(data)
+        block = "".join(chunks)[:length]
+
+        self.__cache_block(block_index, block)
+        return block
+
+    def __find_block(self, position):
+        """Return the index of the block that contains position, or None if
+        it is beyond the end."""
+
+        while self.__size is None and position >= self.__starts[-1]:
+            self.__index_next_block()
+
+        if position < 0 or position >= self.__starts[-1]:
+            return None
+
+        return bisect_right(self.__starts, position) - 1
+
+    def __read(self, start, stop):
+
+        chunks = []
+        while start < stop:
+            block_index = self.__find_block(start)
+            if block_index is None:
                 break
-            match = rexp_match(line)
-            if match is None:
-                if rexp is rexp_ansi or not "\x1b" in line:
-                    continue
+            block = self.__get_block(block_index)
+            block_start = self.__starts[block_index]
+            chunk = block[start - block_start:stop - block_start]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            start += len(chunk)
 
-                match = rexp_ansi.match(line)
-                if match is None:
-                    continue
-                # Switch to slower ANSI parsing:
-                rexp = rexp_ansi
-                rexp_match = rexp.match
+        return "".join(chunks)
 
-            # Timestamp is in the very beginning of the row, and can be sorted
-            # by lexical comparison. That's why we don't bother parsing the
-            # time to integer. We also don't have to take a substring here,
-            # which would be a useless memcpy.
-            if line >= last_line:
-                levels_append(
-                    dict_levels_get(match.group(1), debug_level_none))
-                offsets_append(offset)
-                last_line = line
-            else:
-                pos = find_insert_position(line)
-                levels.insert(
-                    pos, dict_levels_get(match.group(1), debug_level_none))
-                offsets.insert(pos, offset)
+    def __len__(self):
 
-        self.have_load_finished()
-        yield False
+        for x in self.index_blocks():
+            pass
 
+        return self.__size
 
-class LogLine (list):
+    def size(self):
 
-    _line_regex = default_log_line_regex()
+        return len(self)
 
-    @classmethod
-    def parse_full(cls, line_string):
+    def __getitem__(self, key):
 
-        match = cls._line_regex.match(line_string)
-        if match is None:
-            # raise ValueError ("not a valid log line (%r)" % (line_string,))
-            groups = [0, 0, 0, 0, "", "", 0, "", "", 0]
-            return cls(groups)
-
-        line = cls(match.groups())
-        # Timestamp.
-        line[0] = parse_time(line[0])
-        # PID.
-        line[1] = int(line[1])
-        # Thread.
-        line[2] = long(line[2], 16)
-        # Level (this is handled in LineCache).
-        line[3] = 0
-        # Line.
-        line[6] = int(line[6])
-        # Message start offset.
-        line[9] = match.start(9 + 1)
-
-        for col_id in (4,   # COL_CATEGORY
-                       5,   # COL_FILENAME
-                       7,   # COL_FUNCTION,
-                       8,):  # COL_OBJECT
-            line[col_id] = intern(line[col_id] or "")
+        if isinstance(key, slice):
+            if key.step not in (None, 1,):
+                raise ValueError("slice steps are not supported")
+            start, stop = key.start, key.stop
+            if start is None:
+                start = 0
+            elif start < 0:
+                start = max(start + len(self), 0)
+            if stop is None:
+                stop = len(self)
+            elif stop < 0:
+                stop += len(self)
+            return self.__read(start, stop)
 
-        return line
+        if key < 0:
+            key += len(self)
+        data = self.__read(key, key + 1)
+        if not data:
+            raise IndexError("index out of range")
+        return data
 
+    def find(self, string, start=0, end=None):
 
-class LogLines (object):
+        if end is None:
+            end = sys.maxint
 
-    def __init__(self, fileobj, line_cache):
+        position = start
+        while position < end:
+            block_index = self.__find_block(position)
+            if block_index is None:
+                break
+            block = self.__get_block(block_index)
+            block_start = self.__starts[block_index]
+            block_stop = block_start + len(block)
 
-        self.__fileobj = fileobj
-        self.__line_cache = line_cache
+            found = block.find(string, position - block_start,
+                               end - block_start)
+            if found != -1:
+                return block_start + found
 
-    def __len__(self):
+            if len(string) > 1:
+                # Check for a match that crosses into the next block:
+                seam_start = max(position, block_stop - len(string) + 1)
+                seam = self.__read(seam_start,
+                                   min(block_stop + len(string) - 1, end))
+                found = seam.find(string)
+                if found != -1:
+                    return seam_start + found
 
-        return len(self.__line_cache.offsets)
+            position = block_stop
 
-    def __getitem__(self, line_index):
+        return -1
 
-        offset = self.__line_cache.offsets[line_index]
-        self.__fileobj.seek(offset)
-        line_string = self.__fileobj.readline()
-        line = LogLine.parse_full(line_string)
-        msg = line_string[line[-1]:]
-        line[-1] = msg
-        return line
+    def seek(self, position, whence=0):
 
-    def __iter__(self):
+        if whence == 1:
+            position += self.__position
+        elif whence == 2:
+            position += len(self)
 
-        l = len(self)
-        i = 0
-        while i < l:
-            yield self[i]
-            i += 1
+        self.__position = position
 
+    def tell(self):
 
-class LogFile (Producer):
+        return self.__position
 
-    def __init__(self, filename, dispatcher):
+    def read(self, size=-1):
 
-        import mmap
+        if size < 0:
+            stop = len(self)
+        else:
+            stop = self.__position + size
 
-        Producer.__init__(self)
+        data = self.__read(self.__position, stop)
+        self.__position += len(data)
+        return data
 
-        self.logger = logging.getLogger("logfile")
+    def readline(self):
 
-        self.path = os.path.normpath(os.path.abspath(filename))
-        self.__real_fileobj = file(filename, "rb")
-        self.fileobj = mmap.mmap(
-            self.__real_fileobj.fileno(), 0, access=mmap.ACCESS_READ)
-        self.line_cache = LineCache(self.fileobj, dispatcher)
-        self.line_cache.consumers.append(self)
+        position = self.__position
+        block_index = self.__find_block(position)
+        if block_index is None:
+            return ""
 
-    def get_full_line(self, line_index):
+        block = self.__get_block(block_index)
+        block_start = self.__starts[block_index]
+        end = block.find("\n", position - block_start)
+        if end != -1:
+            line = block[position - block_start:end + 1]
+        else:
+            # The line continues in the next block:
+            end = self.find("\n", block_start + len(block))
+            if end == -1:
+                end = len(self)
+            else:
+                end += 1
+            line = self.__read(position, end)
 
-        offset = self.line_cache.offsets[line_index]
-        self.fileobj.seek(offset)
-        line_string = self.fileobj.readline()
-        line = LogLine.parse_full(line_string)
-        msg = line_string[line[-1]:]
-        line[-1] = msg
+        self.__position += len(line)
         return line
 
-    def start_loading(self):
 
-        self.logger.debug("starting load")
-        self.line_cache.start_loading()
+class LineIndex (object):
 
-    def get_load_progress(self):
+    """Sidecar file that caches the results of a LineCache scan.
 
-        return self.line_cache.get_progress()
+    The index is written next to the log file, or into the XDG cache directory
+    if that is not possible.  It is only considered valid if size, modification
+    time and the first few kilobytes of the log file are unchanged."""
 
-    def handle_load_started(self):
+    magic = "GDVINDEX"
+    version = 1
+    suffix = ".gdvindex"
 
-        # Chain up to our consumers:
-        self.have_load_started()
+    # Don't litter the file system with indices for small files, which load
+    # fast enough anyways:
+    min_log_size = 4 * 1024 * 1024
+    head_size = 64 * 1024
 
-    def handle_load_finished(self):
-        self.logger.debug("finish loading")
-        self.lines = LogLines(self.fileobj, self.line_cache)
+    # magic, version, byte order, log size, log mtime, head digest, number of
+    # lines, number of entries in the file order permutation:
+    _header = struct.Struct("=8sIcQd20sQQ")
 
-        # Chain up to our consumers:
-        self.have_load_finished()
+    def __init__(self, log_path, fileobj):
+
+        from hashlib import sha1
+
+        self.logger = logging.getLogger("lineindex")
+
+        self.log_path = log_path
+        self.__fileobj = fileobj
+
+        cache_home = os.environ.get("XDG_CACHE_HOME")
+        if not cache_home:
+            cache_home = os.path.expanduser(os.path.join("~", ".cache"))
+        cache_name = sha1(log_path).hexdigest() + self.suffix
+
+        self.paths = [log_path + self.suffix,
+                      os.path.join(cache_home, "gst-debug-viewer", "index",
+                                   cache_name)]
+
+    def get_signature(self):
+
+        from hashlib import sha1
+
+        stat = os.stat(self.log_path)
+        head = self.__fileobj[:self.head_size]
+
+        return (stat.st_size, stat.st_mtime, sha1(head).digest(),)
+
+    def load(self):
+        """Return the tuple (offsets, levels, order) read from the index, or
+        None if there is no valid index for the log file."""
+
+        try:
+            signature = self.get_signature()
+        except EnvironmentError as exc:
+            self.logger.warning("cannot check log file: %s", exc)
+            return None
+
+        for path in self.paths:
+            try:
+                result = self.__load(path, signature)
+            except (EnvironmentError, ValueError,) as exc:
+                self.logger.debug("not using index %s: %s", path, exc)
+                continue
+            if result is not None:
+                self.logger.debug("using index %s", path)
+                return result
+
+        return None
+
+    def __load(self, path, signature):
+
+        import mmap
+
+        with open(path, "rb") as fileobj:
+            data = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            header_size = self._header.size
+            if len(data) < header_size:
+                raise ValueError("truncated header")
+            header = self._header.unpack_from(data)
+            (magic, version, byteorder, size, mtime, digest,
+             n_lines, n_order,) = header
+
+            if magic != self.magic or version != self.version:
+                raise ValueError("unsupported index version")
+            if byteorder != sys.byteorder[0]:
+                raise ValueError("byte order mismatch")
+            if (size, mtime, digest,) != signature:
+                raise ValueError("stale index")
+
+            offsets = offset_array()
+            level_codes = array("B")
+            order = array("I")
+            position = header_size
+            for column, count in ((offsets, n_lines,),
+                                  (level_codes, n_lines,),
+                                  (order, n_order,),):
+                length = count * column.itemsize
+                if position + length > len(data):
+                    raise ValueError("truncated index")
+                column.fromstring(buffer(data, position, length))
+                position += length
+        finally:
+            data.close()
+
+        levels = LevelArray.from_values(level_codes)
+        if not order:
+            order = None
+
+        return (offsets, levels, order,)
+
+    def save(self, line_cache):
+
+        if not line_cache.offsets:
+            return
+
+        try:
+            signature = self.get_signature()
+        except EnvironmentError as exc:
+            self.logger.warning("cannot check log file: %s", exc)
+            return
+
+        if signature[0] < self.min_log_size:
+            return
+
+        order = line_cache.get_file_order()
+        if order is None:
+            order = array("I")
+
+        offsets = line_cache.offsets
+        level_codes = line_cache.levels.values
+
+        header = self._header.pack(self.magic, self.version,
+                                   sys.byteorder[0],
+                                   signature[0], signature[1], signature[2],
+                                   len(offsets), len(order))
+
+        for path in self.paths:
+            try:
+                self.__save(path, header, (offsets, level_codes, order,))
+            except EnvironmentError as exc:
+                self.logger.debug("cannot write index %s: %s", path, exc)
+                continue
+            else:
+                self.logger.debug("wrote index %s", path)
+                return
+
+        self.logger.warning("could not write line index for %s",
+                            self.log_path)
+
+    def __save(self, path, header, columns):
+
+        def write(fileobj):
+            fileobj.write(header)
+            for column in columns:
+                column.tofile(fileobj)
+
+        _replace_file(path, write)
+
+    def get_sidecar_paths(self, suffix):
+        """Return the paths to try, in order, for another file that is
+        cached alongside the index."""
+
+        return [path[:-len(self.suffix)] + suffix for path in self.paths]
+
+
+def _replace_file(path, write):
+    """Atomically replace the file at path with the contents written by
+    calling write with a file object.  Creates the directory if needed."""
+
+    from tempfile import mkstemp
+
+    dir = os.path.dirname(path)
+    if not os.path.isdir(dir):
+        os.makedirs(dir)
+
+    fd, temp_path = mkstemp(dir=dir, prefix=".%s-tmp" % (
+        os.path.basename(path),))
+    try:
+        with os.fdopen(fd, "wb") as fileobj:
+            write(fileobj)
+        os.rename(temp_path, path)
+    except:
+        os.unlink(temp_path)
+        raise
+
+
+class LineCache (Producer):
+    """
+    offsets: file position for each line (array of 64 bit values)
+    levels: the debug level for each line (LevelArray)
+    index: optional LineIndex to load from and save to
+    path: file name of the log, needed for scanning in worker processes
+    """
+
+    _lines_per_iteration = 50000
+
+    # Files of at least this size are scanned in chunks by worker processes:
+    _parallel_min_size = 64 * 1024 * 1024
+    _parallel_chunk_size = 16 * 1024 * 1024
+    _update_chunk_size = 4 * 1024 * 1024
+
+    def __init__(self, fileobj, dispatcher, index=None, path=None):
+
+        Producer.__init__(self)
+
+        self.logger = logging.getLogger("linecache")
+        self.dispatcher = dispatcher
+        self.index = index
+        self.path = path
+
+        self.__fileobj = fileobj
+        if isinstance(fileobj, CompressedFile):
+            # The decompressed size is not known before reading through the
+            # whole file.
+            self.__file_size = None
+        else:
+            self.__fileobj.seek(0, 2)
+            self.__file_size = self.__fileobj.tell()
+            self.__fileobj.seek(0)
+
+        self.offsets = offset_array()
+        self.levels = LevelArray()
+        self.__order = None
+        self.__parallel_progress = None
+
+    def start_loading(self):
+
+        self.have_load_started()
+
+        if self.index is not None and self.__load_index():
+            if self.__file_size is None:
+                self.logger.debug("dispatching block index process")
+                self.dispatcher(self.__process_block_index())
+            else:
+                self.have_load_finished()
+            return
+
+        n_workers = self.__get_n_workers()
+        if n_workers > 1:
+            self.logger.debug("dispatching parallel load process (%i workers)",
+                              n_workers)
+            self.dispatcher(self.__process_parallel(n_workers))
+        else:
+            self.logger.debug("dispatching load process")
+            self.dispatcher(self.__process())
+
+    def __get_n_workers(self):
+
+        if self.path is None or self.__file_size is None or \
+                self.__file_size < self._parallel_min_size:
+            return 1
+
+        try:
+            import multiprocessing
+            n_cpus = multiprocessing.cpu_count()
+        except (ImportError, NotImplementedError,):
+            return 1
+
+        n_chunks = self.__file_size // self._parallel_chunk_size + 1
+        return min(n_cpus, n_chunks)
+
+    def __load_index(self):
+
+        result = self.index.load()
+        if result is None:
+            return False
+
+        self.logger.debug("loaded offsets and levels from index")
+        self.offsets, self.levels, self.__order = result
+        if self.__order is None:
+            self.__order = array("I")
+        if self.__file_size is not None:
+            self.__fileobj.seek(0, 2)
+
+        return True
+
+    def __process_block_index(self):
+
+        # Compressed files still need to be read through once to find the
+        # block positions for random access:
+        for x in self.__fileobj.index_blocks():
+            yield True
+
+        self.__fileobj.seek(0, 2)
+        self.have_load_finished()
+        yield False
+
+    def get_file_order(self):
+        """Return an array that maps the n-th line in the file to its position
+        in offsets, or None if offsets is sorted already."""
+
+        if self.__order is None:
+            for x in self.__process_file_order():
+                pass
+
+        if not self.__order:
+            return None
+        return self.__order
+
+    def __process_file_order(self):
+
+        from itertools import compress, count, imap, islice
+        from operator import gt
+
+        offsets = self.offsets
+        n_lines = len(offsets)
+        limit = self._lines_per_iteration
+
+        descents = []
+        for start in xrange(0, n_lines, limit):
+            chunk = offsets[start:start + limit + 1]
+            descents.extend(compress(count(start + 1),
+                                     imap(gt, chunk, islice(chunk, 1, None))))
+            yield True
+
+        # An empty order means that offsets is in file order already:
+        order = array("I")
+        if descents:
+            for start in xrange(0, n_lines, limit):
+                order.extend(xrange(start, min(start + limit, n_lines)))
+                yield True
+
+        spans = []
+        for x in _find_unsorted_spans(offsets, descents, spans):
+            yield True
+
+        key = offsets.__getitem__
+        for i, (start, stop,) in enumerate(spans):
+            order[start:stop] = array("I", sorted(xrange(start, stop),
+                                                  key=key))
+            if i % 5000 == 4999:
+                yield True
+
+        self.__order = order
+
+    def update(self, fileobj):
+        """Index the lines that were appended to the log file since it was
+        scanned.  fileobj is the current mapping of the file, which replaces
+        the old one.  The new lines are sorted among themselves and added to
+        the end of offsets and levels.  Returns the number of new lines.
+
+        At most about _update_chunk_size bytes are scanned per call, so that
+        following a fast growing file does not block the caller for long.
+        The next call continues with the rest.
+
+        The new lines are not merged with the lines indexed before, since
+        everything else refers to lines by their index.  A new line with a
+        timestamp before the previous last line therefore breaks the timestamp
+        order of the lines, see LineFields.n_sorted_lines."""
+
+        start = self.__file_size
+        size = len(fileobj)
+
+        self.__fileobj = fileobj
+
+        if start > 0 and fileobj[start - 1] != "\n":
+            # The last line was still being written.  It is indexed already,
+            # so continue after it:
+            start = fileobj.find("\n", start)
+            if start == -1:
+                return 0
+            start += 1
+
+        if start >= size:
+            self.__file_size = size
+            return 0
+
+        stop = fileobj.find("\n", min(start + self._update_chunk_size,
+                                      size) - 1)
+        if stop == -1:
+            stop = size
+        else:
+            stop += 1
+        self.__file_size = stop
+
+        offsets, level_values = _scan_range(fileobj, start, stop)
+        self.offsets.extend(offsets)
+        self.levels.values.extend(level_values)
+        self.__order = None
+        fileobj.seek(0, 2)
+
+        return len(offsets)
+
+    def get_progress(self):
+
+        if self.__file_size is None:
+            return self.__fileobj.get_progress()
+
+        if self.__parallel_progress is not None:
+            return float(self.__parallel_progress) / self.__file_size
+
+        return float(self.__fileobj.tell()) / self.__file_size
+
+    def __iter_chunks(self):
+
+        data = self.__fileobj
+        size = self.__file_size
+        chunk_size = self._parallel_chunk_size
+
+        start = 0
+        while start < size:
+            stop = data.find("\n", min(start + chunk_size, size) - 1)
+            if stop == -1:
+                stop = size
+            else:
+                stop += 1
+            yield (start, stop,)
+            start = stop
+
+    def __process_parallel(self, n_workers):
+
+        import multiprocessing
+
+        self.__parallel_progress = 0
+
+        pool = multiprocessing.Pool(n_workers)
+        try:
+            results = [(stop - start,
+                        pool.apply_async(_scan_chunk,
+                                         ((self.path, start, stop,),)),)
+                       for start, stop in self.__iter_chunks()]
+            pool.close()
+
+            for chunk_size, result in results:
+                while not result.ready():
+                    # Don't block the dispatcher for long, to keep the UI
+                    # responsive:
+                    result.wait(.05)
+                    yield True
+
+                offsets_string, levels_string = result.get()
+                offsets = offset_array()
+                offsets.fromstring(offsets_string)
+                level_values = array("B")
+                level_values.fromstring(levels_string)
+                del offsets_string, levels_string
+
+                for x in _merge_sorted_runs(self.__fileobj, self.offsets,
+                                            self.levels.values,
+                                            [(offsets, level_values,)]):
+                    yield True
+                self.__parallel_progress += chunk_size
+                yield True
+
+            pool.join()
+        finally:
+            pool.terminate()
+
+        self.__parallel_progress = None
+        self.__fileobj.seek(0, 2)
+
+        if self.index is not None:
+            for x in self.__process_file_order():
+                yield True
+            self.index.save(self)
+
+        self.have_load_finished()
+        yield False
+
+    def __process(self):
+
+        offsets = self.offsets
+        levels = self.levels.values
+
+        rexp_bare, rexp_ansi, dict_levels = _line_scan_regexes()
+        rexp = rexp_bare
+
+        # Moving attribute lookups out of the loop:
+        readline = self.__fileobj.readline
+        tell = self.__fileobj.tell
+        rexp_match = rexp.match
+        levels_append = levels.append
+        offsets_append = offsets.append
+        dict_levels_get = dict_levels.get
+
+        time_len = len(time_args(0))
+        sorted_runs = _SortedRuns()
+        add_out_of_order = sorted_runs.add
+
+        self.__fileobj.seek(0)
+        limit = self._lines_per_iteration
+        last_line = ""
+        i = 0
+        while True:
+            i += 1
+            if i >= limit:
+                i = 0
+                yield True
+
+            offset = tell()
+            line = readline()
+            if not line:
+                break
+            match = rexp_match(line)
+            if match is None:
+                if rexp is rexp_ansi or not "\x1b" in line:
+                    continue
+
+                match = rexp_ansi.match(line)
+                if match is None:
+                    continue
+                # Switch to slower ANSI parsing:
+                rexp = rexp_ansi
+                rexp_match = rexp.match
+
+            # Timestamp is in the very beginning of the row, and can be sorted
+            # by lexical comparison. That's why we don't bother parsing the
+            # time to integer. We also don't have to take a substring here,
+            # which would be a useless memcpy.
+            if line >= last_line:
+                levels_append(
+                    dict_levels_get(match.group(2), debug_level_none))
+                offsets_append(offset)
+                last_line = line
+            else:
+                # Sorted in after the scan:
+                add_out_of_order(
+                    match.group(1), line[:time_len], offset,
+                    dict_levels_get(match.group(2), debug_level_none))
+
+        for x in _merge_sorted_runs(self.__fileobj, offsets, levels,
+                                    list(sorted_runs.iter_runs())):
+            yield True
+
+        if self.index is not None:
+            for x in self.__process_file_order():
+                yield True
+            self.index.save(self)
+
+        self.have_load_finished()
+        yield False
+
+
+class RowCache (object):
+
+    """Cache of parsed rows (LogLine objects) keyed by line offset, bounded by
+    a memory budget in bytes.
+
+    Eviction uses the CLOCK algorithm.  New rows start without their
+    reference bit, so rows that a background pass streams through only
+    replace each other and rows that were not used again.  Rows that are
+    accessed repeatedly, like the ones being drawn, get a second chance.
+    Pinned rows are never evicted; if all rows are pinned, the cache grows
+    past its capacity instead."""
+
+    # Rough memory use of a cached row in bytes:
+    row_size = 512
+    default_budget = 32 * 1024 * 1024
+    min_capacity = 256
+
+    def __init__(self, budget=None):
+
+        if budget is None:
+            budget = self.default_budget
+
+        self.capacity = max(budget // self.row_size, self.min_capacity)
+        self.hits = 0
+        self.misses = 0
+        self.pinned = frozenset()
+        self.clear()
+
+    def clear(self):
+
+        self.__slots = {}
+        self.__keys = []
+        self.__rows = []
+        self.__referenced = bytearray()
+        self.__hand = 0
+        self.pinned = frozenset()
+
+    def __len__(self):
+
+        return len(self.__slots)
+
+    def __contains__(self, offset):
+
+        return offset in self.__slots
+
+    def __getitem__(self, offset):
+
+        return self.__rows[self.__slots[offset]]
+
+    def get(self, offset):
+        """Return the row for offset, or None if it is not cached.  Unlike
+        item access, this marks the row as used and counts hits and
+        misses."""
+
+        slot = self.__slots.get(offset)
+        if slot is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.__referenced[slot] = 1
+        return self.__rows[slot]
+
+    def __setitem__(self, offset, row):
+
+        slots = self.__slots
+        slot = slots.get(offset)
+        if slot is not None:
+            self.__rows[slot] = row
+            return
+
+        if len(self.__keys) < self.capacity:
+            slot = None
+        else:
+            slot = self.__find_victim()
+
+        if slot is None:
+            slots[offset] = len(self.__keys)
+            self.__keys.append(offset)
+            self.__rows.append(row)
+            self.__referenced.append(0)
+            return
+
+        del slots[self.__keys[slot]]
+        slots[offset] = slot
+        self.__keys[slot] = offset
+        self.__rows[slot] = row
+
+    def __find_victim(self):
+        """Return the slot of the row to replace, or None if all rows are
+        pinned."""
+
+        keys = self.__keys
+        referenced = self.__referenced
+        pinned = self.pinned
+        capacity = len(keys)
+        hand = self.__hand
+
+        # Two sweeps clear all reference bits, so more than that means that
+        # everything is pinned:
+        for i in xrange(2 * capacity):
+            if not referenced[hand] and keys[hand] not in pinned:
+                break
+            referenced[hand] = 0
+            hand += 1
+            if hand == capacity:
+                hand = 0
+        else:
+            return None
+
+        self.__hand = (hand + 1) % capacity
+        return hand
+
+    def pin(self, offsets):
+        """Protect the rows with the given offsets from eviction, replacing
+        the previously pinned set."""
+
+        self.pinned = frozenset(offsets)
+
+    def get_stats(self):
+
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "rows": len(self),
+                "capacity": self.capacity}
+
+
+class LogLine (tuple):
+
+    """Parsed log line, a tuple of the fields in LogModelBase.COL_* order.
+
+    Lines from parse_full carry a level of 0 (levels are handled in LineCache)
+    and the offset of the message in the line instead of the message text, so
+    that cached lines stay small.  Lines are never modified; complete returns
+    a new line with the actual level and message."""
+
+    __slots__ = ()
+
+    _line_regex = default_log_line_regex()
+
+    @classmethod
+    def parse_full(cls, line_string):
+
+        match = cls._line_regex.match(line_string)
+        if match is None:
+            # raise ValueError ("not a valid log line (%r)" % (line_string,))
+            return cls._invalid_line
+
+        groups = match.groups()
+        return cls((parse_time(groups[0]),      # COL_TIME
+                    int(groups[1]),             # COL_PID
+                    long(groups[2], 16),        # COL_THREAD
+                    0,                          # COL_LEVEL
+                    intern(groups[4] or ""),    # COL_CATEGORY
+                    intern(groups[5] or ""),    # COL_FILENAME
+                    int(groups[6]),             # COL_LINE_NUMBER
+                    intern(groups[7] or ""),    # COL_FUNCTION
+                    intern(groups[8] or ""),    # COL_OBJECT
+                    match.start(9 + 1),))       # COL_MESSAGE (offset)
+
+    def complete(self, level, message):
+        """Return a copy of the line with the given level and message in
+        place of the level and message offset."""
+
+        return LogLine(self[:3] + (level,) + self[4:9] + (message,))
+
+    # Enough to hold the timestamp, PID and thread fields:
+    prefix_size = 64
+
+    @staticmethod
+    def parse_prefix(line_prefix):
+        """Return the tuple (timestamp, PID, thread) of the line that starts
+        with line_prefix (at least prefix_size bytes of it, if it is that
+        long).  This is a lot cheaper than parse_full for these fields.
+        Returns None if the fields cannot be taken apart this simply (for
+        example, if the line is colored)."""
+
+        fields = line_prefix.split(None, 3)
+        if len(fields) < 3:
+            return None
+
+        ts_string, pid_string, thread_string = fields[:3]
+        if not thread_string.startswith("0x"):
+            return None
+
+        try:
+            return (parse_time(ts_string), int(pid_string),
+                    long(thread_string, 16),)
+        except ValueError:
+            return None
+
+LogLine._invalid_line = LogLine((0, 0, 0, 0, "", "", 0, "", "", 0,))
+
+
+class LogLines (object):
+
+    def __init__(self, fileobj, line_cache):
+
+        self.__fileobj = fileobj
+        self.__line_cache = line_cache
+
+    def __len__(self):
+
+        return len(self.__line_cache.offsets)
+
+    def __getitem__(self, line_index):
+
+        offset = self.__line_cache.offsets[line_index]
+        self.__fileobj.seek(offset)
+        line_string = self.__fileobj.readline()
+        line = LogLine.parse_full(line_string)
+        return line.complete(line[3], line_string[line[-1]:])
+
+    def __iter__(self):
+
+        l = len(self)
+        i = 0
+        while i < l:
+            yield self[i]
+            i += 1
+
+
+class LineFields (object):
+
+    """Column store of the parsed fields of all lines in a LineCache.
+
+    columns holds one array per LogLine field, with one item per line in the
+    same order as LineCache.offsets.  The level column is the values array of
+    LineCache.levels.  String fields are interned: their columns hold ids into
+    the corresponding list in strings.  The message column holds the offset of
+    the message relative to the start of the line.  The columns of the ids
+    and the message offsets start out with two bytes per item and are
+    replaced by wider ones when a value does not fit.
+
+    Loading sorts the lines by timestamp, but lines that get appended later
+    may break the order.  The timestamps of the first n_sorted_lines lines are
+    in ascending order.
+
+    The columns are filled by the process generator, which is meant to be run
+    in the background once something needs the fields, which it announces by
+    calling request.  The functions in progress_handlers are called without
+    arguments for every batch of lines that it parsed, which is used to resume
+    the processes that index the columns (these stop when they caught up)."""
+
+    string_fields = (4,   # COL_CATEGORY
+                     5,   # COL_FILENAME
+                     7,   # COL_FUNCTION
+                     8,)  # COL_OBJECT
+
+    _lines_per_iteration = 20000
+
+    def __init__(self, fileobj, line_cache):
+
+        self.__fileobj = fileobj
+        self.line_cache = line_cache
+
+        self.columns = [offset_array(),  # Timestamp.
+                        array("I"),  # PID.
+                        offset_array(),  # Thread.
+                        line_cache.levels.values,
+                        array("H"),  # Category id.
+                        array("H"),  # Filename id.
+                        array("I"),  # Line.
+                        array("H"),  # Function id.
+                        array("H"),  # Object id.
+                        array("H")]  # Message start offset.
+
+        self.strings = [None] * len(self.columns)
+        self.__string_ids = [None] * len(self.columns)
+        for field in self.string_fields:
+            self.strings[field] = [""]
+            self.__string_ids[field] = {"": 0}
+
+        self.progress_handlers = []
+        self.requested = False
+        self.n_sorted_lines = 0
+
+    def request(self):
+        """Ask for the fields of all lines to be parsed.  The first call
+        calls handle_request, which is meant to dispatch the process."""
+
+        if self.requested:
+            return
+
+        self.requested = True
+        self.handle_request()
+
+    def handle_request(self):
+
+        pass
+
+    def set_fileobj(self, fileobj):
+        """Use the given new mapping of the log file, after it has grown."""
+
+        self.__fileobj = fileobj
+
+    def __len__(self):
+        """Return the number of lines parsed so far."""
+
+        return len(self.columns[0])
+
+    def is_complete(self):
+
+        return len(self) == len(self.line_cache.offsets)
+
+    def get_progress(self):
+
+        n_lines = len(self.line_cache.offsets)
+        if n_lines == 0:
+            return 1.
+
+        return float(len(self)) / n_lines
+
+    def get_string_id(self, field, string):
+        """Return the id of string in the given field, or None if no line has
+        this value."""
+
+        return self.__string_ids[field].get(string)
+
+    def take(self, field, line_indices):
+        """Return the values of field for the given line indices, which is an
+        xrange with a step of 1 or a sequence of integers."""
+
+        column = self.columns[field]
+
+        if isinstance(line_indices, xrange):
+            if not line_indices:
+                return ()
+            start = line_indices[0]
+            return column[start:start + len(line_indices)]
+
+        return map(column.__getitem__, line_indices)
+
+    def get_messages(self, line_indices):
+        """Return the messages of the given lines, without the newline."""
+
+        data = self.__fileobj
+        find = data.find
+        data_size = len(data)
+        offsets = self.line_cache.offsets
+        message_offsets = self.columns[9]
+
+        def get_message(line_index):
+            start = offsets[line_index] + message_offsets[line_index]
+            end = find("\n", start)
+            if end == -1:
+                end = data_size
+            return data[start:end]
+
+        return map(get_message, line_indices)
+
+    def __update_sorted_lines(self, start, stop):
+
+        n_sorted = self.n_sorted_lines
+        if n_sorted != start:
+            # The order was broken before.
+            return
+
+        times = self.columns[0]
+        if n_sorted == 0:
+            n_sorted = 1
+        while n_sorted < stop and times[n_sorted - 1] <= times[n_sorted]:
+            n_sorted += 1
+        self.n_sorted_lines = min(n_sorted, stop)
+
+    def process(self):
+
+        data = self.__fileobj
+        offsets = self.line_cache.offsets
+        regex_match = LogLine._line_regex.match
+        find = data.find
+        data_size = len(data)
+
+        columns = self.columns
+        (times, pids, threads, levels, categories, filenames, line_numbers,
+         functions, objects, messages,) = columns
+        string_columns = [[field, columns[field], self.strings[field],
+                           self.__string_ids[field]]
+                          for field in self.string_fields]
+
+        def widen(field, value):
+            # Replace the narrow column for a value that does not fit:
+            column = array("I", columns[field])
+            column.append(value)
+            columns[field] = column
+            return column
+
+        i = len(times)
+        while i < len(offsets):
+            stop = min(i + self._lines_per_iteration, len(offsets))
+            for offset in offsets[i:stop]:
+                end = find("\n", offset)
+                if end == -1:
+                    end = data_size
+                match = regex_match(data[offset:end])
+                if match is None:
+                    groups = ("0:00:00.0", "0", "0", "", "", "", "0", "",
+                              "", "",)
+                    message_offset = 0
+                else:
+                    groups = match.groups()
+                    message_offset = match.start(9 + 1)
+
+                times.append(parse_time(groups[0]))
+                pids.append(int(groups[1]))
+                threads.append(long(groups[2], 16))
+                line_numbers.append(int(groups[6]))
+                try:
+                    messages.append(message_offset)
+                except OverflowError:
+                    messages = widen(9, message_offset)
+                for string_column in string_columns:
+                    field, column, strings, string_ids = string_column
+                    string = groups[field] or ""
+                    string_id = string_ids.setdefault(string, len(strings))
+                    if string_id == len(strings):
+                        strings.append(intern(string))
+                    try:
+                        column.append(string_id)
+                    except OverflowError:
+                        string_column[1] = widen(field, string_id)
+            self.__update_sorted_lines(i, stop)
+            i = stop
+            for handler in list(self.progress_handlers):
+                handler()
+            yield True
+
+        yield False
+
+
+class LineExport (object):
+
+    """Writes a subset of the lines of a log file, given by their offsets, to
+    another file.
+
+    The lines are written in file order, so that the log file is read
+    sequentially.  The lines of a MergedFile are written in the given order
+    instead, since in its file order all lines of one file come before those
+    of the next.  Lines that follow each other in the log file are copied
+    with a single slice, and the output is collected into writes of about
+    buffer_size bytes.  The work is done by the process generator."""
+
+    _lines_per_iteration = 50000
+    buffer_size = 1 << 20
+
+    def __init__(self, fileobj, offsets):
+
+        self.__fileobj = fileobj
+        if not isinstance(fileobj, MergedFile):
+            offsets = sorted(offsets)
+        self.offsets = offset_array(offsets)
+        self.n_written = 0
+
+    def __len__(self):
+
+        return len(self.offsets)
+
+    def is_complete(self):
+
+        return self.n_written == len(self.offsets)
+
+    def get_progress(self):
+
+        if not self.offsets:
+            return 1.
+
+        return float(self.n_written) / len(self.offsets)
+
+    def process(self, out):
+        """Generator that writes the lines to the file object out."""
+
+        data = self.__fileobj
+        find = data.find
+        offsets = self.offsets
+        buffer_size = self.buffer_size
+
+        chunks = []
+        chunks_size = 0
+        run_start = None
+        run_end = None
+
+        i = 0
+        while i < len(offsets):
+            stop = min(i + self._lines_per_iteration, len(offsets))
+            for offset in offsets[i:stop]:
+                if offset != run_end:
+                    if run_end is not None:
+                        chunks.append(data[run_start:run_end])
+                        chunks_size += run_end - run_start
+                    run_start = offset
+
+                end = find("\n", offset)
+                if end == -1:
+                    # Last line of the file, without a newline:
+                    chunks.append(data[run_start:] + "\n")
+                    chunks_size += len(chunks[-1])
+                    run_end = None
+                else:
+                    run_end = end + 1
+                    if run_end - run_start < buffer_size:
+                        continue
+                    chunks.append(data[run_start:run_end])
+                    chunks_size += run_end - run_start
+                    run_start = run_end
+
+                if chunks_size >= buffer_size:
+                    out.write("".join(chunks))
+                    chunks = []
+                    chunks_size = 0
+
+            if run_end is not None and run_start != run_end:
+                chunks.append(data[run_start:run_end])
+            run_start = run_end
+            if chunks:
+                out.write("".join(chunks))
+                chunks = []
+                chunks_size = 0
+
+            i = stop
+            self.n_written = stop
+            yield True
+
+        yield False
+
+
+class MessageIndex (object):
+
+    """Trigram index over the messages of the lines in a LineFields store, to
+    narrow searches down to the lines that can contain a string.
+
+    Trigrams are recorded per block of block_lines consecutive lines, which
+    keeps the index small.  The text is indexed in lower case, so the
+    candidates also cover case insensitive searches.  Candidate lines still
+    have to be checked against the actual search.
+
+    The index is filled by the process generator, which follows the progress
+    of LineFields.process and is meant to be run in the background."""
+
+    block_lines = 32
+
+    _blocks_per_iteration = 200
+
+    def __init__(self, fields):
+
+        self.fields = fields
+        # Number of lines indexed so far:
+        self.n_lines = 0
+        # Maps trigrams to a sorted array of block numbers:
+        self.postings = {}
+
+    def is_complete(self):
+
+        return (self.fields.is_complete() and
+                self.n_lines == len(self.fields.line_cache.offsets))
+
+    def get_progress(self):
+
+        n_lines = len(self.fields.line_cache.offsets)
+        if n_lines == 0:
+            return 1.
+
+        return float(self.n_lines) / n_lines
+
+    def process(self):
+        """Generator that indexes the lines that have their fields parsed so
+        far.  It stops when it caught up with the fields process, so it is run
+        again from LineFields.progress_handlers and after lines were added to
+        the log."""
+
+        from itertools import imap
+
+        fields = self.fields
+        postings = self.postings
+        block_lines = self.block_lines
+
+        # A partial last block is indexed again with its new lines:
+        start = self.n_lines - self.n_lines % block_lines
+        i = 0
+        while True:
+            stop = min(start + block_lines, len(fields))
+            if stop == self.n_lines and stop - start < block_lines:
+                # No new lines to index.
+                break
+
+            block = start // block_lines
+            text = "\n".join(fields.get_messages(xrange(start, stop))).lower()
+            n = len(text)
+            for trigram in set(imap(text.__getslice__,
+                                    xrange(n - 2), xrange(3, n + 1))):
+                try:
+                    blocks = postings[trigram]
+                except KeyError:
+                    postings[trigram] = array("I", (block,))
+                    continue
+                if blocks[-1] != block:
+                    blocks.append(block)
+
+            self.n_lines = stop
+            if stop - start < block_lines:
+                # Partial block at the end.
+                continue
+            start = stop
+
+            i += 1
+            if i == self._blocks_per_iteration:
+                i = 0
+                yield True
+
+        yield False
+
+    def get_candidates(self, strings):
+        """Return an array of the indices of all lines that may contain each
+        of the given strings, or None if the index cannot narrow the search
+        down (because it is incomplete, or all strings are shorter than three
+        characters)."""
+
+        if not self.is_complete():
+            return None
+
+        trigrams = set()
+        for string in strings:
+            string = string.lower()
+            trigrams.update(string[i:i + 3]
+                            for i in xrange(len(string) - 2))
+        if not trigrams:
+            return None
+
+        postings = []
+        for trigram in trigrams:
+            blocks = self.postings.get(trigram)
+            if blocks is None:
+                return array("I")
+            postings.append(blocks)
+
+        postings.sort(key=len)
+        blocks = set(postings[0])
+        for other in postings[1:]:
+            blocks.intersection_update(other)
+            if not blocks:
+                break
+
+        block_lines = self.block_lines
+        n_lines = self.n_lines
+        result = array("I")
+        for block in sorted(blocks):
+            start = block * block_lines
+            result.extend(xrange(start, min(start + block_lines, n_lines)))
+
+        return result
+
+    def get_regex_candidates(self, pattern, flags=0):
+        """Like get_candidates, for the lines that may match the regular
+        expression pattern.  Uses the literal text that every match has to
+        contain."""
+
+        return self.get_candidates(regex_literals(pattern, flags))
+
+
+class LogStatistics (object):
+
+    """Line counts of a log, computed from a LineFields store.
+
+    counts maps each of count_fields to a dictionary from field value to the
+    number of lines with that value (debug levels, category names, thread
+    ids, object names and source file names).  rate maps the whole seconds
+    of the timestamps to the number of lines logged in that second.
+    call_sites maps (filename, line, function) tuples to their number of
+    lines.
+
+    The counts are filled by the process generator in a single pass over the
+    column store, following the progress of LineFields.process.  Given a
+    LineIndex, the results are cached alongside it."""
+
+    count_fields = (3,   # COL_LEVEL
+                    4,   # COL_CATEGORY
+                    2,   # COL_THREAD
+                    8,   # COL_OBJECT
+                    5,)  # COL_FILENAME
+
+    version = 1
+    suffix = ".gdvstats"
+
+    _lines_per_iteration = 50000
+
+    def __init__(self, fields, index=None):
+
+        self.logger = logging.getLogger("statistics")
+
+        self.fields = fields
+        self.index = index
+        # Number of lines counted so far:
+        self.n_lines = 0
+
+        self.counts = dict((field, {},) for field in self.count_fields)
+        self.rate = {}
+        self.call_sites = {}
+
+    def is_complete(self):
+
+        return (self.fields.is_complete() and
+                self.n_lines == len(self.fields.line_cache.offsets))
+
+    def get_progress(self):
+
+        n_lines = len(self.fields.line_cache.offsets)
+        if n_lines == 0:
+            return 1.
+
+        return float(self.n_lines) / n_lines
+
+    def get_counts(self, field):
+        """Return a list of (value, count) pairs for the given field, most
+        frequent values first."""
+
+        return sorted(self.counts[field].iteritems(),
+                      key=lambda item: (-item[1], item[0],))
+
+    def get_top_call_sites(self, n):
+        """Return a list of the n (call site, count) pairs with the most
+        lines, most frequent first."""
+
+        import heapq
+
+        return heapq.nlargest(n, self.call_sites.iteritems(),
+                              key=lambda item: item[1])
+
+    def process(self):
+        """Generator that counts the lines parsed so far, like
+        MessageIndex.process.  The statistics are saved once all lines of the
+        log are counted."""
+
+        if self.n_lines == 0 and self.fields.is_complete() and self.load():
+            yield False
+            return
+
+        fields = self.fields
+        while True:
+            stop = min(self.n_lines + self._lines_per_iteration, len(fields))
+            if stop == self.n_lines:
+                break
+
+            self.__count(self.n_lines, stop)
+            self.n_lines = stop
+            yield True
+
+        if self.is_complete():
+            self.save()
+
+        yield False
+
+    def __count(self, start, stop):
+
+        from itertools import imap, izip, repeat
+        import operator
+
+        def count(values):
+            counts = {}
+            get = counts.get
+            for value in values:
+                counts[value] = get(value, 0) + 1
+            return counts
+
+        def merge(counts, value_counts):
+            get = counts.get
+            for value, n in value_counts:
+                counts[value] = get(value, 0) + n
+
+        columns = self.fields.columns
+        strings = self.fields.strings
+
+        # Values are counted by id and converted to strings after, since there
+        # are far fewer distinct values than lines:
+        for field in self.count_fields:
+            value_counts = count(columns[field][start:stop]).iteritems()
+            if field == 3:
+                value_counts = ((DebugLevel(level), n,)
+                                for level, n in value_counts)
+            elif strings[field] is not None:
+                field_strings = strings[field]
+                value_counts = ((field_strings[string_id], n,)
+                                for string_id, n in value_counts)
+            merge(self.counts[field], value_counts)
+
+        merge(self.rate,
+              count(imap(operator.floordiv, columns[0][start:stop],
+                         repeat(1000000000))).iteritems())
+
+        filenames = strings[5]
+        functions = strings[7]
+        call_sites = izip(columns[5][start:stop], columns[6][start:stop],
+                          columns[7][start:stop])
+        merge(self.call_sites,
+              (((filenames[filename_id], line, functions[function_id],), n,)
+               for (filename_id, line, function_id,), n
+               in count(call_sites).iteritems()))
+
+    def __get_signature(self):
+
+        if self.index is None:
+            return None
+
+        try:
+            signature = self.index.get_signature()
+        except EnvironmentError as exc:
+            self.logger.warning("cannot check log file: %s", exc)
+            return None
+
+        if signature[0] < self.index.min_log_size:
+            return None
+
+        size, mtime, digest = signature
+        return [size, mtime, digest.encode("hex")]
+
+    def load(self):
+        """Read the results from the cache.  Returns whether a valid cache
+        was found."""
+
+        import json
+
+        signature = self.__get_signature()
+        if signature is None:
+            return False
+
+        n_lines = len(self.fields.line_cache.offsets)
+        for path in self.index.get_sidecar_paths(self.suffix):
+            try:
+                with open(path, "rb") as fileobj:
+                    state = json.load(fileobj, encoding="latin-1")
+                if (state["version"] != self.version or
+                        state["signature"] != signature or
+                        state["n_lines"] != n_lines):
+                    raise ValueError("stale statistics")
+                self.__set_state(state)
+            except (EnvironmentError, ValueError, KeyError, TypeError,) as exc:
+                self.logger.debug("not using statistics %s: %s", path, exc)
+                continue
+            self.logger.debug("using statistics %s", path)
+            return True
+
+        return False
+
+    def __set_state(self, state):
+
+        def to_str(value):
+            if isinstance(value, unicode):
+                return value.encode("latin-1")
+            return value
+
+        counts = dict((field, {},) for field in self.count_fields)
+        for field, value_counts in state["counts"]:
+            if field == 3:
+                convert = DebugLevel
+            else:
+                convert = to_str
+            counts[field] = dict((convert(value), n,)
+                                 for value, n in value_counts)
+        self.counts = counts
+        self.rate = dict(state["rate"])
+        self.call_sites = dict(((to_str(filename), line, to_str(function),),
+                                n,)
+                               for filename, line, function, n
+                               in state["call_sites"])
+        self.n_lines = state["n_lines"]
+
+    def save(self):
+        """Write the results to the cache, if the log file has an index."""
+
+        import json
+
+        signature = self.__get_signature()
+        if signature is None:
+            return
+
+        state = {"version": self.version,
+                 "signature": signature,
+                 "n_lines": self.n_lines,
+                 "counts": [(field, [(int(value), n,) if field == 3
+                                     else (value, n,)
+                                     for value, n
+                                     in self.counts[field].iteritems()],)
+                            for field in self.count_fields],
+                 "rate": self.rate.items(),
+                 "call_sites": [site + (n,)
+                                for site, n in self.call_sites.iteritems()]}
+
+        def write(fileobj):
+            json.dump(state, fileobj, encoding="latin-1")
+
+        for path in self.index.get_sidecar_paths(self.suffix):
+            try:
+                _replace_file(path, write)
+            except EnvironmentError as exc:
+                self.logger.debug("cannot write statistics %s: %s", path, exc)
+                continue
+            else:
+                self.logger.debug("wrote statistics %s", path)
+                return
+
+
+class LineGroupIndex (object):
+
+    """Inverted index from the thread and object of lines to the lines, for
+    following one thread or object through a log without filtering it.
+
+    postings maps each of group_fields to a dictionary from the field's value
+    in the Data.LineFields column store (the thread id, or the string id of
+    the object name) to the ascending array of the indices of the lines with
+    that value.  Lines without an object are not indexed.
+
+    The index is filled by the process generator, which follows the progress
+    of LineFields.process and is meant to be run in the background."""
+
+    group_fields = (2,   # COL_THREAD
+                    8,)  # COL_OBJECT
+
+    _lines_per_iteration = 50000
+
+    def __init__(self, fields):
+
+        self.fields = fields
+        # Number of lines indexed so far:
+        self.n_lines = 0
+        self.postings = dict((field, {},) for field in self.group_fields)
+
+    def is_complete(self):
+
+        return (self.fields.is_complete() and
+                self.n_lines == len(self.fields.line_cache.offsets))
+
+    def get_progress(self):
+
+        n_lines = len(self.fields.line_cache.offsets)
+        if n_lines == 0:
+            return 1.
+
+        return float(self.n_lines) / n_lines
+
+    def process(self):
+        """Generator that indexes the lines parsed so far, like
+        MessageIndex.process."""
+
+        from itertools import count, groupby, imap, izip
+        from operator import itemgetter
+
+        fields = self.fields
+        first = itemgetter(0)
+
+        while True:
+            start = self.n_lines
+            stop = min(start + self._lines_per_iteration, len(fields))
+            if stop == start:
+                break
+
+            for field in self.group_fields:
+                postings = self.postings[field]
+                values = fields.columns[field][start:stop]
+                # Threads and objects log in bursts, so add runs of lines at
+                # once:
+                for value, run in groupby(izip(values, count(start)), first):
+                    if field == 8 and value == 0:
+                        # No object.
+                        continue
+                    try:
+                        line_indices = postings[value]
+                    except KeyError:
+                        line_indices = postings[value] = array("I")
+                    line_indices.extend(imap(itemgetter(1), run))
+
+            self.n_lines = stop
+            yield True
+
+        yield False
+
+    def get_keys(self, field):
+        """Return the values of field that have lines, as they are used in
+        postings, in the order of their first line."""
+
+        postings = self.postings[field]
+        return sorted(postings, key=lambda key: postings[key][0])
+
+    def get_name(self, field, key):
+        """Return the display name of a key of field."""
+
+        if field == 8:
+            return self.fields.strings[field][key]
+
+        return "0x%x" % (key,)
+
+    def get_lines(self, field, value):
+        """Return the ascending array of the indices of the lines with the
+        given thread id or object name.  The array is empty if there are
+        none."""
+
+        if self.fields.strings[field] is not None:
+            value = self.fields.get_string_id(field, value)
+
+        return self.postings[field].get(value, array("I"))
+
+
+def regex_literals(pattern, flags=0):
+    """Return a list of strings that every match of the regular expression
+    pattern contains.  The list is empty if the pattern has no such literal
+    text (for example if it has alternatives at the top level)."""
+
+    import sre_parse
+    import sre_constants
+
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except (sre_constants.error, OverflowError, RuntimeError,):
+        return []
+
+    literals = []
+    current = []
+    for op, value in parsed:
+        if op == sre_constants.LITERAL and value < 256:
+            current.append(chr(value))
+            continue
+        if current:
+            literals.append("".join(current))
+            current = []
+    if current:
+        literals.append("".join(current))
+
+    return literals
+
+
+class LogFile (Producer):
+
+    def __init__(self, filename, dispatcher, use_index=True):
+
+        import mmap
+
+        Producer.__init__(self)
+
+        self.logger = logging.getLogger("logfile")
+
+        self.path = os.path.normpath(os.path.abspath(filename))
+        self.__real_fileobj = file(filename, "rb")
+        self.fileobj = CompressedFile.open(self.__real_fileobj)
+        if self.fileobj is None:
+            self.fileobj = mmap.mmap(
+                self.__real_fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        if use_index:
+            index = LineIndex(self.path, self.fileobj)
+        else:
+            index = None
+        self.line_cache = LineCache(self.fileobj, dispatcher, index,
+                                    self.path)
+        self.line_cache.consumers.append(self)
+        self.fields = None
+
+    def update(self):
+        """Index lines that were appended to the file since loading, remapping
+        it as needed.  Returns the indices of the new lines as a tuple (start,
+        stop)."""
+
+        import mmap
+
+        start = len(self.line_cache.offsets)
+
+        if isinstance(self.fileobj, CompressedFile):
+            return (start, start,)
+
+        size = os.fstat(self.__real_fileobj.fileno()).st_size
+        if size < len(self.fileobj):
+            self.logger.warning("log file was truncated, not following it")
+            return (start, start,)
+        elif size > len(self.fileobj):
+            self.fileobj = mmap.mmap(
+                self.__real_fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            self.lines = LogLines(self.fileobj, self.line_cache)
+            if self.fields is not None:
+                self.fields.set_fileobj(self.fileobj)
+
+        # Also continues with lines that the last call left for later:
+        self.line_cache.update(self.fileobj)
+
+        return (start, len(self.line_cache.offsets),)
+
+    def get_full_line(self, line_index):
+
+        offset = self.line_cache.offsets[line_index]
+        self.fileobj.seek(offset)
+        line_string = self.fileobj.readline()
+        line = LogLine.parse_full(line_string)
+        return line.complete(line[3], line_string[line[-1]:])
+
+    def start_loading(self):
+
+        self.logger.debug("starting load")
+        self.line_cache.start_loading()
+
+    def get_load_progress(self):
+
+        return self.line_cache.get_progress()
+
+    def handle_load_started(self):
+
+        # Chain up to our consumers:
+        self.have_load_started()
+
+    def handle_load_finished(self):
+        self.logger.debug("finish loading")
+        self.lines = LogLines(self.fileobj, self.line_cache)
+        self.fields = LineFields(self.fileobj, self.line_cache)
+
+        # Chain up to our consumers:
+        self.have_load_finished()
+
+
+class MergedFile (object):
+
+    """Several log files accessed as one.  Positions combine the index of a
+    file (in the bits above offset_bits) with an offset into that file, so
+    that positions within a line are computed as usual.  Slices and searches
+    never extend past the end of the file they start in."""
+
+    offset_bits = 48
+
+    def __init__(self, files):
+
+        self.files = list(files)
+        self.__file_id = 0
+
+    def split(self, position):
+        """Return the tuple (file index, offset) for position."""
+
+        return (position >> self.offset_bits,
+                position & ((1 << self.offset_bits) - 1),)
+
+    def join(self, file_id, offset):
+
+        return (file_id << self.offset_bits) | offset
+
+    def __len__(self):
+
+        return self.join(len(self.files) - 1, len(self.files[-1]))
+
+    def __file_end(self, file_id, position):
+
+        if position is None or position >> self.offset_bits != file_id:
+            return len(self.files[file_id])
+
+        return position & ((1 << self.offset_bits) - 1)
+
+    def __getitem__(self, key):
+
+        if isinstance(key, slice):
+            if key.step not in (None, 1,):
+                raise ValueError("slice steps are not supported")
+            file_id, start = self.split(key.start or 0)
+            stop = self.__file_end(file_id, key.stop)
+            return self.files[file_id][start:stop]
+
+        file_id, offset = self.split(key)
+        return self.files[file_id][offset]
+
+    def find(self, string, start=0, end=None):
+
+        file_id, offset = self.split(start)
+        result = self.files[file_id].find(string, offset,
+                                          self.__file_end(file_id, end))
+        if result == -1:
+            return -1
+
+        return self.join(file_id, result)
+
+    def seek(self, position, whence=0):
+
+        if whence == 1:
+            position += self.tell()
+        elif whence == 2:
+            position += len(self)
+
+        self.__file_id, offset = self.split(position)
+        self.files[self.__file_id].seek(offset)
+
+    def tell(self):
+
+        return self.join(self.__file_id, self.files[self.__file_id].tell())
+
+    def readline(self):
+
+        return self.files[self.__file_id].readline()
+
+    def close(self):
+
+        for fileobj in self.files:
+            fileobj.close()
+
+
+class _ProcessCollector (object):
+
+    """Dispatcher that keeps the process instead of running it, so that it
+    can be run from within another process."""
+
+    def __init__(self):
+
+        self.process = None
+
+    def __call__(self, iterator):
+
+        self.process = iterator
+
+    def cancel(self):
+
+        self.process = None
+
+
+class MergedLineCache (Producer):
+
+    """Lines of the LogFile objects of a MergedLogFile, merged by timestamp.
+    Offsets are MergedFile positions; lines with equal timestamps are kept
+    in the order of the files.  The LogFile objects must use collector as
+    their dispatcher, so that they are loaded one after the other by the
+    process of the merged file."""
+
+    def __init__(self, fileobj, log_files, dispatcher, collector):
+
+        Producer.__init__(self)
+
+        self.logger = logging.getLogger("linecache")
+        self.dispatcher = dispatcher
+
+        self.offsets = offset_array()
+        self.levels = LevelArray()
+        self.index = None
+
+        self.__fileobj = fileobj
+        self.__log_files = log_files
+        self.__collector = collector
+        self.__n_loaded = 0
+
+    def start_loading(self):
+
+        self.have_load_started()
+        self.logger.debug("dispatching merged load process")
+        self.dispatcher(self.__process())
+
+    def get_progress(self):
+
+        n_files = len(self.__log_files)
+        if self.__n_loaded == n_files:
+            return 1.
+
+        log_file = self.__log_files[self.__n_loaded]
+        return (self.__n_loaded + log_file.get_load_progress()) / n_files
+
+    def get_run(self, file_id, start, stop):
+        """Return the lines start to stop of the given file as a pair of
+        offset and level value arrays, for _merge_sorted_runs."""
+
+        from itertools import imap, repeat
+        import operator
+
+        line_cache = self.__log_files[file_id].line_cache
+        position = self.__fileobj.join(file_id, 0)
+        offsets = offset_array(imap(operator.or_,
+                                    line_cache.offsets[start:stop],
+                                    repeat(position)))
+
+        return (offsets, line_cache.levels.values[start:stop],)
+
+    def append_runs(self, runs):
+        """Merge the given runs among themselves and append them."""
+
+        offsets = offset_array()
+        levels = array("B")
+        for x in _merge_sorted_runs(self.__fileobj, offsets, levels, runs):
+            pass
+
+        self.offsets.extend(offsets)
+        self.levels.values.extend(levels)
+
+    def __process(self):
+
+        collector = self.__collector
+        for log_file in self.__log_files:
+            log_file.start_loading()
+            # Files with a valid line index finish loading right away:
+            if collector.process is not None:
+                for x in collector.process:
+                    yield True
+                collector.process = None
+            self.__n_loaded += 1
+
+        runs = [self.get_run(file_id, 0, len(log_file.line_cache.offsets))
+                for file_id, log_file in enumerate(self.__log_files)]
+        for x in _merge_sorted_runs(self.__fileobj, self.offsets,
+                                    self.levels.values, runs):
+            yield True
+
+        self.have_load_finished()
+        yield False
+
+
+class MergedLogFile (LogFile):
+
+    """Several log files (such as those of the processes of one pipeline)
+    shown as one log.  path is the list of the paths of the files."""
+
+    def __init__(self, filenames, dispatcher, use_index=True):
+
+        Producer.__init__(self)
+
+        self.logger = logging.getLogger("logfile")
+
+        collector = _ProcessCollector()
+        self.log_files = [LogFile(filename, collector, use_index)
+                          for filename in filenames]
+        self.path = [log_file.path for log_file in self.log_files]
+        self.fileobj = MergedFile([log_file.fileobj
+                                   for log_file in self.log_files])
+        self.line_cache = MergedLineCache(self.fileobj, self.log_files,
+                                          dispatcher, collector)
+        self.line_cache.consumers.append(self)
+        self.fields = None
+
+    def update(self):
+        """Index lines that were appended to any of the files since loading.
+        The new lines of all files are merged among themselves and appended.
+        Returns the indices of the new lines as a tuple (start, stop)."""
+
+        start = len(self.line_cache.offsets)
+
+        runs = []
+        for file_id, log_file in enumerate(self.log_files):
+            file_start, file_stop = log_file.update()
+            self.fileobj.files[file_id] = log_file.fileobj
+            if file_start != file_stop:
+                runs.append(self.line_cache.get_run(file_id, file_start,
+                                                    file_stop))
+
+        if not runs:
+            return (start, start,)
+
+        self.line_cache.append_runs(runs)
+        self.lines = LogLines(self.fileobj, self.line_cache)
+        if self.fields is not None:
+            self.fields.set_fileobj(self.fileobj)
+
+        return (start, len(self.line_cache.offsets),)
@@ -159,3 +159,24 @@ class ThreadColorThemeTango (ThreadColorTheme):
                                    t.scarletred1,
                                    t.aluminium6]):
             self.add_color(i, color)
+
+
+class HighlightColorTheme (ColorTheme):
+
+    pass
+
+
+class HighlightColorThemeTango (HighlightColorTheme):
+
+    def __init__(self):
+
+        HighlightColorTheme.__init__(self)
+
+        t = TangoPalette.get()
+        for i, (foreground, background,) in enumerate([(t.white, t.skyblue3,),
+                                                       (t.black, t.butter1,),
+                                                       (t.white, t.chameleon3,),
+                                                       (t.white, t.plum2,),
+                                                       (t.black, t.orange1,),
+                                                       (t.white, t.scarletred2,)]):
+            self.add_color(i, foreground, background)
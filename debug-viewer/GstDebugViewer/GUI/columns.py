@@ -24,11 +24,14 @@ def _(s):
     return s
 
 import logging
+from collections import OrderedDict
+from itertools import groupby
 
 from gi.repository import Gtk, GLib
 
 from GstDebugViewer import Common, Data
-from GstDebugViewer.GUI.colors import LevelColorThemeTango
+from GstDebugViewer.GUI.colors import (HighlightColorThemeTango,
+                                       LevelColorThemeTango)
 from GstDebugViewer.GUI.models import LazyLogModel, LogModelBase
 
 # Sync with gst-inspector!
@@ -83,6 +86,9 @@ class TextColumn (SizedColumn):
             cell.props.family = self.font_family
             cell.props.family_set = True
 
+        self.cell_data_func = None
+        self.row_color_func = None
+
         if self.get_data_func:
             data_func = self.get_data_func()
             assert data_func
@@ -92,6 +98,7 @@ class TextColumn (SizedColumn):
                     data_func(cell.props, model.get_value(tree_iter, id_))
             else:
                 cell_data_func = data_func
+            self.cell_data_func = cell_data_func
             column.set_cell_data_func(cell, cell_data_func)
         elif not self.get_modify_func:
             column.add_attribute(cell, "text", self.id)
@@ -107,7 +114,36 @@ class TextColumn (SizedColumn):
 
         def cell_data_func(column, cell, model, tree_iter, user_data):
             cell.props.text = modify_func(model.get_value(tree_iter, id_))
-        column.set_cell_data_func(cell, cell_data_func)
+        self.cell_data_func = cell_data_func
+        self.update_cell_data_func()
+
+    def set_row_color_func(self, row_color_func):
+        """Color the cells of this column with row_color_func, which takes
+        the model and tree iter of a row and returns a (foreground,
+        background) pair of Gdk colors (or None for the default).  Pass None
+        to stop coloring."""
+
+        self.row_color_func = row_color_func
+        self.update_cell_data_func()
+
+    def update_cell_data_func(self):
+
+        column = self.view_column
+        cell = column.get_cells()[0]
+        cell_data_func = self.cell_data_func
+        row_color_func = self.row_color_func
+
+        if row_color_func is None:
+            column.set_cell_data_func(cell, cell_data_func)
+            return
+
+        def colored_cell_data_func(column, cell, model, tree_iter, user_data):
+            # The column's own function can override the colors:
+            cell.props.foreground_gdk, cell.props.background_gdk = \
+                row_color_func(model, tree_iter)
+            if cell_data_func is not None:
+                cell_data_func(column, cell, model, tree_iter, user_data)
+        column.set_cell_data_func(cell, colored_cell_data_func)
 
     def compute_default_size(self):
 
@@ -327,54 +363,150 @@ class ObjectColumn (TextColumn):
         return ["longobjectname00"]
 
 
+class Highlighters (dict):
+
+    """Highlighters of a MessageColumn, keyed by their owner.  A highlighter is
+    a function that returns the ranges to highlight in a message as a sequence
+    of (start, end) tuples.  Each owner keeps its color index for as long as
+    it has a highlighter set, and version changes whenever a highlighter is
+    set or removed."""
+
+    def __init__(self):
+
+        dict.__init__(self)
+
+        self.version = 0
+        self.color_indices = {}
+
+    def __setitem__(self, key, highlighter):
+
+        dict.__setitem__(self, key, highlighter)
+
+        if key not in self.color_indices:
+            used = set(self.color_indices.values())
+            index = 0
+            while index in used:
+                index += 1
+            self.color_indices[key] = index
+        self.version += 1
+
+    def __delitem__(self, key):
+
+        dict.__delitem__(self, key)
+
+        del self.color_indices[key]
+        self.version += 1
+
+    def clear(self):
+
+        dict.clear(self)
+
+        self.color_indices.clear()
+        self.version += 1
+
+
 class MessageColumn (TextColumn):
 
     name = "message"
     label_header = _("Message")
     id = None
 
+    # Number of rows to keep the highlighted markup for:
+    markup_cache_size = 512
+
     def __init__(self, *a, **kw):
 
-        self.highlighters = {}
+        self.highlighters = Highlighters()
+        self.color_theme = HighlightColorThemeTango()
 
         TextColumn.__init__(self, *a, **kw)
 
+    def get_markup(self, message):
+        """Return the message as Pango markup with the ranges of all
+        highlighters marked, or None if there is nothing to highlight."""
+
+        highlighters = self.highlighters
+        color_indices = highlighters.color_indices
+
+        ranges = []
+        for key, highlighter in highlighters.iteritems():
+            color_index = color_indices[key]
+            ranges.extend((color_index, max(start, 0), min(end, len(message)),)
+                          for start, end in highlighter(message))
+        if not ranges:
+            return None
+
+        # Where highlights overlap, the owner with the lowest color index wins:
+        ranges.sort()
+        bounds = set((0, len(message),))
+        for color_index, start, end in ranges:
+            bounds.add(start)
+            bounds.add(end)
+        bounds = sorted(bounds)
+
+        def get_color_index(segment):
+            start, end = segment
+            for color_index, range_start, range_end in ranges:
+                if range_start <= start and end <= range_end:
+                    return color_index
+            return None
+
+        colors = self.color_theme.colors
+        n_colors = len(colors)
+        escape = GLib.markup_escape_text
+        tags = []
+        for color_index, segments in groupby(zip(bounds, bounds[1:]),
+                                             get_color_index):
+            segments = list(segments)
+            text = escape(message[segments[0][0]:segments[-1][1]])
+            if color_index is None:
+                tags.append(text)
+            else:
+                foreground, background = colors[color_index % n_colors]
+                tags.append("<span foreground=\'%s\' background=\'%s\'>"
+                            "%s</span>" % (foreground.hex_string(),
+                                           background.hex_string(),
+                                           text,))
+
+        return "".join(tags)
+
     def get_data_func(self):
 
         highlighters = self.highlighters
+        get_markup = self.get_markup
         id_ = LazyLogModel.COL_MESSAGE
 
-        def message_data_func(column, cell, model, tree_iter, user_data):
+        # Maps (line offset, highlighters version) to the markup, in least
+        # recently used order:
+        cache = OrderedDict()
+        cache_size = self.markup_cache_size
+        cache_state = [None]
 
-            msg = model.get_value(tree_iter, id_)
+        def message_data_func(column, cell, model, tree_iter, user_data):
 
             if not highlighters:
-                cell.props.text = msg
+                cell.props.text = model.get_value(tree_iter, id_)
                 return
 
-            if len(highlighters) > 1:
-                raise NotImplementedError("FIXME: Support more than one...")
+            if cache_state[0] is not model:
+                # Offsets refer to a different file now.
+                cache.clear()
+                cache_state[0] = model
 
-            highlighter = highlighters.values()[0]
-            row = model[tree_iter]
-            ranges = highlighter(row)
-            if not ranges:
-                cell.props.text = msg
-            else:
-                tags = []
-                prev_end = 0
-                end = None
-                for start, end in ranges:
-                    if prev_end < start:
-                        tags.append(
-                            GLib.markup_escape_text(msg[prev_end:start]))
-                    msg_escape = GLib.markup_escape_text(msg[start:end])
-                    tags.append("<span foreground=\'#FFFFFF\'"
-                                " background=\'#0000FF\'>%s</span>" % (msg_escape,))
-                    prev_end = end
-                if end is not None:
-                    tags.append(GLib.markup_escape_text(msg[end:]))
-                cell.props.markup = "".join(tags)
+            line_index = model.get_user_data(tree_iter)
+            key = (model.line_offsets[line_index], highlighters.version,)
+            try:
+                markup = cache.pop(key)
+            except KeyError:
+                msg = model.get_value(tree_iter, id_)
+                markup = get_markup(msg)
+                if markup is None:
+                    markup = GLib.markup_escape_text(msg)
+                if len(cache) >= cache_size:
+                    cache.popitem(last=False)
+            cache[key] = markup
+
+            cell.props.markup = markup
 
         return message_data_func
 
@@ -399,6 +531,7 @@ class ColumnManager (Common.GUI.Manager):
         self.view = None
         self.actions = None
         self.zoom = 1.0
+        self.row_color_func = None
         self.__columns_changed_id = None
         self.columns = []
         self.column_order = list(self.column_classes)
@@ -481,6 +614,16 @@ class ColumnManager (Common.GUI.Manager):
 
         self.zoom = scale
 
+    def set_row_color_func(self, row_color_func):
+        """Color the rows of the view, see TextColumn.set_row_color_func."""
+
+        for column in self.columns:
+            column.set_row_color_func(row_color_func)
+
+        self.row_color_func = row_color_func
+        if self.view is not None:
+            self.view.queue_draw()
+
     def set_base_time(self, base_time):
 
         try:
@@ -510,6 +653,8 @@ class ColumnManager (Common.GUI.Manager):
 
         cell = column.view_column.get_cells()[0]
         cell.props.scale = self.zoom
+        if self.row_color_func is not None:
+            column.set_row_color_func(self.row_color_func)
 
         self.columns.insert(pos, column)
         self.view.insert_column(column.view_column, pos)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer export module.
+
+Filters log files and writes the remaining lines to a new file, without
+opening a window."""
+
+from itertools import compress, imap
+import logging
+import sys
+
+from GstDebugViewer import Common, Data
+from GstDebugViewer.GUI.filters import (AndFilter,
+                                        CategoryFilter,
+                                        DebugLevelFilter,
+                                        MessageFilter,
+                                        ObjectFilter)
+from GstDebugViewer.GUI.models import FilteredLogModel, LazyLogModel
+
+
+def get_filters(options):
+    """Return the list of filters given by the export options."""
+
+    filters = []
+
+    level = options.get("level")
+    if level is not None and level != max(Data.debug_levels):
+        filters.append(DebugLevelFilter(level.higher_level(),
+                                        DebugLevelFilter.this_and_above))
+
+    category = options.get("category")
+    if category is not None:
+        filters.append(CategoryFilter(category, True))
+
+    object_ = options.get("object")
+    if object_ is not None:
+        filters.append(ObjectFilter(object_, True))
+
+    pattern = options.get("match")
+    if pattern is not None:
+        filters.append(MessageFilter(pattern))
+
+    return filters
+
+
+def get_level_offsets(line_cache, level_filters):
+    """Return the offsets of the lines that all of the given DebugLevelFilters
+    keep.  This only needs the levels that loading collected."""
+
+    level_table = [all(filter.level_table[level] for filter in level_filters)
+                   for level in range(len(Data.debug_levels))]
+
+    return Data.offset_array(
+        compress(line_cache.offsets,
+                 imap(level_table.__getitem__, line_cache.levels.values)))
+
+
+def export(log_file, filters, fileobj, dispatcher):
+    """Write the lines of the loaded log_file that all of the given filters
+    keep to fileobj.  Returns the number of lines written."""
+
+    line_cache = log_file.line_cache
+
+    if not filters:
+        offsets = line_cache.offsets
+    elif all(isinstance(filter, DebugLevelFilter) for filter in filters):
+        offsets = get_level_offsets(line_cache, filters)
+    else:
+        # Parse the fields of all lines, so that the filters run on the
+        # column store instead of parsing every row:
+        if not log_file.fields.is_complete():
+            dispatcher(log_file.fields.process())
+
+        log_filter = FilteredLogModel(LazyLogModel(log_file))
+        log_filter.add_filter(AndFilter(*filters), dispatcher)
+        offsets = log_filter.line_offsets
+
+    line_export = Data.LineExport(log_file.fileobj, offsets)
+    dispatcher(line_export.process(fileobj))
+
+    return len(line_export)
+
+
+def main(options):
+
+    logger = logging.getLogger("export")
+
+    args = options["args"]
+    dispatcher = Common.Data.DefaultDispatcher()
+
+    try:
+        if len(args) == 1:
+            log_file = Data.LogFile(args[0], dispatcher)
+        else:
+            log_file = Data.MergedLogFile(args, dispatcher)
+        log_file.start_loading()
+
+        with open(options["export"], "wb") as fileobj:
+            n_lines = export(log_file, get_filters(options), fileobj,
+                             dispatcher)
+    except EnvironmentError as exc:
+        logger.error("%s", exc)
+        sys.exit(1)
+
+    logger.info("exported %i of %i lines", n_lines,
+                len(log_file.line_cache.offsets))
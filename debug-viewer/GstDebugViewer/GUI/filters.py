@@ -19,6 +19,12 @@
 
 """GStreamer Debug Viewer GUI module."""
 
+from functools import partial
+from itertools import compress, ifilter, ifilterfalse
+import operator
+import re
+
+from GstDebugViewer import Data
 from GstDebugViewer.GUI.models import LogModelBase
 
 
@@ -30,9 +36,200 @@ def get_comparison_function(all_but_this):
         return lambda x, y: x != y
 
 
+def get_column_batch_func(fields, col_id, value, all_but_this):
+
+    if all_but_this:
+        compare = operator.eq
+    else:
+        compare = operator.ne
+
+    compare = partial(compare, value)
+    take = fields.take
+
+    def column_batch_func(line_indices):
+        return map(compare, take(col_id, line_indices))
+    return column_batch_func
+
+
+def get_string_batch_func(fields, col_id, value, all_but_this):
+
+    value_id = fields.get_string_id(col_id, value)
+    if value_id is None:
+        # No line has this value; ids are never negative:
+        value_id = -1
+
+    return get_column_batch_func(fields, col_id, value_id, all_but_this)
+
+
 class Filter (object):
 
-    pass
+    """Base class for filters.
+
+    Filters return True from filter_func for rows that are kept.  They can be
+    combined into a single filter using the &, | and ~ operators, which is
+    evaluated in one pass over the log.  Filters that look at the message
+    set uses_message; the others get rows without one."""
+
+    uses_message = False
+
+    def get_batch_func(self, fields):
+        """Return a function that takes a sequence of line indices into the
+        Data.LineFields column store and returns a list of truth values
+        telling which lines to keep.  Returns None if the filter can only
+        operate on rows, using filter_func."""
+
+        return None
+
+    def get_select_func(self, fields):
+        """Return a function that takes an ascending sequence of line indices
+        into the Data.LineFields column store and returns the list of those
+        that are kept.  Returns None if the filter can only operate on rows,
+        using filter_func."""
+
+        batch_func = self.get_batch_func(fields)
+        if batch_func is None:
+            return None
+
+        def select_func(line_indices):
+            return list(compress(line_indices, batch_func(line_indices)))
+        return select_func
+
+    def __and__(self, other):
+
+        return AndFilter(self, other)
+
+    def __or__(self, other):
+
+        return OrFilter(self, other)
+
+    def __invert__(self):
+
+        return NotFilter(self)
+
+
+class CompoundFilter (Filter):
+
+    def __init__(self, *filters):
+
+        self.filters = []
+        for filter in filters:
+            if type(filter) is type(self):
+                # Flatten nested filters of the same kind:
+                self.filters.extend(filter.filters)
+            else:
+                self.filters.append(filter)
+
+        self.uses_message = any(filter.uses_message for filter in self.filters)
+
+    def get_select_funcs(self, fields):
+
+        select_funcs = [filter.get_select_func(fields)
+                        for filter in self.filters]
+        if None in select_funcs:
+            return None
+
+        return select_funcs
+
+
+class AndFilter (CompoundFilter):
+
+    """Keeps rows that all of the given filters keep."""
+
+    def __init__(self, *filters):
+
+        CompoundFilter.__init__(self, *filters)
+
+        filter_funcs = [filter.filter_func for filter in self.filters]
+
+        def and_filter_func(row):
+            for filter_func in filter_funcs:
+                if not filter_func(row):
+                    return False
+            return True
+        self.filter_func = and_filter_func
+
+    def get_select_func(self, fields):
+
+        select_funcs = self.get_select_funcs(fields)
+        if select_funcs is None:
+            return None
+
+        def and_select_func(line_indices):
+            # Each filter only sees the lines that passed the previous ones:
+            for select_func in select_funcs:
+                if not line_indices:
+                    break
+                line_indices = select_func(line_indices)
+            return line_indices
+        return and_select_func
+
+
+class OrFilter (CompoundFilter):
+
+    """Keeps rows that any of the given filters keeps."""
+
+    def __init__(self, *filters):
+
+        CompoundFilter.__init__(self, *filters)
+
+        filter_funcs = [filter.filter_func for filter in self.filters]
+
+        def or_filter_func(row):
+            for filter_func in filter_funcs:
+                if filter_func(row):
+                    return True
+            return False
+        self.filter_func = or_filter_func
+
+    def get_select_func(self, fields):
+
+        select_funcs = self.get_select_funcs(fields)
+        if select_funcs is None:
+            return None
+
+        def or_select_func(line_indices):
+            selected = set()
+            remaining = line_indices
+            # Each filter only sees the lines that no previous one kept:
+            for select_func in select_funcs:
+                if not remaining:
+                    break
+                selected.update(select_func(remaining))
+                remaining = list(ifilterfalse(selected.__contains__,
+                                              remaining))
+            return list(ifilter(selected.__contains__, line_indices))
+        return or_select_func
+
+
+class NotFilter (Filter):
+
+    """Keeps rows that the given filter does not keep."""
+
+    def __init__(self, filter):
+
+        self.filter = filter
+        self.uses_message = filter.uses_message
+
+        filter_func = filter.filter_func
+
+        def not_filter_func(row):
+            return not filter_func(row)
+        self.filter_func = not_filter_func
+
+    def get_select_func(self, fields):
+
+        select_func = self.filter.get_select_func(fields)
+        if select_func is None:
+            return None
+
+        def not_select_func(line_indices):
+            selected = set(select_func(line_indices))
+            return list(ifilterfalse(selected.__contains__, line_indices))
+        return not_select_func
+
+    def __invert__(self):
+
+        return self.filter
 
 
 class DebugLevelFilter (Filter):
@@ -52,11 +249,28 @@ class DebugLevelFilter (Filter):
             return comparison_function(row[col_id], debug_level)
         self.filter_func = filter_func
 
+        # Lookup table by level value:
+        self.level_table = [comparison_function(level, debug_level)
+                            for level in sorted(Data.debug_levels)]
+
+    def get_batch_func(self, fields):
+
+        col_id = LogModelBase.COL_LEVEL
+        lookup = self.level_table.__getitem__
+        take = fields.take
+
+        def level_batch_func(line_indices):
+            return map(lookup, take(col_id, line_indices))
+        return level_batch_func
+
 
 class CategoryFilter (Filter):
 
     def __init__(self, category, all_but_this=False):
 
+        self.value = category
+        self.all_but_this = all_but_this
+
         col_id = LogModelBase.COL_CATEGORY
         comparison_function = get_comparison_function(all_but_this)
 
@@ -64,11 +278,19 @@ class CategoryFilter (Filter):
             return comparison_function(row[col_id], category)
         self.filter_func = category_filter_func
 
+    def get_batch_func(self, fields):
+
+        return get_string_batch_func(fields, LogModelBase.COL_CATEGORY,
+                                     self.value, self.all_but_this)
+
 
 class ObjectFilter (Filter):
 
     def __init__(self, object_, all_but_this=False):
 
+        self.value = object_
+        self.all_but_this = all_but_this
+
         col_id = LogModelBase.COL_OBJECT
         comparison_function = get_comparison_function(all_but_this)
 
@@ -76,14 +298,116 @@ class ObjectFilter (Filter):
             return comparison_function(row[col_id], object_)
         self.filter_func = object_filter_func
 
+    def get_batch_func(self, fields):
+
+        return get_string_batch_func(fields, LogModelBase.COL_OBJECT,
+                                     self.value, self.all_but_this)
+
 
 class FilenameFilter (Filter):
 
     def __init__(self, filename, all_but_this=False):
 
+        self.value = filename
+        self.all_but_this = all_but_this
+
         col_id = LogModelBase.COL_FILENAME
         comparison_function = get_comparison_function(all_but_this)
 
         def filename_filter_func(row):
             return comparison_function(row[col_id], filename)
         self.filter_func = filename_filter_func
+
+    def get_batch_func(self, fields):
+
+        return get_string_batch_func(fields, LogModelBase.COL_FILENAME,
+                                     self.value, self.all_but_this)
+
+
+class ThreadFilter (Filter):
+
+    def __init__(self, thread, all_but_this=False):
+
+        self.value = thread
+        self.all_but_this = all_but_this
+
+        col_id = LogModelBase.COL_THREAD
+        comparison_function = get_comparison_function(all_but_this)
+
+        def thread_filter_func(row):
+            return comparison_function(row[col_id], thread)
+        self.filter_func = thread_filter_func
+
+    def get_batch_func(self, fields):
+
+        return get_column_batch_func(fields, LogModelBase.COL_THREAD,
+                                     self.value, self.all_but_this)
+
+
+class TimeRangeFilter (Filter):
+
+    """Keeps rows with start <= timestamp < stop.  Either bound can be None
+    to leave the range open on that side."""
+
+    def __init__(self, start=None, stop=None):
+
+        self.start = start
+        self.stop = stop
+
+        col_id = LogModelBase.COL_TIME
+
+        def time_range_filter_func(row):
+            ts = row[col_id]
+            return ((start is None or start <= ts) and
+                    (stop is None or ts < stop))
+        self.filter_func = time_range_filter_func
+
+    def get_batch_func(self, fields):
+
+        col_id = LogModelBase.COL_TIME
+        take = fields.take
+        if self.start is not None:
+            # start <= ts:
+            after_start = partial(operator.le, self.start)
+        if self.stop is not None:
+            # ts < stop:
+            before_stop = partial(operator.gt, self.stop)
+
+        def time_range_batch_func(line_indices):
+            times = take(col_id, line_indices)
+            if self.start is None:
+                mask = [True] * len(times)
+            else:
+                mask = map(after_start, times)
+            if self.stop is not None:
+                mask = map(operator.and_, mask, map(before_stop, times))
+            return mask
+        return time_range_batch_func
+
+
+class MessageFilter (Filter):
+
+    """Keeps rows with a message that matches the given regular expression
+    (anywhere in the message)."""
+
+    uses_message = True
+
+    def __init__(self, pattern, flags=0):
+
+        self.regex = re.compile(pattern, flags)
+
+        col_id = LogModelBase.COL_MESSAGE
+        search = self.regex.search
+
+        def message_filter_func(row):
+            return search(row[col_id]) is not None
+        self.filter_func = message_filter_func
+
+    def get_batch_func(self, fields):
+
+        search = self.regex.search
+        get_messages = fields.get_messages
+
+        def message_batch_func(line_indices):
+            return map(search, get_messages(line_indices))
+        return message_batch_func
@@ -20,7 +20,10 @@
 """GStreamer Debug Viewer GUI module."""
 
 from array import array
+from binascii import hexlify, unhexlify
 from bisect import bisect_left
+from collections import deque
+from itertools import compress, imap, izip, repeat
 import logging
 
 from gi.repository import GObject
@@ -44,15 +47,30 @@ class LogModelBase (Common.GUI.GenericTreeModel):
                "COL_OBJECT", str,
                "COL_MESSAGE", str,)
 
+    # Memory budget of the parsed row cache in bytes:
+    row_cache_budget = Data.RowCache.default_budget
+
     def __init__(self):
 
         Common.GUI.GenericTreeModel.__init__(self)
 
         # self.props.leak_references = False
 
-        self.line_offsets = array("I")
-        self.line_levels = []  # FIXME: Not so nice!
-        self.line_cache = {}
+        self.line_offsets = Data.offset_array()
+        self.line_levels = Data.LevelArray()
+        self.line_cache = Data.RowCache(self.row_cache_budget)
+        # Data.LineFields column store, indexed like line_offsets:
+        self.line_fields = None
+
+        # Columns that Data.LogLine.parse_prefix decodes, with their index in
+        # its result:
+        self.prefix_fields = {self.COL_TIME: 0,
+                              self.COL_PID: 1,
+                              self.COL_THREAD: 2}
+        # Number of values per column that were decoded from the start of
+        # the line, and that needed a full parse of the line:
+        self.prefix_parses = [0] * len(self.column_types)
+        self.full_parses = [0] * len(self.column_types)
 
     def ensure_cached(self, line_offset):
 
@@ -62,24 +80,37 @@ class LogModelBase (Common.GUI.GenericTreeModel):
 
         raise NotImplementedError("derived classes must override this method")
 
-    def iter_rows_offset(self):
+    def access_prefix(self, offset):
+
+        raise NotImplementedError("derived classes must override this method")
+
+    def read_rows(self, offsets, levels, messages=True):
+
+        raise NotImplementedError("derived classes must override this method")
+
+    def iter_rows_offset(self, start=0, stop=None, messages=True):
+        """Iterate over (row, line offset) pairs for the given range of
+        lines.  Rows are Data.LogLine objects with the level filled in, and
+        the message if messages is true (else it is None, which saves reading
+        it from the file)."""
 
         ensure_cached = self.ensure_cached
         line_cache = self.line_cache
         line_levels = self.line_levels
-        COL_LEVEL = self.COL_LEVEL
         COL_MESSAGE = self.COL_MESSAGE
         access_offset = self.access_offset
 
-        for i, offset in enumerate(self.line_offsets):
+        if stop is None:
+            stop = len(self.line_offsets)
+
+        for i, offset in enumerate(self.line_offsets[start:stop], start):
             ensure_cached(offset)
             row = line_cache[offset]
-            # adjust special rows
-            row[COL_LEVEL] = line_levels[i]
-            msg_offset = row[COL_MESSAGE]
-            row[COL_MESSAGE] =  access_offset(offset + msg_offset)
-            yield (row, offset,)
-            row[COL_MESSAGE] = msg_offset
+            if messages:
+                message = access_offset(offset + row[COL_MESSAGE])
+            else:
+                message = None
+            yield (row.complete(line_levels[i], message), offset,)
 
     def on_get_flags(self):
 
@@ -128,6 +159,15 @@ class LogModelBase (Common.GUI.GenericTreeModel):
             return self.line_levels[line_index]
 
         line_offset = self.line_offsets[line_index]
+        if line_offset not in self.line_cache:
+            prefix_field = self.prefix_fields.get(col_id)
+            if prefix_field is not None:
+                values = Data.LogLine.parse_prefix(
+                    self.access_prefix(line_offset))
+                if values is not None:
+                    self.prefix_parses[col_id] += 1
+                    return values[prefix_field]
+            self.full_parses[col_id] += 1
         self.ensure_cached(line_offset)
 
         value = self.line_cache[line_offset][col_id]
@@ -137,6 +177,16 @@ class LogModelBase (Common.GUI.GenericTreeModel):
 
         return value
 
+    def get_parse_stats(self):
+        """Return the prefix_parses and full_parses counts by lower case
+        column name."""
+
+        names = self.columns[::2]
+        return dict((name[len("COL_"):].lower(),
+                     {"prefix": self.prefix_parses[col_id],
+                      "full": self.full_parses[col_id]},)
+                    for col_id, name in enumerate(names))
+
     def get_value_range(self, col_id, start, stop):
 
         if col_id != self.COL_LEVEL:
@@ -208,6 +258,7 @@ class LazyLogModel (LogModelBase):
         self.line_cache.clear()
         self.line_offsets = log_obj.line_cache.offsets
         self.line_levels = log_obj.line_cache.levels
+        self.line_fields = log_obj.fields
 
     def access_offset(self, offset):
 
@@ -215,20 +266,66 @@ class LazyLogModel (LogModelBase):
         self.__fileobj.seek(offset)
         return self.__fileobj.readline()
 
+    def access_prefix(self, offset):
+
+        return self.__fileobj[offset:offset + Data.LogLine.prefix_size]
+
+    def read_rows(self, offsets, levels, messages=True):
+        """Generate the rows of the lines at the given offsets with the given
+        levels, like iter_rows_offset.  The lines are sliced out of the file
+        and parsed without going through the row cache, which leaves the
+        model untouched."""
+
+        data = self.__fileobj
+        find = data.find
+        size = len(data)
+        parse_full = Data.LogLine.parse_full
+        COL_MESSAGE = self.COL_MESSAGE
+
+        for offset, level in izip(offsets, levels):
+            stop = find("\n", offset)
+            if stop == -1:
+                stop = size
+            else:
+                stop += 1
+            line = data[offset:stop]
+            row = parse_full(line)
+            if messages:
+                message = line[row[COL_MESSAGE]:]
+            else:
+                message = None
+            yield row.complete(level, message)
+
     def ensure_cached(self, line_offset):
 
-        if line_offset in self.line_cache:
+        if self.line_cache.get(line_offset) is not None:
             return
 
-        if len(self.line_cache) > 10000:
-            self.line_cache.clear()
-
         self.__fileobj.seek(line_offset)
         line = self.__fileobj.readline()
 
         self.line_cache[line_offset] = Data.LogLine.parse_full(line)
 
 
+def combine_masks(masks):
+    """Return the mask that is set where all of the given masks are set.
+    Masks are bytearrays with items of either 0 or 1."""
+
+    if len(masks) == 1:
+        return masks[0]
+
+    n_bytes = len(masks[0])
+    if n_bytes == 0:
+        return bytearray()
+
+    # Operating on long integers is a lot faster than iterating bytes:
+    value = long(hexlify(masks[0]), 16)
+    for mask in masks[1:]:
+        value &= long(hexlify(mask), 16)
+
+    return bytearray(unhexlify("%0*x" % (2 * n_bytes, value,)))
+
+
 class FilteredLogModelBase (LogModelBase):
 
     def __init__(self, super_model):
@@ -239,6 +336,8 @@ class FilteredLogModelBase (LogModelBase):
 
         self.super_model = super_model
         self.access_offset = super_model.access_offset
+        self.access_prefix = super_model.access_prefix
+        self.read_rows = super_model.read_rows
         self.ensure_cached = super_model.ensure_cached
         self.line_cache = super_model.line_cache
 
@@ -253,6 +352,20 @@ class FilteredLogModelBase (LogModelBase):
 
 class FilteredLogModel (FilteredLogModelBase):
 
+    """Model showing the lines of the super model that pass all filters and
+    lie in the range set with set_range.
+
+    For filters evaluated on the column store, a mask with one byte per line
+    of the super model is kept.  As long as all filters have a mask, removing
+    a filter or widening the range only combines the masks and does not run
+    any filter again.
+
+    Filter processes evaluate the lines in chunks and return to the
+    dispatcher after each one, so the UI is never blocked for long."""
+
+    _masked_chunk_lines = 100000
+    _rows_chunk_lines = 10000
+
     def __init__(self, super_model):
 
         FilteredLogModelBase.__init__(self, super_model)
@@ -260,8 +373,10 @@ class FilteredLogModel (FilteredLogModelBase):
         self.logger = logging.getLogger("filtered-log-model")
 
         self.filters = []
+        self.filter_masks = []
         self.reset()
         self.__active_process = None
+        self.__aborted_state = None
         self.__filter_progress = 0.
 
     def reset(self):
@@ -271,50 +386,165 @@ class FilteredLogModel (FilteredLogModelBase):
         self.line_offsets = self.super_model.line_offsets
         self.line_levels = self.super_model.line_levels
         self.super_index = xrange(len(self.line_offsets))
+        self.__range = None
 
         del self.filters[:]
+        del self.filter_masks[:]
+
+    def __get_range(self):
+
+        if self.__range is None:
+            return (0, len(self.super_model.line_offsets),)
+        else:
+            return self.__range
+
+    def __set_super_index(self, super_index):
+
+        super_model = self.super_model
+        self.super_index = super_index
+        self.line_offsets = Data.offset_array(
+            map(super_model.line_offsets.__getitem__, super_index))
+        self.line_levels = Data.LevelArray.from_values(
+            array("B", map(super_model.line_levels.values.__getitem__,
+                           super_index)))
+
+    def __set_identity_range(self):
+
+        super_start, super_stop = self.__get_range()
+        self.super_index = xrange(super_start, super_stop)
+        self.line_offsets = SubRange(self.super_model.line_offsets,
+                                     super_start, super_stop)
+        self.line_levels = SubRange(self.super_model.line_levels,
+                                    super_start, super_stop)
+
+    def __apply_masks(self):
+
+        if not self.filters:
+            self.__set_identity_range()
+            return
+
+        super_start, super_stop = self.__get_range()
+        mask = combine_masks(self.filter_masks)
+        self.__set_super_index(
+            array("I", compress(xrange(super_start, super_stop),
+                                mask[super_start:super_stop])))
 
     def __filter_process(self, filter):
 
-        YIELD_LIMIT = 10000
+        fields = self.super_model.line_fields
+        if fields is not None:
+            select_func = filter.get_select_func(fields)
+            if select_func is not None:
+                if fields.is_complete():
+                    return self.__filter_process_masked(select_func)
+                # Later filters can use the column store:
+                fields.request()
+
+        return self.__filter_process_rows(filter.filter_func,
+                                          filter.uses_message)
+
+    @staticmethod
+    def __iter_chunks(start, stop, chunk_lines):
+
+        for chunk_start in xrange(start, stop, chunk_lines):
+            yield (chunk_start, min(chunk_start + chunk_lines, stop),)
+
+    def __filter_process_masked(self, select_func):
+
+        self.logger.debug("running filter on column store")
+        # Evaluate the filter for all lines, not just the visible ones, so
+        # that the mask stays valid when other filters are removed:
+        n_lines = len(self.super_model.line_offsets)
+        mask = bytearray(n_lines)
+        set_kept = mask.__setitem__
+        progress_full = float(n_lines)
+
+        for start, stop in self.__iter_chunks(0, n_lines,
+                                              self._masked_chunk_lines):
+            selected = select_func(xrange(start, stop))
+            deque(imap(set_kept, selected, repeat(1)), 0)
+            self.__filter_progress = stop / progress_full
+            yield True
+
+        self.filter_masks[-1] = mask
+        super_index = self.super_index
+        self.__set_super_index(
+            array("I", compress(super_index,
+                                imap(mask.__getitem__, super_index))))
+        self.logger.debug("filtering finished")
+
+        self.__filter_progress = 1.
+        self.__handle_filter_process_finished()
+        yield False
+
+    def __filter_process_rows(self, func, messages=True):
 
         self.logger.debug("preparing new filter")
-        new_line_offsets = array("I")
-        new_line_levels = []
-        new_super_index = array("I")
-        level_id = self.COL_LEVEL
-        func = filter.filter_func
+        read_rows = self.read_rows
+        line_offsets = self.line_offsets
+        line_levels = self.line_levels
+        super_index = self.super_index
+        n_lines = len(line_offsets)
 
-        def enum():
-            i = 0
-            for row, offset in self.iter_rows_offset():
-                line_index = self.super_index[i]
-                yield (line_index, row, offset,)
-                i += 1
         self.logger.debug("running filter")
-        progress = 0.
-        progress_full = float(len(self))
-        y = YIELD_LIMIT
-        for i, row, offset in enum():
-            if func(row):
-                new_line_offsets.append(offset)
-                new_line_levels.append(row[level_id])
-                new_super_index.append(i)
-            y -= 1
-            if y == 0:
-                progress += float(YIELD_LIMIT)
-                self.__filter_progress = progress / progress_full
-                y = YIELD_LIMIT
-                yield True
-        self.line_offsets = new_line_offsets
-        self.line_levels = new_line_levels
-        self.super_index = new_super_index
+        new_super_index = array("I")
+        progress_full = float(n_lines)
+        for start, stop in self.__iter_chunks(0, n_lines,
+                                              self._rows_chunk_lines):
+            rows = read_rows(line_offsets[start:stop],
+                             line_levels[start:stop], messages)
+            new_super_index.extend(super_index[i]
+                                   for i, row in enumerate(rows, start)
+                                   if func(row))
+            self.__filter_progress = stop / progress_full
+            yield True
+
+        self.__set_super_index(new_super_index)
         self.logger.debug("filtering finished")
 
         self.__filter_progress = 1.
         self.__handle_filter_process_finished()
         yield False
 
+    def __refilter_process(self):
+
+        if None not in self.filter_masks:
+            self.logger.debug("combining filter masks")
+            self.__apply_masks()
+            self.__filter_progress = 1.
+            self.__handle_filter_process_finished()
+            yield False
+            return
+
+        # Some filters were only run on the rows that were visible at the
+        # time, so all of them need to run again:
+        self.__set_identity_range()
+        filter = self.__get_combined_filter()
+        for result in self.__filter_process_rows(filter.filter_func,
+                                                 filter.uses_message):
+            yield result
+
+    def __get_combined_filter(self):
+        """Return a filter that keeps the rows that all filters keep, which
+        evaluates them in one pass."""
+
+        # The filters module imports this one:
+        from GstDebugViewer.GUI.filters import AndFilter
+
+        return AndFilter(*self.filters)
+
+    def __start_process(self, process, dispatcher):
+
+        self.__dispatcher = dispatcher
+        self.__active_process = process
+        dispatcher(process)
+
+    def __save_state(self):
+
+        self.__aborted_state = (list(self.filters), list(self.filter_masks),
+                                self.super_index, self.line_offsets,
+                                self.line_levels, self.__range,)
+
     def add_filter(self, filter, dispatcher):
 
         if self.__active_process is not None:
@@ -322,11 +552,28 @@ class FilteredLogModel (FilteredLogModelBase):
 
         self.logger.debug("adding filter")
 
+        self.__save_state()
         self.filters.append(filter)
+        # Set to the mask by the filter process, if it can make one:
+        self.filter_masks.append(None)
 
-        self.__dispatcher = dispatcher
-        self.__active_process = self.__filter_process(filter)
-        dispatcher(self.__active_process)
+        self.__start_process(self.__filter_process(filter), dispatcher)
+
+    def remove_filter(self, filter, dispatcher):
+        """Remove a previously added filter.  If all remaining filters have a
+        mask, the process finishes on its first iteration."""
+
+        if self.__active_process is not None:
+            raise ValueError("dispatched a filter process already")
+
+        self.logger.debug("removing filter")
+
+        self.__save_state()
+        i = self.filters.index(filter)
+        del self.filters[i]
+        del self.filter_masks[i]
+
+        self.__start_process(self.__refilter_process(), dispatcher)
 
     def abort_process(self):
 
@@ -337,7 +584,10 @@ class FilteredLogModel (FilteredLogModelBase):
         self.__active_process = None
         self.__dispatcher = None
 
-        del self.filters[-1]
+        (self.filters[:], self.filter_masks[:], self.super_index,
+         self.line_offsets, self.line_levels,
+         self.__range,) = self.__aborted_state
+        self.__aborted_state = None
 
     def get_filter_progress(self):
 
@@ -349,6 +599,7 @@ class FilteredLogModel (FilteredLogModelBase):
     def __handle_filter_process_finished(self):
 
         self.__active_process = None
+        self.__aborted_state = None
         self.handle_process_finished()
 
     def handle_process_finished(self):
@@ -363,40 +614,149 @@ class FilteredLogModel (FilteredLogModelBase):
 
         return self.super_index[line_index]
 
-    def set_range(self, super_start, super_stop):
+    def handle_super_lines_appended(self, super_start, super_stop):
+        """Filter the lines that were appended to the super model, which have
+        the indices super_start to super_stop.  Returns the range of rows that
+        were appended to this model as a tuple (start, stop)."""
+
+        if self.__active_process is not None:
+            raise ValueError("cannot add lines while filtering")
+
+        start = len(self.super_index)
 
-        old_super_start = self.line_index_to_super(0)
-        old_super_stop = self.line_index_to_super(
-            len(self.super_index) - 1) + 1
+        if self.__range is not None:
+            # The new lines are outside of the range.
+            return (start, start,)
+
+        if not self.filters:
+            self.__set_identity_range()
+            return (start, len(self.super_index),)
+
+        if not isinstance(self.super_index, array):
+            # Restricting the range leaves SubRanges, which cannot grow:
+            self.__set_super_index(array("I", self.super_index))
+
+        funcs = [filter.filter_func for filter in self.filters]
+        masks = self.filter_masks
+        new_super_index = array("I")
+        rows = self.super_model.iter_rows_offset(
+            super_start, super_stop,
+            messages=self.__get_combined_filter().uses_message)
+        for i, (row, offset,) in enumerate(rows, super_start):
+            keep = True
+            for func, mask in zip(funcs, masks):
+                if mask is not None:
+                    # Masks must cover every line, not just the visible ones:
+                    value = bool(func(row))
+                    mask.append(value)
+                    keep = keep and value
+                elif keep:
+                    keep = func(row)
+            if keep:
+                new_super_index.append(i)
+
+        super_model = self.super_model
+        self.super_index.extend(new_super_index)
+        self.line_offsets.extend(map(super_model.line_offsets.__getitem__,
+                                     new_super_index))
+        self.line_levels.values.extend(
+            map(super_model.line_levels.values.__getitem__, new_super_index))
+
+        return (start, len(self.super_index),)
+
+    def set_range(self, super_start, super_stop, dispatcher):
+        """Show only the lines of the super model from super_start to
+        super_stop.  Only lines that come into view need to be filtered; if
+        there are none, or all filters have a mask, the process finishes on
+        its first iteration."""
+
+        if self.__active_process is not None:
+            raise ValueError("dispatched a filter process already")
+
+        old_super_start, old_super_stop = self.__get_range()
 
         self.logger.debug("set range (%i, %i), current (%i, %i)",
                           super_start, super_stop, old_super_start, old_super_stop)
 
+        self.__save_state()
+        if super_start == 0 and \
+                super_stop >= len(self.super_model.line_offsets):
+            # Showing all lines again; lines that get appended later must
+            # show up too:
+            self.__range = None
+        else:
+            self.__range = (super_start, super_stop,)
+
+        self.__start_process(
+            self.__range_process(old_super_start, old_super_stop), dispatcher)
+
+    def __range_process(self, old_super_start, old_super_stop):
+
+        super_start, super_stop = self.__get_range()
+
         if len(self.filters) == 0:
             # Identity.
-            self.super_index = xrange(super_start, super_stop)
-            self.line_offsets = SubRange(self.super_model.line_offsets,
-                                         super_start, super_stop)
-            self.line_levels = SubRange(self.super_model.line_levels,
-                                        super_start, super_stop)
-            return
-
-        if super_start < old_super_start:
-            # TODO:
-            raise NotImplementedError("Only handling further restriction of the range"
-                                      " (start offset = %i)" % (start_offset,))
+            self.__set_identity_range()
+        elif None not in self.filter_masks:
+            self.__apply_masks()
+        else:
+            overlap_start = max(super_start, old_super_start)
+            overlap_stop = min(super_stop, old_super_stop)
+            if overlap_start >= overlap_stop:
+                # None of the lines that are shown now stay in view:
+                overlap_start = overlap_stop = super_stop
+
+            start = self.line_index_from_super(overlap_start)
+            stop = self.line_index_from_super(overlap_stop)
+
+            if super_start >= old_super_start and \
+                    super_stop <= old_super_stop:
+                # Further restriction of the range.
+                self.super_index = SubRange(self.super_index, start, stop)
+                self.line_offsets = SubRange(self.line_offsets, start, stop)
+                self.line_levels = SubRange(self.line_levels, start, stop)
+            else:
+                # The range got wider; only the lines that come into view
+                # need to be filtered:
+                super_index = array("I")
+                progress_full = float(super_stop - super_start -
+                                      (overlap_stop - overlap_start))
+                n_lines = 0
+                for chunk_lines in self.__filter_super_range(
+                        super_start, overlap_start, super_index):
+                    n_lines += chunk_lines
+                    self.__filter_progress = n_lines / progress_full
+                    yield True
+                super_index.extend(self.super_index[start:stop])
+                for chunk_lines in self.__filter_super_range(
+                        overlap_stop, super_stop, super_index):
+                    n_lines += chunk_lines
+                    self.__filter_progress = n_lines / progress_full
+                    yield True
+                self.__set_super_index(super_index)
 
-        if super_stop > old_super_stop:
-            # TODO:
-            raise NotImplementedError("Only handling further restriction of the range"
-                                      " (end offset = %i)" % (stop_offset,))
+        self.__filter_progress = 1.
+        self.__handle_filter_process_finished()
+        yield False
 
-        start = self.line_index_from_super(super_start)
-        stop = self.line_index_from_super(super_stop)
+    def __filter_super_range(self, super_start, super_stop, super_index):
+        """Append the indices of the lines from super_start to super_stop that
+        pass all filters to super_index, a chunk at a time.  Generates the
+        number of lines of each chunk."""
 
-        self.super_index = SubRange(self.super_index, start, stop)
-        self.line_offsets = SubRange(self.line_offsets, start, stop)
-        self.line_levels = SubRange(self.line_levels, start, stop)
+        super_model = self.super_model
+        read_rows = self.read_rows
+        filter = self.__get_combined_filter()
+        func = filter.filter_func
+        messages = filter.uses_message
+
+        for start, stop in self.__iter_chunks(super_start, super_stop,
+                                              self._rows_chunk_lines):
+            rows = read_rows(super_model.line_offsets[start:stop],
+                             super_model.line_levels[start:stop], messages)
+            super_index.extend(i for i, row in enumerate(rows, start)
+                               if func(row))
+            yield stop - start
 
 
 class SubRange (object):
@@ -229,9 +229,12 @@ class Window (object):
         self.app = app
 
         self.dispatcher = None
+        self.fields_dispatcher = None
+        self.follow_dispatcher = None
         self.info_widget = None
         self.progress_dialog = None
         self.update_progress_id = None
+        self.follow_id = None
 
         self.window_state = Common.GUI.WindowState()
         self.column_manager = ViewColumnManager(app.state_section)
@@ -264,16 +267,24 @@ class Window (object):
              ("shrink-text", Gtk.STOCK_ZOOM_OUT, _(
               "Shrink Text"), "<Ctrl>minus"),
              ("reset-text", Gtk.STOCK_ZOOM_100, _("Normal Text Size"), "<Ctrl>0")])
+        group.add_toggle_actions(
+            [("follow-file", None, _("_Follow File"))])
         self.actions.add_group(group)
         self.actions.reload_file.props.sensitive = False
 
         group = Gtk.ActionGroup("RowActions")
         group.add_actions(
-            [("hide-before-line", None, _("Hide lines before this point")),
+            [("export-lines", Gtk.STOCK_SAVE_AS, _(
+              "_Export Shown Lines..."), "<Ctrl><Shift>S"),
+             ("hide-before-line", None, _("Hide lines before this point")),
              ("hide-after-line", None, _(
               "Hide lines after this point")),
              ("show-hidden-lines", None, _(
               "Show hidden lines")),
+             ("show-lines-outside-range", None, _(
+              "Show lines outside range")),
+             ("remove-last-filter", None, _(
+              "Undo last filter")),
              ("edit-copy-line", Gtk.STOCK_COPY, _(
               "Copy line"), "<Ctrl>C"),
              ("edit-copy-message", Gtk.STOCK_COPY, _(
@@ -320,6 +331,8 @@ class Window (object):
         self.log_view.set_search_column(-1)
         sel = self.log_view.get_selection()
         sel.connect("changed", self.handle_log_view_selection_changed)
+        self.log_view.props.vadjustment.connect(
+            "value-changed", self.handle_log_view_adjustment_value_changed)
 
         self.view_popup = ui.get_widget(
             "/ui/context/LogViewContextMenu").get_submenu()
@@ -397,6 +410,10 @@ class Window (object):
 
     def detach(self):
 
+        if self.follow_id is not None:
+            GObject.source_remove(self.follow_id)
+            self.follow_id = None
+
         self.set_log_file(None)
         for feature in self.features:
             feature.handle_detach_window(self)
@@ -527,6 +544,27 @@ class Window (object):
             tree_iter = model.get_iter(path)
             model.row_changed(path, tree_iter)
 
+    def handle_log_view_adjustment_value_changed(self, adjustment):
+
+        self.pin_visible_rows()
+
+    def pin_visible_rows(self):
+        """Keep the parsed rows that are in view in the row cache, while
+        background passes stream through the log."""
+
+        model = self.log_view.get_model()
+        if model is None or self.log_model is None:
+            return
+
+        visible_range = self.log_view.get_visible_range()
+        if visible_range is None:
+            return
+
+        start_path, end_path = visible_range
+        line_offsets = model.line_offsets
+        self.log_model.line_cache.pin(
+            [line_offsets[i] for i in xrange(start_path[0], end_path[0] + 1)])
+
     def handle_log_view_selection_changed(self, selection):
 
         try:
@@ -574,6 +612,152 @@ class Window (object):
 
         self.set_log_file(self.log_file.path)
 
+    @action
+    def handle_export_lines_action_activate(self, action):
+
+        dialog = Gtk.FileChooserDialog(None, self.gtk_window,
+                                       Gtk.FileChooserAction.SAVE,
+                                       (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                                        Gtk.STOCK_SAVE, Gtk.ResponseType.ACCEPT,))
+        dialog.props.do_overwrite_confirmation = True
+        response = dialog.run()
+        dialog.hide()
+        if response == Gtk.ResponseType.ACCEPT:
+            self.export_lines(dialog.get_filename())
+        dialog.destroy()
+
+    def export_lines(self, filename):
+        """Write the lines that pass the current filters to the given file,
+        in the background."""
+
+        try:
+            fileobj = open(filename, "wb")
+        except EnvironmentError as exc:
+            self.handle_environment_error(exc, filename)
+            return
+
+        line_export = Data.LineExport(self.log_file.fileobj,
+                                      self.log_filter.line_offsets)
+
+        dispatcher = Common.Data.GSourceDispatcher()
+
+        def handle_cancel():
+            dispatcher.cancel()
+            self.handle_export_finished(fileobj)
+
+        self.progress_dialog = ProgressDialog(self, _("Exporting lines"))
+        self.show_info(self.progress_dialog.widget)
+        self.progress_dialog.handle_cancel = handle_cancel
+        dispatcher(self.__export_process(line_export, fileobj))
+        self.update_progress_id = GObject.timeout_add(
+            250, self.update_export_progress, line_export)
+
+        self.set_sensitive(False)
+
+    def __export_process(self, line_export, fileobj):
+
+        try:
+            for x in line_export.process(fileobj):
+                yield True
+        except EnvironmentError as exc:
+            self.handle_export_finished(fileobj)
+            self.handle_environment_error(exc, fileobj.name)
+        else:
+            self.handle_export_finished(fileobj)
+
+        yield False
+
+    def update_export_progress(self, line_export):
+
+        if self.progress_dialog is None:
+            self.update_progress_id = None
+            return False
+
+        self.progress_dialog.update(line_export.get_progress())
+
+        return True
+
+    def handle_export_finished(self, fileobj):
+
+        fileobj.close()
+
+        self.hide_info()
+        self.progress_dialog = None
+        self.set_sensitive(True)
+
+    @action
+    def handle_follow_file_action_activate(self, action):
+
+        if action.props.active:
+            if self.follow_id is None:
+                self.follow_id = GObject.timeout_add(1000, self.update_follow)
+        elif self.follow_id is not None:
+            GObject.source_remove(self.follow_id)
+            self.follow_id = None
+
+    def update_follow(self):
+
+        if self.log_file is None or self.log_file.fields is None:
+            # Not loaded (yet).
+            return True
+
+        if self.progress_dialog is not None:
+            # Loading or filtering.
+            return True
+
+        if self.follow_dispatcher is not None:
+            # Still adding the lines that were appended before.
+            return True
+
+        self.follow_dispatcher = Common.Data.GSourceDispatcher()
+        self.follow_dispatcher(self.__follow_process())
+
+        return True
+
+    def __follow_process(self):
+
+        # The log file indexes the appended lines a chunk at a time, so that a
+        # fast growing file does not block the UI:
+        while self.progress_dialog is None:
+            start, stop = self.log_file.update()
+            if start == stop:
+                break
+            self.add_appended_lines(start, stop)
+            yield True
+
+        self.follow_dispatcher = None
+        yield False
+
+    def add_appended_lines(self, start, stop):
+
+        self.logger.debug("%i lines appended to log file", stop - start)
+
+        self.log_model.set_log(self.log_file)
+        if self.fields_dispatcher is not None:
+            # Continue parsing fields with the new mapping of the file:
+            self.fields_dispatcher.cancel()
+            self.fields_dispatcher(self.log_file.fields.process())
+
+        model = self.log_view.get_model()
+        visible_range = self.log_view.get_visible_range()
+        filter_start, filter_stop = self.log_filter.handle_super_lines_appended(
+            start, stop)
+
+        if model is self.log_filter:
+            for line_index in xrange(filter_start, filter_stop):
+                path = (line_index,)
+                tree_iter = model.get_iter(path)
+                model.row_inserted(path, tree_iter)
+
+            # Keep showing the end of the log if it was in view:
+            if (filter_stop > filter_start and visible_range is not None and
+                    visible_range[1][0] >= filter_start - 1):
+                self.log_view.scroll_to_cell((filter_stop - 1,), None,
+                                             False, 0., 0.)
+
+        for feature in self.features:
+            feature.handle_log_lines_appended(self, self.log_file, start, stop)
+
     @action
     def handle_cancel_load_action_activate(self, action):
 
@@ -632,13 +816,12 @@ class Window (object):
                 first_index,
                 last_index)
 
-        self.push_view_state()
         start_index = first_index
         stop_index = last_index + 1
-        self.log_filter.set_range(start_index, stop_index)
-        self.update_model()
-        self.pop_view_state()
+        self.start_filter_process(self.log_filter.set_range,
+                                  start_index, stop_index)
         self.actions.show_hidden_lines.props.sensitive = True
+        self.actions.show_lines_outside_range.props.sensitive = True
 
     def get_range(self):
 
@@ -666,6 +849,23 @@ class Window (object):
         self.update_model(self.log_filter)
         self.pop_view_state(scroll_to_selection=True)
         self.actions.show_hidden_lines.props.sensitive = False
+        self.actions.show_lines_outside_range.props.sensitive = False
+        self.actions.remove_last_filter.props.sensitive = False
+
+    @action
+    def handle_show_lines_outside_range_action_activate(self, action):
+
+        self.logger.info("restoring model range to show all lines")
+        # Only widens the range; the filters stay active:
+        self.start_filter_process(self.log_filter.set_range,
+                                  0, len(self.log_model.line_offsets))
+        self.actions.show_lines_outside_range.props.sensitive = False
+
+    @action
+    def handle_remove_last_filter_action_activate(self, action):
+
+        self.logger.info("removing last model filter")
+        self.remove_model_filter(self.log_filter.filters[-1])
 
     @action
     def handle_edit_copy_line_action_activate(self, action):
@@ -745,6 +945,14 @@ class Window (object):
 
     def add_model_filter(self, filter):
 
+        self.start_filter_process(self.log_filter.add_filter, filter)
+
+    def remove_model_filter(self, filter):
+
+        self.start_filter_process(self.log_filter.remove_filter, filter)
+
+    def start_filter_process(self, func, *args):
+
         self.progress_dialog = ProgressDialog(self, _("Filtering"))
         self.show_info(self.progress_dialog.widget)
         self.progress_dialog.handle_cancel = self.handle_filter_progress_dialog_cancel
@@ -755,7 +963,7 @@ class Window (object):
         # things down for nothing.
         self.push_view_state()
         self.log_view.set_model(None)
-        self.log_filter.add_filter(filter, dispatcher=dispatcher)
+        func(*args, dispatcher=dispatcher)
 
         GObject.timeout_add(250, self.update_filter_progress)
 
@@ -792,11 +1000,12 @@ class Window (object):
         self.hide_info()
         self.progress_dialog = None
 
-        # No push_view_state here, did this in add_model_filter.
+        # No push_view_state here, did this in start_filter_process.
         self.update_model(self.log_filter)
         self.pop_view_state()
 
-        self.actions.show_hidden_lines.props.sensitive = True
+        self.actions.remove_last_filter.props.sensitive = bool(
+            self.log_filter.filters)
 
         self.set_sensitive(True)
 
@@ -895,11 +1104,21 @@ class Window (object):
         renderer.props.text = strip_escape(self.log_file.readline().strip())
 
     def set_log_file(self, filename):
+        """Show the given log file.  filename may also be a list of several
+        files, which are then shown merged by timestamp."""
 
         if self.log_file is not None:
             for feature in self.features:
                 feature.handle_detach_log_file(self, self.log_file)
 
+        if self.fields_dispatcher is not None:
+            self.fields_dispatcher.cancel()
+            self.fields_dispatcher = None
+
+        if self.follow_dispatcher is not None:
+            self.follow_dispatcher.cancel()
+            self.follow_dispatcher = None
+
         if filename is None:
             if self.dispatcher is not None:
                 self.dispatcher.cancel()
@@ -909,17 +1128,27 @@ class Window (object):
         else:
             self.logger.debug("setting log file %r", filename)
 
+            if isinstance(filename, basestring):
+                filenames = [filename]
+            else:
+                filenames = list(filename)
+
             try:
                 self.setup_model(LazyLogModel())
 
                 self.dispatcher = Common.Data.GSourceDispatcher()
-                self.log_file = Data.LogFile(filename, self.dispatcher)
-            except EnvironmentError as exc:
-                try:
-                    file_size = os.path.getsize(filename)
-                except EnvironmentError:
-                    pass
+                if len(filenames) == 1:
+                    self.log_file = Data.LogFile(filenames[0],
+                                                 self.dispatcher)
                 else:
+                    self.log_file = Data.MergedLogFile(filenames,
+                                                       self.dispatcher)
+            except EnvironmentError as exc:
+                for name in filenames:
+                    try:
+                        file_size = os.path.getsize(name)
+                    except EnvironmentError:
+                        continue
                     if file_size == 0:
                         # Trying to mmap an empty file results in an invalid
                         # argument error.
@@ -929,7 +1158,8 @@ class Window (object):
                 self.handle_environment_error(exc, filename)
                 return
 
-            basename = os.path.basename(filename)
+            basename = ", ".join([os.path.basename(name)
+                                  for name in filenames])
             self.gtk_window.props.title = _(
                 "%s - GStreamer Debug Viewer") % (basename,)
 
@@ -972,6 +1202,15 @@ class Window (object):
 
         self.actions.cancel_load.activate()
 
+    def handle_fields_request(self):
+
+        self.logger.debug("parsing fields into the column store")
+
+        # Parse all fields in the background, so that filters and features
+        # don't need to parse lines:
+        self.fields_dispatcher = Common.Data.GSourceDispatcher()
+        self.fields_dispatcher(self.log_file.fields.process())
+
     def update_load_progress(self):
 
         if self.progress_dialog is None:
@@ -995,9 +1234,14 @@ class Window (object):
         self.log_model.set_log(self.log_file)
         self.log_filter.reset()
 
+        # The column store is built once a filter or feature asks for it:
+        self.log_file.fields.handle_request = self.handle_fields_request
+
         self.actions.reload_file.props.sensitive = True
         self.actions.groups["RowActions"].props.sensitive = True
         self.actions.show_hidden_lines.props.sensitive = False
+        self.actions.show_lines_outside_range.props.sensitive = False
+        self.actions.remove_last_filter.props.sensitive = False
 
         self.set_sensitive(True)
 
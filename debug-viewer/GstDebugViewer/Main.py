@@ -50,10 +50,23 @@ class OptionParser (Common.Main.LogOptionParser):
         options["args"] = []
 
         self.add_option("version", None, _("Display version and exit"))
+        self.add_option("export", "o",
+                        _("Write the lines kept by the filter options to "
+                          "FILE instead of showing them"), "FILE")
+        self.add_option("level", None,
+                        _("Export lines of LEVEL and more severe levels only"),
+                        "LEVEL")
+        self.add_option("category", None,
+                        _("Export lines of CATEGORY only"), "CATEGORY")
+        self.add_option("object", None,
+                        _("Export lines of OBJECT only"), "OBJECT")
+        self.add_option("match", None,
+                        _("Export lines with a message matching REGEX only"),
+                        "REGEX")
 
     def get_parameter_string(self):
 
-        return _("[FILENAME] - Display and analyze GStreamer debug log files")
+        return _("[FILENAME...] - Display and analyze GStreamer debug log files")
 
     def handle_parse_complete(self, remaining_args):
 
@@ -65,12 +78,39 @@ class OptionParser (Common.Main.LogOptionParser):
             main_version()
             sys.exit(0)
 
+        if "export" in self.options:
+            self.handle_export_options(remaining_args)
+
         if self.options["main"] is None:
             from GstDebugViewer import GUI
             self.options["main"] = GUI.main
 
         self.options["args"][:] = remaining_args
 
+    def handle_export_options(self, remaining_args):
+
+        import re
+        from GstDebugViewer import Data
+
+        if not remaining_args:
+            raise Common.Main.OptionError(_("No file to export from given"))
+
+        if "level" in self.options:
+            try:
+                self.options["level"] = Data.DebugLevel(self.options["level"])
+            except ValueError as exc:
+                raise Common.Main.OptionError(str(exc))
+
+        if "match" in self.options:
+            try:
+                re.compile(self.options["match"])
+            except re.error as exc:
+                raise Common.Main.OptionError(
+                    _("Invalid regular expression: %s") % (exc,))
+
+        from GstDebugViewer.GUI import export
+        self.options["main"] = export.main
+
 
 def main():
 
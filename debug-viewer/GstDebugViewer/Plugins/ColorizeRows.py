@@ -19,46 +19,295 @@
 
 """GStreamer Debug Viewer row colorization plugin."""
 
+import logging
+from array import array
+from itertools import imap
+from zlib import crc32
+
+from GstDebugViewer import Common, Data
+from GstDebugViewer.GUI.colors import LevelColorThemeTango, TangoPalette
 from GstDebugViewer.Plugins import FeatureBase, PluginBase
 
+from gettext import gettext as _
+from gi.repository import Gtk
 
-class ColorizeLevels (FeatureBase):
 
-    def attach(self, window):
+class RowColorSentinel (object):
 
-        pass
+    """Precomputes the colors of all lines of a log file in the background.
 
-    def detach(self, window):
+    colors is an array with one index into palette per line of the log
+    file.  palette holds (foreground, background) pairs of Gdk colors; its
+    first entry leaves rows uncolored.  Subclasses implement
+    get_color_indices, and can follow the progress of another process by
+    returning None until the lines are available.  The process stops then,
+    and has to be continued with resume."""
 
-        pass
+    _lines_per_iteration = 100000
 
+    def __init__(self):
 
-class LevelColorSentinel (object):
+        self.dispatcher = Common.Data.GSourceDispatcher()
+        self.log_file = None
+        self.colors = array("B")
+        self.palette = [(None, None,)]
 
-    def processor(self, proc):
+    def run_for(self, log_file):
 
-        for row in proc:
+        self.abort()
+        self.log_file = log_file
+        self.colors = array("B")
+        self.dispatcher(self.__process())
 
-            yield None
+    def resume(self):
+        """Compute the colors of lines that were appended to the log, or that
+        could not be computed before."""
 
+        if self.log_file is None:
+            return
 
-class ColorizeCategories (FeatureBase):
+        self.dispatcher.cancel()
+        self.dispatcher(self.__process())
 
-    def attach(self, window):
+    def abort(self):
 
-        pass
+        self.dispatcher.cancel()
+        self.log_file = None
 
-    def detach(self, window):
+    def get_color_indices(self, start, stop):
+        """Return the color indices of the given range of lines, or None if
+        they cannot be computed yet."""
 
-        pass
+        raise NotImplementedError("derived classes must override this method")
+
+    def is_complete(self):
+
+        return (self.log_file is not None and
+                len(self.colors) == len(self.log_file.line_cache.offsets))
+
+    def __process(self):
+
+        colors = self.colors
+        n_lines = len(self.log_file.line_cache.offsets)
 
+        while len(colors) < n_lines:
+            start = len(colors)
+            stop = min(start + self._lines_per_iteration, n_lines)
+            color_indices = self.get_color_indices(start, stop)
+            if color_indices is None:
+                break
+            colors.extend(color_indices)
+            self.handle_progress()
+            yield True
 
-class CategoryColorSentinel (object):
+        yield False
 
-    def processor(self):
+    def handle_progress(self):
 
         pass
 
+    def get_row_color_func(self):
+        """Return a row color function for
+        GUI.columns.ColumnManager.set_row_color_func.  It maps the rows of
+        filtered models to their lines in the log file."""
+
+        colors = self.colors
+        palette = self.palette
+        no_colors = palette[0]
+
+        def row_color_func(model, tree_iter):
+            line_index = model.line_index_to_super(
+                model.get_user_data(tree_iter))
+            try:
+                return palette[colors[line_index]]
+            except IndexError:
+                # Not computed yet.
+                return no_colors
+
+        return row_color_func
+
+
+class LevelColorSentinel (RowColorSentinel):
+
+    """Colors lines by their debug level.  The palette is indexed by level
+    value, so the colors are the level values of the line cache."""
+
+    def __init__(self):
+
+        RowColorSentinel.__init__(self)
+
+        theme = LevelColorThemeTango()
+        self.palette = [(None, None,)]
+        for level in sorted(Data.debug_levels)[1:]:
+            foreground, background = theme.colors[level][:2]
+            self.palette.append((foreground.gdk_color(),
+                                 background.gdk_color(),))
+
+    def get_color_indices(self, start, stop):
+
+        return self.log_file.line_cache.levels.values[start:stop]
+
+
+class CategoryColorSentinel (RowColorSentinel):
+
+    """Colors lines by their category.  Categories get a palette entry by a
+    hash of their name, so a category has the same color in every log.  The
+    category ids are taken from the Data.LineFields column store, so this
+    is resumed from its progress_handlers."""
+
+    def __init__(self):
+
+        RowColorSentinel.__init__(self)
+
+        t = TangoPalette.get()
+        self.palette = [(None, None,)]
+        for background in (t.butter1, t.chameleon1, t.orange1, t.skyblue1,
+                           t.plum1, t.chocolate1, t.aluminium2,
+                           t.scarletred1,):
+            self.palette.append((t.black.gdk_color(),
+                                 background.gdk_color(),))
+
+        # Color index by category string id:
+        self.category_colors = array("B")
+
+    def run_for(self, log_file):
+
+        self.category_colors = array("B")
+        RowColorSentinel.run_for(self, log_file)
+        log_file.fields.progress_handlers.append(self.resume)
+        log_file.fields.request()
+
+    def abort(self):
+
+        if self.log_file is not None:
+            self.log_file.fields.progress_handlers.remove(self.resume)
+        RowColorSentinel.abort(self)
+
+    def get_color_indices(self, start, stop):
+
+        fields = self.log_file.fields
+        if len(fields) < stop:
+            return None
+
+        col_id = 4  # COL_CATEGORY
+        n_colors = len(self.palette) - 1
+        category_colors = self.category_colors
+        for category in fields.strings[col_id][len(category_colors):]:
+            if category:
+                category_colors.append(
+                    1 + (crc32(category) & 0xffffffff) % n_colors)
+            else:
+                category_colors.append(0)
+
+        return array("B", imap(category_colors.__getitem__,
+                               fields.take(col_id, xrange(start, stop))))
+
+
+class ColorizeRowsFeature (FeatureBase):
+
+    """Base class for the features that color the rows of the log view
+    using a RowColorSentinel."""
+
+    action_name = None
+    action_label = None
+    sentinel_class = None
+
+    def __init__(self, *a, **kw):
+
+        self.logger = logging.getLogger("ui.colorizerows")
+
+        self.action_group = Gtk.ActionGroup(
+            "%sActions" % (type(self).__name__,))
+        self.action_group.add_toggle_actions(
+            [(self.action_name, None, self.action_label,)])
+
+        self.window = None
+        self.merge_id = None
+        self.row_color_func = None
+
+        self.sentinel = self.sentinel_class()
+        self.sentinel.handle_progress = self.handle_sentinel_progress
+
+    def handle_attach_window(self, window):
+
+        self.window = window
+
+        ui = window.ui_manager
+        ui.insert_action_group(self.action_group, 0)
+
+        self.merge_id = ui.new_merge_id()
+        ui.add_ui(self.merge_id, "/menubar/ViewMenu/ViewMenuAdditions",
+                  self.action_name, self.action_name,
+                  Gtk.UIManagerItemType.MENUITEM, False)
+
+        action = self.action_group.get_action(self.action_name)
+        action.connect("toggled", self.handle_action_toggled)
+
+    def handle_detach_window(self, window):
+
+        self.sentinel.abort()
+        self.set_colored(False)
+
+        window.ui_manager.remove_ui(self.merge_id)
+        self.merge_id = None
+        self.window = None
+
+    def handle_attach_log_file(self, window, log_file):
+
+        action = self.action_group.get_action(self.action_name)
+        if action.props.active and log_file.fields is not None:
+            self.sentinel.run_for(log_file)
+            self.set_colored(True)
+
+    def handle_detach_log_file(self, window, log_file):
+
+        self.sentinel.abort()
+        self.set_colored(False)
+
+    def handle_log_lines_appended(self, window, log_file, start, stop):
+
+        self.sentinel.resume()
+
+    def handle_action_toggled(self, action):
+
+        log_file = self.window.log_file
+        if not action.props.active:
+            self.sentinel.abort()
+            self.set_colored(False)
+        elif log_file is not None and log_file.fields is not None:
+            self.sentinel.run_for(log_file)
+            self.set_colored(True)
+
+    def handle_sentinel_progress(self):
+
+        self.window.log_view.queue_draw()
+
+    def set_colored(self, colored):
+
+        column_manager = self.window.column_manager
+        if colored:
+            self.row_color_func = self.sentinel.get_row_color_func()
+            column_manager.set_row_color_func(self.row_color_func)
+        elif self.row_color_func is not None:
+            # Another feature might have taken over coloring:
+            if column_manager.row_color_func is self.row_color_func:
+                column_manager.set_row_color_func(None)
+            self.row_color_func = None
+
+
+class ColorizeLevels (ColorizeRowsFeature):
+
+    action_name = "colorize-levels"
+    action_label = _("Color Rows by _Level")
+    sentinel_class = LevelColorSentinel
+
+
+class ColorizeCategories (ColorizeRowsFeature):
+
+    action_name = "colorize-categories"
+    action_label = _("Color Rows by _Category")
+    sentinel_class = CategoryColorSentinel
+
 
 class Plugin (PluginBase):
 
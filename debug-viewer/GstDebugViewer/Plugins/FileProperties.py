@@ -20,39 +20,202 @@
 """GStreamer Debug Viewer file properties plugin."""
 
 import logging
+import os.path
 
+from GstDebugViewer import Common, Data
 from GstDebugViewer.Plugins import FeatureBase, PluginBase
 
 from gettext import gettext as _
+from gi.repository import GObject
 from gi.repository import Gtk
 
 
 class FilePropertiesSentinel (object):
 
-    pass
+    """Computes the Data.LogStatistics of a log file in the background, as
+    the fields of its lines are parsed.  handle_statistics_complete is called
+    when all lines are counted."""
+
+    def __init__(self):
+
+        self.dispatcher = Common.Data.GSourceDispatcher()
+        self.statistics = None
+
+    def run_for(self, log_file):
+        """Start counting the lines of log_file, using the statistics cached
+        alongside its line index if possible."""
+
+        self.abort()
+        self.statistics = Data.LogStatistics(log_file.fields,
+                                             log_file.line_cache.index)
+        log_file.fields.progress_handlers.append(self.resume)
+        log_file.fields.request()
+        self.dispatcher(self.__process())
+
+    def resume(self):
+        """Count the lines that were parsed since the last run."""
+
+        if self.statistics is None:
+            return
+
+        self.dispatcher.cancel()
+        self.dispatcher(self.__process())
+
+    def abort(self):
+
+        self.dispatcher.cancel()
+        if self.statistics is not None:
+            self.statistics.fields.progress_handlers.remove(self.resume)
+        self.statistics = None
+
+    def __process(self):
+
+        for x in self.statistics.process():
+            if not x:
+                break
+            yield True
+
+        if self.statistics.is_complete():
+            self.handle_statistics_complete()
+        yield False
+
+    def handle_statistics_complete(self):
+
+        pass
 
 
 class FilePropertiesDialog (Gtk.Dialog):
 
-    pass
+    """Shows the size of a log file and its statistics."""
+
+    # Number of call sites to list:
+    n_call_sites = 20
+
+    def __init__(self, parent):
+
+        Gtk.Dialog.__init__(self, title=_("Properties"), transient_for=parent)
+
+        self.add_button(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
+        self.set_default_size(520, 480)
+
+        box = self.get_content_area()
+        self.summary_label = Gtk.Label()
+        self.summary_label.props.xalign = 0.
+        self.summary_label.props.selectable = True
+        box.pack_start(self.summary_label, False, False, 6)
+
+        self.notebook = Gtk.Notebook()
+        box.pack_start(self.notebook, True, True, 0)
+
+        self.stores = {}
+        for name, label, headers in (
+                ("levels", _("Levels"), (_("Level"),),),
+                ("categories", _("Categories"), (_("Category"),),),
+                ("threads", _("Threads"), (_("Thread"),),),
+                ("objects", _("Objects"), (_("Object"),),),
+                ("filenames", _("Source Files"), (_("Filename"),),),
+                ("call_sites", _("Call Sites"), (_("Filename"), _("Line"),
+                                                 _("Function"),),),
+                ("rate", _("Lines per Second"), (_("Time"),),)):
+            self.stores[name] = self.__add_page(label, headers)
+
+        box.show_all()
+
+    def __add_page(self, label, headers):
+
+        store = Gtk.ListStore(*([str] * len(headers) + [int]))
+        view = Gtk.TreeView(model=store)
+        for col_id, header in enumerate(headers + (_("Lines"),)):
+            renderer = Gtk.CellRendererText()
+            column = Gtk.TreeViewColumn(header, renderer, text=col_id)
+            column.props.resizable = True
+            column.set_sort_column_id(col_id)
+            view.append_column(column)
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_policy(Gtk.PolicyType.AUTOMATIC,
+                            Gtk.PolicyType.AUTOMATIC)
+        scrolled.add(view)
+        self.notebook.append_page(scrolled, Gtk.Label(label=label))
+
+        return store
+
+    def __fill(self, name, rows):
+
+        store = self.stores[name]
+        store.clear()
+        for row in rows:
+            store.append(row)
+
+    def update(self, log_file, statistics):
+        """Show the properties of log_file.  statistics may be incomplete
+        (or None) while they are computed."""
+
+        paths = log_file.path
+        if isinstance(paths, basestring):
+            paths = [paths]
+        size = sum(os.path.getsize(path) for path in paths)
+
+        summary = [", ".join(paths),
+                   _("%i bytes, %i lines") % (size,
+                                              len(log_file.line_cache.offsets),)]
+        if statistics is None or not statistics.is_complete():
+            progress = 0. if statistics is None else statistics.get_progress()
+            summary.append(_("Computing statistics (%i%%)")
+                           % (progress * 100,))
+        self.summary_label.props.label = "\n".join(summary)
+
+        if statistics is None:
+            return
+
+        for name, field, format_value in (
+                ("levels", 3, lambda level: level.name,),
+                ("categories", 4, str,),
+                ("threads", 2, lambda thread: "0x%x" % (thread,),),
+                ("objects", 8, str,),
+                ("filenames", 5, str,)):
+            self.__fill(name, ((format_value(value), n,)
+                               for value, n in statistics.get_counts(field)))
+
+        self.__fill("call_sites",
+                    ((filename, str(line), function, n,)
+                     for (filename, line, function,), n
+                     in statistics.get_top_call_sites(self.n_call_sites)))
+        self.__fill("rate",
+                    ((Data.time_args(second * 1000000000), n,)
+                     for second, n in sorted(statistics.rate.iteritems())))
 
 
 class FilePropertiesFeature (FeatureBase):
 
     def __init__(self, *a, **kw):
 
+        self.logger = logging.getLogger("ui.fileproperties")
+
         self.action_group = Gtk.ActionGroup("FilePropertiesActions")
         self.action_group.add_actions(
             [("show-file-properties", Gtk.STOCK_PROPERTIES,
               _("_Properties"), "<Ctrl>P")])
+        self.action_group.props.sensitive = False
 
-    def attach(self, window):
+        self.window = None
+        self.log_file = None
+        self.merge_id = None
+        self.dialog = None
+        self.update_id = None
+
+        self.sentinel = FilePropertiesSentinel()
+        self.sentinel.handle_statistics_complete = self.handle_statistics_complete
+
+    def handle_attach_window(self, window):
+
+        self.window = window
 
         ui = window.ui_manager
         ui.insert_action_group(self.action_group, 0)
 
         self.merge_id = ui.new_merge_id()
-        ui.add_ui(self.merge_id, "/menubar/FileMenu/FileMenuAdditions",
+        ui.add_ui(self.merge_id, "/menubar/AppMenu/AppMenuAdditions",
                   "FileProperties", "show-file-properties",
                   Gtk.UIManagerItemType.MENUITEM, False)
 
@@ -60,9 +223,80 @@ class FilePropertiesFeature (FeatureBase):
         self.action_group.get_action(
             "show-file-properties").connect("activate", handler)
 
+    def handle_detach_window(self, window):
+
+        self.sentinel.abort()
+        self.close_dialog()
+
+        window.ui_manager.remove_ui(self.merge_id)
+        self.merge_id = None
+        self.window = None
+
+    def handle_attach_log_file(self, window, log_file):
+
+        self.log_file = log_file
+        self.action_group.props.sensitive = True
+
+    def handle_detach_log_file(self, window, log_file):
+
+        self.sentinel.abort()
+        self.close_dialog()
+        self.log_file = None
+        self.action_group.props.sensitive = False
+
+    def handle_log_lines_appended(self, window, log_file, start, stop):
+
+        self.sentinel.resume()
+
+    def handle_statistics_complete(self):
+
+        self.logger.debug("statistics complete")
+        self.update_dialog()
+
     def handle_action_activate(self, action):
 
-        pass
+        if self.log_file is None:
+            return
+
+        if self.sentinel.statistics is None:
+            # The statistics are only computed once they are shown:
+            self.sentinel.run_for(self.log_file)
+
+        if self.dialog is None:
+            self.dialog = FilePropertiesDialog(self.window.gtk_window)
+            self.dialog.connect("response", self.handle_dialog_response)
+            self.update_id = GObject.timeout_add(500, self.update_dialog)
+        self.update_dialog()
+        self.dialog.present()
+
+    def handle_dialog_response(self, dialog, response):
+
+        self.close_dialog()
+
+    def update_dialog(self):
+
+        if self.dialog is None:
+            self.update_id = None
+            return False
+
+        statistics = self.sentinel.statistics
+        self.dialog.update(self.log_file, statistics)
+
+        if statistics is not None and statistics.is_complete():
+            self.update_id = None
+            return False
+
+        return True
+
+    def close_dialog(self):
+
+        if self.update_id is not None:
+            GObject.source_remove(self.update_id)
+            self.update_id = None
+
+        if self.dialog is not None:
+            self.dialog.destroy()
+            self.dialog = None
 
 
 class Plugin (PluginBase):
@@ -20,6 +20,10 @@
 """GStreamer Debug Viewer timeline widget plugin."""
 
 import logging
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress, imap
 
 from GstDebugViewer import Common, Data, GUI
 from GstDebugViewer.Plugins import FeatureBase, PluginBase, _N
@@ -31,104 +35,211 @@ from gi.repository import Gtk
 
 class SearchOperation (object):
 
-    def __init__(self, model, search_text, search_forward=True, start_position=None):
+    """Search for the lines of model whose message matches search_text.
+    model is the unfiltered log model, so that the matches stay valid when
+    the filters change.
+
+    mode is one of literal, regex, any_term and all_terms; the term modes
+    split search_text at whitespace.  The search text is compiled once, and
+    the same regular expression gives the highlighted ranges in match_func.
+    Raises re.error for an invalid regular expression.
+
+    The matches are collected in matches, a sorted array of line indices, by
+    SearchSentinel.  If a complete Data.MessageIndex is given, only the lines
+    it gives as candidates and the lines added to the model later are
+    checked."""
+
+    literal, regex, any_term, all_terms = range(4)
+
+    def __init__(self, model, search_text, mode=literal, case_sensitive=True,
+                 index=None):
 
         self.model = model
         self.search_text = search_text
-        self.search_forward = search_forward
-        self.start_position = start_position
+        self.mode = mode
+        self.case_sensitive = case_sensitive
 
-        col_id = GUI.models.LogModelBase.COL_MESSAGE
-        len_search_text = len(search_text)
+        if case_sensitive:
+            flags = 0
+        else:
+            flags = re.IGNORECASE
 
-        def match_func(model_row):
+        if mode == self.regex:
+            patterns = [search_text]
+        elif mode == self.literal:
+            patterns = [re.escape(search_text)]
+        else:
+            patterns = [re.escape(term) for term in search_text.split()]
 
-            message = model_row[col_id]
-            if search_text in message:
-                ranges = []
-                start = 0
-                while True:
-                    pos = message.find(search_text, start)
-                    if pos == -1:
-                        break
-                    ranges.append((pos, pos + len_search_text,))
-                    start = pos + len_search_text
-                return ranges
-            else:
+        if len(patterns) == 1:
+            regex = re.compile(patterns[0], flags)
+        else:
+            regex = re.compile("|".join("(?:%s)" % (pattern,)
+                                        for pattern in patterns), flags)
+
+        if mode == self.all_terms and len(patterns) > 1:
+            term_searches = [re.compile(pattern, flags).search
+                             for pattern in patterns]
+
+            def message_match_func(message):
+                for search in term_searches:
+                    if search(message) is None:
+                        return False
+                return True
+        else:
+            message_match_func = regex.search
+
+        self.message_match_func = message_match_func
+
+        finditer = regex.finditer
+
+        def match_func(message):
+
+            if not message_match_func(message):
                 return ()
+            return [match.span() for match in finditer(message)
+                    if match.end() > match.start()]
 
         self.match_func = match_func
 
+        self.candidates = self.__get_candidates(index, flags)
+        self.n_candidate_lines = len(model.line_offsets)
+
+        self.matches = array("I")
+        # Lines below this index have been checked:
+        self.n_lines_searched = 0
+
+    def __get_candidates(self, index, flags):
+
+        if index is None or not index.is_complete():
+            return None
+
+        if self.mode == self.regex:
+            return index.get_regex_candidates(self.search_text, flags)
+        elif self.mode == self.literal:
+            return index.get_candidates([self.search_text])
+
+        terms = self.search_text.split()
+        if self.mode == self.all_terms:
+            return index.get_candidates(terms)
+
+        # Any term: the union of the candidates for each term.
+        candidates = set()
+        for term in terms:
+            term_candidates = index.get_candidates([term])
+            if term_candidates is None:
+                return None
+            candidates.update(term_candidates)
+        return array("I", sorted(candidates))
+
+    def is_complete(self):
+
+        return self.n_lines_searched == len(self.model.line_offsets)
+
+
+def map_lines_to_rows(model, line_indices, rows=None):
+    """Append the row indices of model that show the lines of the super model
+    from the sorted sequence line_indices to the array rows, and return it.
+    Lines that the model filters out are skipped."""
+
+    if rows is None:
+        rows = array("I")
+
+    if not isinstance(model, GUI.models.FilteredLogModelBase):
+        rows.extend(line_indices)
+        return rows
+
+    to_super = model.line_index_to_super
+    from_super = model.line_index_from_super
+    n_rows = len(model)
+    for line_index in line_indices:
+        row = from_super(line_index)
+        if row < n_rows and to_super(row) == line_index:
+            rows.append(row)
+
+    return rows
+
 
 class SearchSentinel (object):
 
+    _lines_per_iteration = 5000
+
     def __init__(self):
 
         self.dispatcher = Common.Data.GSourceDispatcher()
         self.cancelled = False
 
     def run_for(self, operation):
+        """Search the lines of the operation's model that were not searched
+        yet."""
 
         self.dispatcher.cancel()
-        self.dispatcher(self.__process(operation))
         self.cancelled = False
+        self.dispatcher(self.__process(operation))
 
     def abort(self):
 
         self.dispatcher.cancel()
         self.cancelled = True
 
-    def __process(self, operation):
+    def __iter_batches(self, operation):
 
-        model = operation.model
+        batch_size = self._lines_per_iteration
+        n_lines = len(operation.model.line_offsets)
+        start = operation.n_lines_searched
 
-        if operation.start_position is not None:
-            start_pos = operation.start_position
-        elif operation.search_forward:
-            start_pos = 0
-        else:
-            start_pos = len(model) - 1
+        candidates = operation.candidates
+        if candidates is not None:
+            stop = min(operation.n_candidate_lines, n_lines)
+            i = bisect_left(candidates, start)
+            while i < len(candidates) and candidates[i] < stop:
+                batch = candidates[i:i + batch_size]
+                i += len(batch)
+                yield (batch, batch[-1] + 1,)
+            start = max(start, stop)
 
-        start_iter = model.iter_nth_child(None, start_pos)
+        for batch_start in xrange(start, n_lines, batch_size):
+            batch_stop = min(batch_start + batch_size, n_lines)
+            yield (xrange(batch_start, batch_stop), batch_stop,)
 
-        match_func = operation.match_func
-        if operation.search_forward:
-            iter_next = model.iter_next
-        else:
-            # FIXME: This is really ugly.
-            nth_child = model.iter_nth_child
-
-            def iter_next_():
-                for i in xrange(start_pos, -1, -1):
-                    yield nth_child(None, i)
-                yield None
-            it_ = iter_next_()
-
-            def iter_next(it):
-                return it_.next()
-
-        YIELD_LIMIT = 1000
-        i = YIELD_LIMIT
-        tree_iter = start_iter
-        while tree_iter and not self.cancelled:
-            i -= 1
-            if i == 0:
-                yield True
-                i = YIELD_LIMIT
-            row = model[tree_iter]
-            if match_func(row):
-                self.handle_match_found(model, tree_iter)
-            tree_iter = iter_next(tree_iter)
+        if operation.n_lines_searched < n_lines:
+            yield ((), n_lines,)
+
+    def __process(self, operation):
+
+        model = operation.model
+        fields = model.line_fields
+        is_match = operation.message_match_func
+        matches = operation.matches
+
+        col_id = model.COL_MESSAGE
+        get_value = model.get_value
+        nth_child = model.iter_nth_child
+
+        for batch, batch_stop in self.__iter_batches(operation):
+            if self.cancelled:
+                break
+            if fields is not None and fields.is_complete():
+                # Read straight from the log file mapping:
+                messages = fields.get_messages(batch)
+            else:
+                # Slow path until the column store is complete.
+                messages = [get_value(nth_child(None, line_index), col_id)
+                            for line_index in batch]
+            matches.extend(compress(batch, imap(is_match, messages)))
+            operation.n_lines_searched = batch_stop
+            self.handle_search_progress(operation)
+            yield True
 
         if not self.cancelled:
-            self.handle_search_complete()
+            self.handle_search_complete(operation)
         yield False
 
-    def handle_match_found(self, model, tree_iter):
+    def handle_search_progress(self, operation):
 
         pass
 
-    def handle_search_complete(self):
+    def handle_search_complete(self, operation):
 
         pass
 
@@ -136,7 +247,16 @@ class SearchSentinel (object):
 class FindBarWidget (Gtk.HBox):
 
     __status = {"no-match-found": _N("No match found"),
-                "searching": _N("Searching...")}
+                "searching": _N("Searching..."),
+                "match-position": _N("%(position)i of %(count)i"),
+                "match-count": _N("%(count)i matches"),
+                "invalid-pattern": _N("Invalid regular expression")}
+
+    # Search modes in the order of the mode combo box entries:
+    modes = ((SearchOperation.literal, _N("Text"),),
+             (SearchOperation.regex, _N("Regular expression"),),
+             (SearchOperation.any_term, _N("Any word"),),
+             (SearchOperation.all_terms, _N("All words"),),)
 
     def __init__(self, action_group):
 
@@ -148,6 +268,16 @@ class FindBarWidget (Gtk.HBox):
         self.entry = Gtk.Entry()
         self.pack_start(self.entry, True, True, 0)
 
+        self.mode_combo = Gtk.ComboBoxText()
+        for mode, name in self.modes:
+            self.mode_combo.append_text(_(name))
+        self.mode_combo.props.active = 0
+        self.pack_start(self.mode_combo, False, False, 0)
+
+        self.case_check = Gtk.CheckButton(label=_("Match case"))
+        self.case_check.props.active = True
+        self.pack_start(self.case_check, False, False, 2)
+
         prev_action = action_group.get_action("goto-previous-search-result")
         prev_button = Gtk.Button()
         prev_button.set_related_action(prev_action)
@@ -175,7 +305,8 @@ class FindBarWidget (Gtk.HBox):
         max_width = 0
         try:
             for status in self.__status.values():
-                self.__set_status(_(status))
+                self.__set_status(_(status) % {"position": 999999,
+                                               "count": 999999})
                 req = label.size_request()
                 max_width = max(max_width, req.width)
             label.set_size_request(max_width, -1)
@@ -200,6 +331,27 @@ class FindBarWidget (Gtk.HBox):
 
         self.__set_status(_(self.__status["searching"]))
 
+    def get_mode(self):
+
+        return self.modes[self.mode_combo.props.active][0]
+
+    def get_case_sensitive(self):
+
+        return self.case_check.props.active
+
+    def status_invalid_pattern(self):
+
+        self.__set_status(_(self.__status["invalid-pattern"]))
+
+    def status_match_position(self, position, count):
+
+        self.__set_status(_(self.__status["match-position"]) %
+                          {"position": position, "count": count})
+
+    def status_match_count(self, count):
+
+        self.__set_status(_(self.__status["match-count"]) % {"count": count})
+
     def clear_status(self):
 
         self.__set_status("")
@@ -227,13 +379,18 @@ class FindBarFeature (FeatureBase):
 
         self.bar = None
         self.operation = None
-        self.search_state = None
-        self.next_match = None
-        self.prev_match = None
+        self.index = None
+        self.index_dispatcher = Common.Data.GSourceDispatcher()
+        # Super model line index of the match that was navigated to last:
+        self.current_match = None
         self.scroll_match = False
+        # Rows of the view model that show a match, see get_match_rows:
+        self.match_rows = array("I")
+        self.match_rows_state = None
+        self.n_matches_mapped = 0
 
         self.sentinel = SearchSentinel()
-        self.sentinel.handle_match_found = self.handle_match_found
+        self.sentinel.handle_search_progress = self.handle_search_progress
         self.sentinel.handle_search_complete = self.handle_search_complete
 
     def scroll_view_to_line(self, line_index):
@@ -290,9 +447,44 @@ class FindBarFeature (FeatureBase):
         action.connect("activate", handler)
 
         self.bar.entry.connect("changed", self.handle_entry_changed)
+        self.bar.mode_combo.connect("changed", self.handle_entry_changed)
+        self.bar.case_check.connect("toggled", self.handle_entry_changed)
+
+    def handle_attach_log_file(self, window, log_file):
+
+        self.index = Data.MessageIndex(log_file.fields)
+        log_file.fields.progress_handlers.append(self.handle_fields_progress)
+        self.index_dispatcher(self.index.process())
+
+    def handle_detach_log_file(self, window, log_file):
+
+        log_file.fields.progress_handlers.remove(self.handle_fields_progress)
+        self.index_dispatcher.cancel()
+        self.index = None
+        self.sentinel.abort()
+        self.operation = None
+        self.clear_matches()
+
+    def handle_log_lines_appended(self, window, log_file, start, stop):
+
+        if self.index is None:
+            return
+
+        # The new lines are indexed from handle_fields_progress once their
+        # fields are parsed.
+        if self.operation is not None:
+            # Continues with the lines that were not searched yet:
+            self.sentinel.run_for(self.operation)
+
+    def handle_fields_progress(self):
+
+        # Index the lines that were parsed by now:
+        self.index_dispatcher(self.index.process())
 
     def handle_detach_window(self, window):
 
+        self.index_dispatcher.cancel()
+        self.sentinel.abort()
         self.window = None
 
         window.ui_manager.remove_ui(self.merge_id)
@@ -311,182 +503,239 @@ class FindBarFeature (FeatureBase):
                 del column.highlighters[self]
             except KeyError:
                 pass
+            self.sentinel.abort()
+            self.operation = None
+            self.clear_matches()
             self.bar.clear_status()
             self.bar.hide()
-            for action_name in ["goto-next-search-result",
-                                "goto-previous-search-result"]:
-                self.action_group.get_action(
-                    action_name).props.sensitive = False
+            self.update_sensitivity()
 
     def handle_goto_previous_search_result_action_activate(self, action):
 
-        if self.prev_match is None:
-            self.logger.warning("inconsistent action sensitivity")
-            return
-
-        self.scroll_view_to_line(self.prev_match)
-        self.prev_match = None
-
-        start_path = self.log_view.get_visible_range()[0]
-        new_position = start_path[0] - 1
-        self.start_search_operation(start_position=new_position,
-                                    forward=False)
-
-        # FIXME
+        self.goto_match(forward=False)
 
     def handle_goto_next_search_result_action_activate(self, action):
 
-        if self.next_match is None:
-            self.logger.warning("inconsistent action sensitivity")
-            return
-
-        self.scroll_view_to_line(self.next_match)
-        self.next_match = None
-
-        end_path = self.log_view.get_visible_range()[1]
-        new_position = end_path[0] + 1
-        self.start_search_operation(start_position=new_position,
-                                    forward=True)
-        # FIXME: Finish.
+        self.goto_match(forward=True)
 
-        # model = self.log_view.get_model ()
-
-        # start_path, end_path = self.log_view.get_visible_range ()
-        # start_index, end_index = start_path[0], end_path[0]
-
-        # for line_index in self.matches:
-        # if line_index > end_index:
-        # break
-        # else:
-        # return
-
-        # self.scroll_view_to_line (line_index)
-
-    def handle_entry_changed(self, entry):
+    def handle_entry_changed(self, widget):
 
         self.update_search()
 
     def update_search(self):
 
-        model = self.log_view.get_model()
         search_text = self.bar.entry.props.text
         column = self.window.column_manager.find_item(name="message")
+
+        self.sentinel.abort()
+        self.clear_matches()
+
         if search_text == "":
             self.logger.debug("search string set to '', aborting search")
-            self.search_state = None
-            self.next_match = None
-            self.prev_match = None
-            self.update_sensitivity()
-            self.sentinel.abort()
+            self.operation = None
+            self.bar.clear_status()
             try:
                 del column.highlighters[self]
             except KeyError:
                 pass
         else:
             self.logger.debug("starting search for %r", search_text)
-            self.next_match = None
-            self.prev_match = None
-            self.update_sensitivity()
+            if self.index is not None:
+                # Build the message index for the searches that follow:
+                self.index.fields.request()
+            try:
+                self.operation = SearchOperation(
+                    self.window.log_model, search_text,
+                    mode=self.bar.get_mode(),
+                    case_sensitive=self.bar.get_case_sensitive(),
+                    index=self.index)
+            except re.error as exc:
+                self.logger.debug("invalid search pattern: %s", exc)
+                self.operation = None
+                self.bar.status_invalid_pattern()
+                try:
+                    del column.highlighters[self]
+                except KeyError:
+                    pass
+                self.update_sensitivity()
+                self.window.update_view()
+                return
+            if self.operation.candidates is not None:
+                self.logger.debug("index gives %i candidate lines",
+                                  len(self.operation.candidates))
             self.scroll_match = True
-
-            start_path = self.log_view.get_visible_range()[0]
-            self.start_search_operation(
-                search_text, start_position=start_path[0])
             self.bar.status_searching()
             column.highlighters[self] = self.operation.match_func
+            self.sentinel.run_for(self.operation)
 
+        self.update_sensitivity()
         self.window.update_view()
 
-    def update_sensitivity(self):
+    def clear_matches(self):
 
-        for name, value in (("goto-next-search-result", self.next_match,),
-                            ("goto-previous-search-result", self.prev_match,),):
-            action = self.action_group.get_action(name)
-            action.props.sensitive = (value is not None)
+        self.current_match = None
+        self.scroll_match = False
+        self.match_rows = array("I")
+        self.match_rows_state = None
+        self.n_matches_mapped = 0
 
-    def start_search_operation(self, search_text=None, forward=True, start_position=None):
+    def get_match_rows(self):
+        """Return a sorted array of the rows of the view model that show a
+        match.  The matches are kept as line indices of the unfiltered model,
+        and mapped again only after the filtering changed."""
 
         model = self.log_view.get_model()
+        if self.operation is None or model is None:
+            return array("I")
+
+        super_index = getattr(model, "super_index", None)
+        state = self.match_rows_state
+        if (state is None or state[0] is not model or
+                state[1] is not super_index or state[2] != len(model)):
+            self.match_rows = array("I")
+            self.n_matches_mapped = 0
+            self.match_rows_state = (model, super_index, len(model),)
+
+        matches = self.operation.matches
+        if self.n_matches_mapped < len(matches):
+            map_lines_to_rows(model, matches[self.n_matches_mapped:],
+                              self.match_rows)
+            self.n_matches_mapped = len(matches)
 
-        if forward:
-            self.search_state = "search-forward"
-            if start_position is None:
-                start_position = 0
+        return self.match_rows
+
+    def get_match_position(self, rows):
+        """Return the position in rows of the match that was navigated to
+        last, or None if it is not shown."""
+
+        if self.current_match is None:
+            return None
+
+        model = self.log_view.get_model()
+        row = map_lines_to_rows(model, (self.current_match,))
+        if not row:
+            return None
+
+        position = bisect_left(rows, row[0])
+        if position == len(rows) or rows[position] != row[0]:
+            return None
+        return position
+
+    def get_match_target(self, rows, forward):
+        """Return the position in rows of the next or previous match, or None
+        if there is none.  Going past the last match wraps around to the
+        first, and the other way round."""
+
+        if not rows:
+            return None
+
+        visible_range = self.log_view.get_visible_range()
+        position = self.get_match_position(rows)
+
+        if position is not None and visible_range is not None and \
+                visible_range[0][0] <= rows[position] <= visible_range[1][0]:
+            if forward:
+                target = position + 1
+            else:
+                target = position - 1
+        elif visible_range is not None:
+            if forward:
+                target = bisect_left(rows, visible_range[0][0])
+            else:
+                target = bisect_right(rows, visible_range[1][0]) - 1
+        elif forward:
+            target = 0
         else:
-            self.search_state = "search-backward"
-            if start_position is None:
-                start_position = len(model) - 1
-
-        if search_text is None:
-            operation = self.operation
-            if operation is None:
-                raise ValueError(
-                    "search_text not given but have no previous search operation")
-            search_text = operation.search_text
-
-        self.operation = SearchOperation(model, search_text,
-                                         start_position=start_position,
-                                         search_forward=forward)
-        self.sentinel.run_for(self.operation)
-
-    def handle_match_found(self, model, tree_iter):
-
-        if not self.search_state in ("search-forward", "search-backward",):
-            self.logger.warning(
-                "inconsistent search state %r", self.search_state)
+            target = len(rows) - 1
+
+        return target % len(rows)
+
+    def goto_match(self, forward):
+
+        rows = self.get_match_rows()
+        target = self.get_match_target(rows, forward)
+        if target is None:
+            self.logger.debug("no match to go to")
             return
 
-        line_index = model.get_path(tree_iter)[0]
-        forward_search = (self.search_state == "search-forward")
+        self.show_match(rows[target])
 
-        if forward_search:
-            self.logger.debug("forward search for %r matches line %i",
-                              self.operation.search_text, line_index)
+    def show_match(self, row):
+
+        model = self.log_view.get_model()
+        if isinstance(model, GUI.models.FilteredLogModelBase):
+            self.current_match = model.line_index_to_super(row)
         else:
-            self.logger.debug("backward search for %r matches line %i",
-                              self.operation.search_text, line_index)
+            self.current_match = row
 
-        self.sentinel.abort()
+        self.scroll_view_to_line(row)
+        self.log_view.get_selection().select_path((row,))
+        self.update_status()
+        self.update_sensitivity()
 
-        if self.scroll_match:
-            self.logger.debug("scrolling to matching line")
-            self.scroll_view_to_line(line_index)
-            # Now search for the next one:
-            self.scroll_match = False
-            # FIXME: Start with first line that is outside of the visible
-            # range.
-            self.start_search_operation(start_position=line_index + 1,
-                                        forward=forward_search)
-        else:
-            if forward_search:
-                self.next_match = line_index
+    def update_status(self):
+
+        if self.operation is None:
+            self.bar.clear_status()
+            return
 
-                self.search_state = "search-backward"
-                self.start_search_operation(forward=False,
-                                            start_position=line_index - 1)
+        rows = self.get_match_rows()
+        if not rows:
+            if self.operation.is_complete():
+                self.bar.status_no_match_found()
             else:
-                self.prev_match = line_index
-                self.update_sensitivity()
-                self.bar.clear_status()
-
-    def handle_search_complete(self):
-
-        if self.search_state == "search-forward":
-            self.logger.debug("forward search for %r reached last line",
-                              self.operation.search_text)
-            self.next_match = None
-        elif self.search_state == "search-backward":
-            self.logger.debug("backward search for %r reached first line",
-                              self.operation.search_text)
-            self.prev_match = None
+                self.bar.status_searching()
+            return
+
+        position = self.get_match_position(rows)
+        if position is None:
+            self.bar.status_match_count(len(rows))
         else:
-            self.logger.warning("inconsistent search state %r",
-                                self.search_state)
+            self.bar.status_match_position(position + 1, len(rows))
+
+    def update_sensitivity(self):
+
+        rows = self.get_match_rows()
+        for name, forward in (("goto-next-search-result", True,),
+                              ("goto-previous-search-result", False,),):
+            action = self.action_group.get_action(name)
+            action.props.sensitive = (
+                self.get_match_target(rows, forward) is not None)
+
+    def handle_search_progress(self, operation):
+
+        if operation is not self.operation:
+            return
+
+        if self.scroll_match:
+            rows = self.get_match_rows()
+            visible_range = self.log_view.get_visible_range()
+            if visible_range is None:
+                start = 0
+            else:
+                start = visible_range[0][0]
+            position = bisect_left(rows, start)
+            if position < len(rows):
+                self.logger.debug("scrolling to first match")
+                self.scroll_match = False
+                self.show_match(rows[position])
+                return
+
+        self.update_status()
+        self.update_sensitivity()
+
+    def handle_search_complete(self, operation):
+
+        if operation is not self.operation:
             return
 
+        self.logger.debug("search for %r complete, %i matching lines",
+                          operation.search_text, len(operation.matches))
+
+        # Matches are all above the visible range, if any:
+        self.scroll_match = False
+        self.update_status()
         self.update_sensitivity()
-        if self.prev_match is None and self.next_match is None:
-            self.bar.status_no_match_found()
 
 
 class Plugin (PluginBase):
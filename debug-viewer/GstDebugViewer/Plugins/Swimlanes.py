@@ -0,0 +1,572 @@
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer swimlane plugin.
+
+Shows a lane per thread or object with a mark wherever it logged, using a
+Data.LineGroupIndex.  Drawing bisects the sorted line indices of each visible
+lane at the pixel boundaries, so it takes time proportional to the size of
+the widget, not to the number of lines.  Only lines appended in follow mode
+that break the timestamp order are scanned one by one."""
+
+import logging
+from bisect import bisect_left, bisect_right
+
+from GstDebugViewer import Common, Data
+from GstDebugViewer.GUI.colors import ThreadColorThemeTango
+from GstDebugViewer.Plugins import FeatureBase, PluginBase
+
+from gettext import gettext as _
+from gi.repository import GObject
+from gi.repository import Gtk
+from gi.repository import Gdk
+
+
+def get_pixel_bounds(times, start_ts, stop_ts, width, n_sorted=None):
+    """Return a list of width + 1 line indices that divide the lines with
+    start_ts <= timestamp <= stop_ts into width pixel columns.  times are the
+    timestamps of all lines, of which the first n_sorted (default: all) are
+    sorted.  Only these lines are covered by the bounds."""
+
+    if n_sorted is None:
+        n_sorted = len(times)
+
+    step = float(stop_ts - start_ts) / width
+    bounds = [bisect_left(times, start_ts + int(x * step), 0, n_sorted)
+              for x in xrange(width)]
+    bounds.append(bisect_right(times, stop_ts, 0, n_sorted))
+
+    return bounds
+
+
+def get_tail_columns(times, line_indices, tail_start, start_ts, stop_ts,
+                     width):
+    """Return the set of pixel columns, as with get_pixel_bounds, of the lines
+    of the ascending line_indices from tail_start on.  Their timestamps are
+    not sorted, so they are looked at one by one."""
+
+    step = float(stop_ts - start_ts) / width
+    columns = set()
+    for line_index in line_indices[bisect_left(line_indices, tail_start):]:
+        ts = times[line_index]
+        if start_ts <= ts <= stop_ts:
+            columns.add(min(int((ts - start_ts) / step), width - 1))
+
+    return columns
+
+
+def get_lane_spans(line_indices, bounds, tail_columns=()):
+    """Return a list of (first, last) pairs of the runs of pixel columns that
+    contain any of the ascending line_indices, for the bounds returned by
+    get_pixel_bounds.  tail_columns are the columns of the lines that the
+    bounds do not cover, see get_tail_columns."""
+
+    if tail_columns:
+        columns = set(tail_columns)
+        for first, last in get_lane_spans(line_indices, bounds):
+            columns.update(xrange(first, last + 1))
+        spans = []
+        for x in sorted(columns):
+            if spans and spans[-1][1] == x - 1:
+                spans[-1] = (spans[-1][0], x,)
+            else:
+                spans.append((x, x,))
+        return spans
+
+    start = bisect_left(line_indices, bounds[0])
+    stop = bisect_left(line_indices, bounds[-1], start)
+    if start == stop:
+        return []
+
+    spans = []
+    position = start
+    for x in xrange(len(bounds) - 1):
+        next_position = bisect_left(line_indices, bounds[x + 1], position,
+                                    stop)
+        if next_position > position:
+            if spans and spans[-1][1] == x - 1:
+                spans[-1] = (spans[-1][0], x,)
+            else:
+                spans.append((x, x,))
+        if next_position == stop:
+            break
+        position = next_position
+
+    return spans
+
+
+class SwimlaneSentinel (object):
+
+    """Builds the Data.LineGroupIndex of a log file in the background.
+    handle_index_progress is called for every batch of indexed lines."""
+
+    def __init__(self):
+
+        self.dispatcher = Common.Data.GSourceDispatcher()
+        self.index = None
+
+    def run_for(self, log_file):
+
+        self.abort()
+        self.index = Data.LineGroupIndex(log_file.fields)
+        log_file.fields.progress_handlers.append(self.resume)
+        log_file.fields.request()
+        self.dispatcher(self.__process())
+
+    def resume(self):
+        """Index the lines that were parsed since the last run."""
+
+        if self.index is None:
+            return
+
+        self.dispatcher.cancel()
+        self.dispatcher(self.__process())
+
+    def abort(self):
+
+        self.dispatcher.cancel()
+        if self.index is not None:
+            self.index.fields.progress_handlers.remove(self.resume)
+        self.index = None
+
+    def __process(self):
+
+        n_lines = self.index.n_lines
+        for x in self.index.process():
+            if not x:
+                break
+            if self.index.n_lines != n_lines:
+                n_lines = self.index.n_lines
+                self.handle_index_progress()
+            yield True
+
+        yield False
+
+    def handle_index_progress(self):
+
+        pass
+
+
+class SwimlaneWidget (Gtk.DrawingArea):
+
+    __gtype_name__ = "GstDebugViewerSwimlaneWidget"
+
+    __gsignals__ = {"line-activated": (GObject.SignalFlags.RUN_LAST,
+                                       None,
+                                       (GObject.TYPE_INT,),)}
+
+    lane_height = 14
+    label_width = 160
+
+    def __init__(self):
+
+        GObject.GObject.__init__(self)
+
+        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK |
+                        Gdk.EventMask.SCROLL_MASK)
+
+        self.index = None
+        self.field = Data.LineGroupIndex.group_fields[0]
+        self.keys = []
+        # Time range shown when zoomed in, None shows the whole log:
+        self.zoom_ts_range = None
+        self.position_ts_range = None
+        self.__bounds_key = None
+        self.__bounds = None
+
+        theme = ThreadColorThemeTango()
+        self.lane_colors = [theme.colors[i][0].float_tuple()
+                            for i in sorted(theme.colors)]
+
+        self.set_tooltip_text(_("Lines per thread or object over time\n"
+                                "Scroll to zoom, click to go to a line"))
+
+    def set_index(self, index):
+
+        self.index = index
+        self.update()
+
+    def set_field(self, field):
+
+        self.field = field
+        self.update()
+
+    def update(self):
+        """Update the lanes after lines were indexed."""
+
+        if self.index is None:
+            self.keys = []
+            self.zoom_ts_range = None
+        else:
+            self.keys = self.index.get_keys(self.field)
+        self.__bounds_key = None
+
+        self.queue_resize()
+        self.queue_draw()
+
+    def update_position(self, start_ts, stop_ts):
+
+        self.position_ts_range = (start_ts, stop_ts,)
+        self.queue_draw()
+
+    def get_times(self):
+
+        if self.index is None:
+            return None
+
+        times = self.index.fields.columns[0]
+        if not self.index.n_lines:
+            return None
+
+        return times
+
+    def get_n_sorted(self):
+        """Return the number of indexed lines with sorted timestamps."""
+
+        return min(self.index.fields.n_sorted_lines, self.index.n_lines)
+
+    def get_ts_range(self):
+
+        times = self.get_times()
+        if times is None:
+            return None
+
+        if self.zoom_ts_range is not None:
+            return self.zoom_ts_range
+
+        return (times[0], times[self.index.n_lines - 1],)
+
+    def get_bounds(self):
+        """Return the pixel column bounds for get_lane_spans."""
+
+        ts_range = self.get_ts_range()
+        width = self.get_allocation().width - self.label_width
+        if ts_range is None or width <= 0 or ts_range[0] == ts_range[1]:
+            return None
+
+        key = (ts_range, width, self.index.n_lines,)
+        if key != self.__bounds_key:
+            times = self.index.fields.columns[0]
+            self.__bounds = get_pixel_bounds(times, ts_range[0], ts_range[1],
+                                             width, self.get_n_sorted())
+            self.__bounds_key = key
+
+        return self.__bounds
+
+    def do_get_preferred_height(self):
+
+        height = max(len(self.keys), 1) * self.lane_height
+        return height, height
+
+    def do_draw(self, ctx):
+
+        alloc = self.get_allocation()
+        w = alloc.width
+
+        ctx.set_source_rgb(1., 1., 1.)
+        ctx.paint()
+
+        bounds = self.get_bounds()
+        if bounds is None:
+            return True
+
+        # Only the lanes that are scrolled into view:
+        x1, y1, x2, y2 = ctx.clip_extents()
+        first_lane = max(int(y1) // self.lane_height, 0)
+        last_lane = min(int(y2) // self.lane_height, len(self.keys) - 1)
+
+        start_ts, stop_ts = self.get_ts_range()
+        plot_width = w - self.label_width
+        if self.position_ts_range is not None:
+            step = float(stop_ts - start_ts) / plot_width
+            pos1 = (self.position_ts_range[0] - start_ts) / step
+            pos2 = (self.position_ts_range[1] - start_ts) / step
+            if pos2 >= 0 and pos1 < plot_width:
+                ctx.set_source_rgb(.9, .9, .9)
+                ctx.rectangle(self.label_width + max(pos1, 0), y1,
+                              max(pos2 - pos1, 1), y2 - y1)
+                ctx.fill()
+
+        times = self.index.fields.columns[0]
+        n_sorted = self.get_n_sorted()
+        ctx.set_font_size(self.lane_height - 4)
+        for lane in xrange(first_lane, last_lane + 1):
+            key = self.keys[lane]
+            y = lane * self.lane_height
+
+            ctx.save()
+            ctx.rectangle(0, y, self.label_width - 4, self.lane_height)
+            ctx.clip()
+            ctx.set_source_rgb(0., 0., 0.)
+            ctx.move_to(2, y + self.lane_height - 3)
+            ctx.show_text(self.index.get_name(self.field, key))
+            ctx.restore()
+
+            line_indices = self.index.postings[self.field][key]
+            if n_sorted < self.index.n_lines:
+                tail_columns = get_tail_columns(times, line_indices, n_sorted,
+                                                start_ts, stop_ts, plot_width)
+            else:
+                tail_columns = ()
+            ctx.set_source_rgb(*self.lane_colors[lane % len(self.lane_colors)])
+            for first, last in get_lane_spans(line_indices, bounds,
+                                              tail_columns):
+                ctx.rectangle(self.label_width + first, y + 1,
+                              last - first + 1, self.lane_height - 2)
+            ctx.fill()
+
+        return True
+
+    def zoom(self, factor, x):
+        """Scale the shown time range by factor (zooming in for factors below
+        1), keeping the time at position x in place."""
+
+        times = self.get_times()
+        ts_range = self.get_ts_range()
+        width = self.get_allocation().width - self.label_width
+        if ts_range is None or width <= 0:
+            return
+
+        first_ts, last_ts = times[0], times[self.index.n_lines - 1]
+        start_ts, stop_ts = ts_range
+        x_ts = start_ts + (stop_ts - start_ts) * max(x, 0) // width
+
+        # Keep at least one nanosecond per pixel:
+        span = max(int((stop_ts - start_ts) * factor), width)
+        if span >= last_ts - first_ts:
+            self.zoom_ts_range = None
+        else:
+            start_ts = x_ts - int((x_ts - start_ts) * factor)
+            start_ts = min(max(start_ts, first_ts), last_ts - span)
+            self.zoom_ts_range = (start_ts, start_ts + span,)
+
+        self.queue_draw()
+
+    def do_scroll_event(self, event):
+
+        x = int(event.x) - self.label_width
+        if event.direction == Gdk.ScrollDirection.UP:
+            self.zoom(.5, x)
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            self.zoom(2., x)
+        else:
+            return False
+
+        return True
+
+    def do_button_press_event(self, event):
+
+        if event.button != 1:
+            return False
+
+        bounds = self.get_bounds()
+        lane = int(event.y) // self.lane_height
+        x = int(event.x) - self.label_width
+        if bounds is None or x < 0 or not 0 <= lane < len(self.keys):
+            return False
+
+        x = min(x, len(bounds) - 2)
+        line_indices = self.index.postings[self.field][self.keys[lane]]
+        position = bisect_left(line_indices, bounds[x])
+        # The line of the lane closest to the pixel column:
+        candidates = line_indices[max(position - 1, 0):position + 1]
+        if not candidates:
+            return False
+        line_index = min(candidates,
+                         key=lambda i: abs(i - bounds[x]))
+        self.emit("line-activated", line_index)
+
+        return True
+
+
+class AttachedWindow (object):
+
+    def __init__(self, feature, window):
+
+        self.feature = feature
+        self.window = window
+
+        ui = window.ui_manager
+        ui.insert_action_group(feature.action_group, 0)
+
+        self.merge_id = ui.new_merge_id()
+        ui.add_ui(self.merge_id, "/menubar/ViewMenu/ViewMenuAdditions",
+                  "ViewSwimlanes", "show-swimlanes",
+                  Gtk.UIManagerItemType.MENUITEM, False)
+
+        self.swimlanes = SwimlaneWidget()
+        self.swimlanes.connect("line-activated",
+                               self.handle_swimlanes_line_activated)
+
+        self.field_combo = Gtk.ComboBoxText()
+        self.field_combo.append_text(_("Threads"))
+        self.field_combo.append_text(_("Objects"))
+        self.field_combo.props.active = 0
+        self.field_combo.connect("changed", self.handle_field_combo_changed)
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scrolled.add_with_viewport(self.swimlanes)
+        scrolled.set_size_request(-1, 6 * SwimlaneWidget.lane_height)
+
+        self.box = Gtk.HBox(spacing=4)
+        self.box.pack_start(self.field_combo, False, False, 0)
+        self.box.pack_start(scrolled, True, True, 0)
+        window.get_top_attach_point().pack_start(self.box, False, False, 0)
+
+        self.sentinel = SwimlaneSentinel()
+        self.sentinel.handle_index_progress = self.handle_index_progress
+
+        handler = self.handle_log_view_adjustment_value_changed
+        adjustment = window.widgets.log_view_scrolled_window.props.vadjustment
+        self.adjustment_changed_id = adjustment.connect("value-changed",
+                                                        handler)
+
+        action = feature.action_group.get_action("show-swimlanes")
+        self.show_toggled_id = action.connect(
+            "toggled", self.handle_show_action_toggled)
+        self.handle_show_action_toggled(action)
+
+    def detach(self):
+
+        self.sentinel.abort()
+
+        adjustment = self.window.widgets.log_view_scrolled_window.props.vadjustment
+        adjustment.disconnect(self.adjustment_changed_id)
+        action = self.feature.action_group.get_action("show-swimlanes")
+        action.disconnect(self.show_toggled_id)
+
+        self.window.ui_manager.remove_ui(self.merge_id)
+        self.merge_id = None
+        self.window.ui_manager.remove_action_group(self.feature.action_group)
+
+        self.box.destroy()
+        self.box = None
+        self.swimlanes = None
+
+    def is_shown(self):
+
+        action = self.feature.action_group.get_action("show-swimlanes")
+        return action.props.active
+
+    def start_index(self):
+
+        log_file = self.window.log_file
+        if log_file is None or log_file.fields is None:
+            return
+
+        if self.sentinel.index is None:
+            self.sentinel.run_for(log_file)
+            self.swimlanes.set_index(self.sentinel.index)
+
+    def handle_show_action_toggled(self, action):
+
+        if action.props.active:
+            self.box.show_all()
+            self.start_index()
+        else:
+            self.box.hide()
+
+    def handle_attach_log_file(self, log_file):
+
+        if self.is_shown():
+            self.start_index()
+
+    def handle_detach_log_file(self, log_file):
+
+        self.sentinel.abort()
+        self.swimlanes.set_index(None)
+
+    def handle_log_lines_appended(self):
+
+        self.sentinel.resume()
+
+    def handle_index_progress(self):
+
+        self.swimlanes.update()
+
+    def handle_field_combo_changed(self, combo):
+
+        fields = Data.LineGroupIndex.group_fields
+        self.swimlanes.set_field(fields[combo.props.active])
+
+    def handle_log_view_adjustment_value_changed(self, adj):
+
+        if not self.is_shown():
+            return
+
+        visible_range = self.window.get_range()
+        if visible_range is not None:
+            self.swimlanes.update_position(*visible_range)
+
+    def handle_swimlanes_line_activated(self, widget, super_line_index):
+
+        log_filter = self.window.log_filter
+        line_index = log_filter.line_index_from_super(super_line_index)
+        # Hidden lines map to the next shown line:
+        line_index = min(line_index, len(log_filter) - 1)
+        if line_index < 0:
+            return
+
+        path = Gtk.TreePath((line_index,))
+        view = self.window.log_view
+        view.set_cursor(path, None, False)
+        view.scroll_to_cell(path, use_align=True, row_align=.5)
+
+
+class SwimlanesFeature (FeatureBase):
+
+    def __init__(self, app):
+
+        self.logger = logging.getLogger("ui.swimlanes")
+
+        self.action_group = Gtk.ActionGroup("SwimlanesActions")
+        self.action_group.add_toggle_actions([("show-swimlanes",
+                                               None, _("_Swimlanes"),)])
+
+        self.attached_windows = {}
+
+    def handle_attach_window(self, window):
+
+        self.attached_windows[window] = AttachedWindow(self, window)
+
+    def handle_detach_window(self, window):
+
+        attached_window = self.attached_windows.pop(window)
+        attached_window.detach()
+
+    def handle_attach_log_file(self, window, log_file):
+
+        attached_window = self.attached_windows[window]
+        attached_window.handle_attach_log_file(log_file)
+
+    def handle_detach_log_file(self, window, log_file):
+
+        attached_window = self.attached_windows[window]
+        attached_window.handle_detach_log_file(log_file)
+
+    def handle_log_lines_appended(self, window, log_file, start, stop):
+
+        attached_window = self.attached_windows[window]
+        attached_window.handle_log_lines_appended()
+
+
+class Plugin (PluginBase):
+
+    features = (SwimlanesFeature,)
@@ -20,6 +20,11 @@
 """GStreamer Debug Viewer timeline widget plugin."""
 
 import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import imap, islice
+import operator
 
 from GstDebugViewer import Common, Data
 from GstDebugViewer.GUI.colors import LevelColorThemeTango, ThreadColorThemeTango
@@ -32,184 +37,404 @@ from gi.repository import Gdk
 import cairo
 
 
-def iter_model_reversed(model):
+MAX_LEVELS = 8
 
-    count = model.iter_n_children(None)
-    for i in xrange(count - 1, 0, -1):
-        yield model[i]
 
+def iter_model_times(model, n_lines, chunk_size):
+    """Generate the timestamps of the first n_lines rows of model as arrays
+    of up to chunk_size items.  They are taken from the Data.LineFields column
+    store if it is complete, else decoded from the start of the lines with
+    Data.LogLine.parse_prefix (the row is only parsed fully for lines that
+    this cannot decode)."""
 
-class LineFrequencySentinel (object):
+    col_id = model.COL_TIME
+    super_index = getattr(model, "super_index", None)
+    if super_index is None:
+        fields = model.line_fields
+    else:
+        fields = model.super_model.line_fields
 
-    def __init__(self, model):
+    if fields is not None and fields.is_complete():
+        if super_index is None or isinstance(super_index, xrange):
+            if super_index:
+                start = super_index[0]
+            else:
+                start = 0
+            column = fields.columns[col_id]
+            for i in xrange(start, start + n_lines, chunk_size):
+                yield column[i:min(i + chunk_size, start + n_lines)]
+            return
+        indices = iter(super_index)
+        for i in xrange(0, n_lines, chunk_size):
+            chunk = list(islice(indices, min(chunk_size, n_lines - i)))
+            yield Data.offset_array(fields.take(col_id, chunk))
+        return
+
+    parse_prefix = Data.LogLine.parse_prefix
+    access_prefix = model.access_prefix
+    ensure_cached = model.ensure_cached
+    line_cache = model.line_cache
+    offsets = model.line_offsets
+    for i in xrange(0, n_lines, chunk_size):
+        times = Data.offset_array()
+        for offset in offsets[i:min(i + chunk_size, n_lines)]:
+            values = parse_prefix(access_prefix(offset))
+            if values is None:
+                ensure_cached(offset)
+                times.append(line_cache[offset][col_id])
+            else:
+                times.append(values[0])
+        yield times
 
-        self.model = model
-        self.clear()
 
-    def clear(self):
+class TimelineData (object):
 
-        self.data = None
-        self.n_partitions = None
-        self.partitions = None
-        self.step = None
-        self.ts_range = None
+    """Timestamps and level values of the rows of a model, and a pyramid of
+    line counts per debug level and time bucket built from them.
 
-    def _search_ts(self, target_ts, first_index, last_index):
+    The first pyramid level splits the time range into n_base_buckets
+    buckets, each further level halves the number of buckets.  Histograms
+    for any time range and width are summed up from the coarsest level that
+    has at least min_partition_buckets buckets per partition.  Narrower
+    partitions are counted exactly from the timestamp array.
 
-        model_get = self.model.get_value
-        model_iter_nth_child = self.model.iter_nth_child
-        col_id = self.model.COL_TIME
+    The data is gathered in steps by the process generator, which can be
+    stopped and run again to continue.  get_histogram can be used once
+    is_complete returns true."""
 
-        # TODO: Rewrite using a lightweight view object + bisect.
+    n_base_buckets = 1 << 14
+    min_partition_buckets = 16
 
-        while True:
-            middle = (last_index - first_index) // 2 + first_index
-            if middle == first_index:
-                return first_index
-            ts = model_get(model_iter_nth_child(None, middle), col_id)
-            if ts < target_ts:
-                first_index = middle
-            elif ts > target_ts:
-                last_index = middle
-            else:
-                return middle
+    _lines_per_iteration = 5000
+    _buckets_per_iteration = 2048
 
-    def run_for(self, n):
+    def __init__(self, model):
 
-        if n == 0:
-            raise ValueError("illegal value for n")
+        self.times = None
+        self.levels = None
+        self.ts_range = None
+        self.last_index = None
+        self.bucket_width = None
+        self.bucket_bounds = None
+        self.pyramid = None
+        self.histograms = {}
 
-        self.n_partitions = n
+        self.__complete = False
+        self.__steps = self.__build(model)
+
+    def is_complete(self):
+
+        return self.__complete
 
     def process(self):
+        """Generator that continues gathering the data, where a previous run
+        stopped."""
 
-        model = self.model
-        result = []
-        partitions = []
+        for x in self.__steps:
+            yield True
 
-        first_ts = None
-        for row in self.model:
-            first_ts = row[model.COL_TIME]
-            if first_ts is not None:
-                break
+        yield False
 
-        if first_ts is None:
+    def __build(self, model):
+
+        # The model is replaced or only grows while this runs, so look at the
+        # rows that it has now:
+        n_lines = len(model.line_offsets)
+        self.levels = model.get_value_range(model.COL_LEVEL, 0, n_lines).values
+
+        times = Data.offset_array()
+        for chunk in iter_model_times(model, n_lines,
+                                      self._lines_per_iteration):
+            times.extend(chunk)
+            yield True
+        self.times = times
+
+        self.__find_ts_range()
+        if self.ts_range is not None:
+            for x in self.__build_pyramid():
+                yield True
+
+        self.__complete = True
+
+    def __find_ts_range(self):
+
+        times = self.times
+        if not times:
             return
 
-        last_ts = None
-        i = 0
+        # FIXME: We ignore 0 here (unparsable lines!), this should be handled
+        # differently!
         UNPARSABLE_LIMIT = 500
-        for row in iter_model_reversed(self.model):
-            last_ts = row[model.COL_TIME]
-            # FIXME: We ignore 0 here (unparsable lines!), this should be
-            # handled differently!
-            i += 1
-            if i == UNPARSABLE_LIMIT:
-                break
-            if last_ts:
-                last_index = row.path[0]
+        stop = max(len(times) - UNPARSABLE_LIMIT, 0)
+        for last_index in xrange(len(times) - 1, stop - 1, -1):
+            if times[last_index]:
                 break
+        else:
+            return
 
-        if last_ts is None or last_ts < first_ts:
+        first_ts = times[0]
+        last_ts = times[last_index]
+        if last_ts < first_ts:
             return
 
-        step = int(float(last_ts - first_ts) / float(self.n_partitions))
+        self.ts_range = (first_ts, last_ts,)
+        self.last_index = last_index
+
+    def __build_pyramid(self):
 
-        YIELD_LIMIT = 100
-        limit = YIELD_LIMIT
+        first_ts, last_ts = self.ts_range
+        n_buckets = self.n_base_buckets
+        bucket_width = (last_ts - first_ts) // n_buckets + 1
 
-        first_index = 0
-        target_ts = first_ts + step
-        old_found = 0
-        while target_ts < last_ts:
-            limit -= 1
-            if limit == 0:
-                limit = YIELD_LIMIT
+        times = self.times
+        levels = self.levels
+        # Each test scans the level array:
+        present_levels = []
+        for level in xrange(MAX_LEVELS):
+            if level in levels:
+                present_levels.append(level)
+            yield True
+        counts = [array("I", [0]) * n_buckets for level in xrange(MAX_LEVELS)]
+        # Line index where each bucket starts, and where the last one ends:
+        bounds = array("I", [0])
+        hi = self.last_index + 1
+        start = 0
+        ts = first_ts
+        for bucket in xrange(n_buckets):
+            ts += bucket_width
+            stop = bisect_left(times, ts, start, hi)
+            bounds.append(stop)
+            if stop != start:
+                bucket_levels = levels[start:stop]
+                for level in present_levels:
+                    counts[level][bucket] = bucket_levels.count(level)
+            start = stop
+            if bucket % self._buckets_per_iteration == 0:
                 yield True
-            found = self._search_ts(target_ts, first_index, last_index)
-            result.append(found - old_found)
-            partitions.append(found)
-            old_found = found
-            first_index = found
-            target_ts += step
 
-        if step == 0:
-            result = []
-            partitions = []
+        pyramid = [counts]
+        while len(counts[0]) > 1:
+            counts = [array("I", imap(operator.add, level_counts[0::2],
+                                      level_counts[1::2]))
+                      for level_counts in counts]
+            pyramid.append(counts)
+            yield True
 
-        self.step = step
-        self.data = result
-        self.partitions = partitions
-        self.ts_range = (first_ts, last_ts,)
+        self.bucket_width = bucket_width
+        self.bucket_bounds = bounds
+        self.pyramid = pyramid
+
+    def get_histogram(self, n_partitions, start_ts=None, stop_ts=None):
+        """Return a tuple (step, partitions, line frequencies, level
+        distributions) for n_partitions partitions of the time range from
+        start_ts to stop_ts (default: all of it).  Partitions holds the line
+        index where each partition ends."""
+
+        first_ts, last_ts = self.ts_range
+        if start_ts is None or start_ts < first_ts:
+            start_ts = first_ts
+        if stop_ts is None or stop_ts > last_ts:
+            stop_ts = last_ts
+
+        key = (n_partitions, start_ts, stop_ts,)
+        if key in self.histograms:
+            return self.histograms[key]
+
+        step = int(float(stop_ts - start_ts) / float(n_partitions))
+        if step > 0:
+            level = self.__get_pyramid_level(step)
+            if level is None:
+                bounds, counts = self.__count_lines(
+                    n_partitions, start_ts, stop_ts, step)
+            else:
+                bounds, counts = self.__count_buckets(
+                    level, n_partitions, start_ts, stop_ts, step)
+            partitions = array("I", bounds[1:])
+            freq_data = map(operator.sub, bounds[1:], bounds[:-1])
+            dist_data = zip(*counts)
+        else:
+            partitions = array("I")
+            freq_data = []
+            dist_data = []
+
+        result = (step, partitions, freq_data, dist_data,)
+        self.histograms[key] = result
+        return result
+
+    def __get_pyramid_level(self, step):
+
+        # A partition that sums up only one or two buckets would be off by up
+        # to a bucket, so use a level with enough buckets per partition:
+        n_buckets = step // (self.bucket_width * self.min_partition_buckets)
+        if n_buckets == 0:
+            return None
+
+        return min(n_buckets.bit_length() - 1, len(self.pyramid) - 1)
+
+    def __count_lines(self, n_partitions, start_ts, stop_ts, step):
+
+        times = self.times
+        levels = self.levels
+        hi = self.last_index + 1
+
+        bounds = [bisect_left(times, start_ts, 0, hi)]
+        for i in xrange(1, n_partitions):
+            bounds.append(bisect_left(times, start_ts + i * step,
+                                      bounds[-1], hi))
+        # The last partition takes the rest, up to and including stop_ts:
+        bounds.append(bisect_right(times, stop_ts, bounds[-1], hi))
+
+        counts = [[0] * n_partitions for level in xrange(MAX_LEVELS)]
+        present_levels = [level for level in xrange(MAX_LEVELS)
+                          if level in levels[bounds[0]:bounds[-1]]]
+        for i in xrange(n_partitions):
+            start, stop = bounds[i], bounds[i + 1]
+            if start == stop:
+                continue
+            partition_levels = levels[start:stop]
+            for level in present_levels:
+                counts[level][i] = partition_levels.count(level)
 
+        return bounds, counts
 
-class LevelDistributionSentinel (object):
+    def __count_buckets(self, level, n_partitions, start_ts, stop_ts, step):
 
-    def __init__(self, freq_sentinel, model):
+        first_ts = self.ts_range[0]
+        bucket_width = self.bucket_width << level
+        level_counts = self.pyramid[level]
+        n_buckets = len(level_counts[0])
+
+        buckets = [(start_ts + i * step - first_ts) // bucket_width
+                   for i in xrange(n_partitions)]
+        buckets.append(min((stop_ts - first_ts) // bucket_width + 1,
+                           n_buckets))
+
+        base_bounds = self.bucket_bounds
+        bounds = [base_bounds[bucket << level] for bucket in buckets]
+
+        counts = []
+        for bucket_counts in level_counts:
+            if not any(bucket_counts):
+                counts.append([0] * n_partitions)
+                continue
+            counts.append([sum(bucket_counts[buckets[i]:buckets[i + 1]])
+                           for i in xrange(n_partitions)])
+
+        return bounds, counts
+
+
+class TimelineCache (object):
+
+    """TimelineData of the most recent model states.  A state is the model
+    together with its super_index (which every filter change replaces) and
+    line count, so that sizing the widget or aborting a filter process
+    does not recompute anything."""
+
+    max_states = 2
+
+    def __init__(self):
+
+        self.states = OrderedDict()
+
+    def clear(self):
+
+        self.states.clear()
+
+    def get(self, model):
+
+        super_index = getattr(model, "super_index", None)
+        key = (id(model), id(super_index), len(model.line_offsets),)
+        if key in self.states:
+            entry = self.states.pop(key)
+        else:
+            # Keep model and super_index alive, so that their ids stay valid
+            # for the key:
+            entry = (model, super_index, TimelineData(model),)
+            while len(self.states) >= self.max_states:
+                self.states.popitem(last=False)
+        self.states[key] = entry
+
+        return entry[-1]
+
+
+class LineFrequencySentinel (object):
+
+    def __init__(self, model, cache=None):
 
-        self.freq_sentinel = freq_sentinel
         self.model = model
-        self.data = []
+        self.cache = cache
+        self.clear()
 
     def clear(self):
 
-        del self.data[:]
+        self.data = None
+        self.level_data = None
+        self.n_partitions = None
+        self.view_ts_range = None
+        self.partitions = None
+        self.step = None
+        self.ts_range = None
+        self.full_ts_range = None
+
+    def run_for(self, n, ts_range=None):
+        """Partition the given time range (default: the whole log) into n
+        parts."""
+
+        if n == 0:
+            raise ValueError("illegal value for n")
+
+        self.n_partitions = n
+        self.view_ts_range = ts_range
 
     def process(self):
 
-        MAX_LEVELS = 8
-        YIELD_LIMIT = 10000
-        y = YIELD_LIMIT
+        if self.cache is None:
+            timeline_data = TimelineData(self.model)
+        else:
+            timeline_data = self.cache.get(self.model)
 
-        model_get = self.model.get_value
-        model_next = self.model.iter_next
-        id_time = self.model.COL_TIME
-        id_level = self.model.COL_LEVEL
-        del self.data[:]
-        data = self.data
-        i = 0
-        partitions_i = 0
-        partitions = self.freq_sentinel.partitions
-        counts = [0] * MAX_LEVELS
-        tree_iter = self.model.get_iter_first()
+        for x in timeline_data.process():
+            if not x:
+                break
+            yield True
 
-        if not partitions:
+        if timeline_data.ts_range is None:
             return
 
-        level_index = 0
-        level_iter = None
+        yield True
+
+        if self.view_ts_range is None:
+            start_ts, stop_ts = timeline_data.ts_range
+        else:
+            start_ts, stop_ts = self.view_ts_range
+        (self.step, self.partitions,
+         self.data, self.level_data,) = timeline_data.get_histogram(
+            self.n_partitions, start_ts, stop_ts)
+        self.ts_range = (max(start_ts, timeline_data.ts_range[0]),
+                         min(stop_ts, timeline_data.ts_range[1]),)
+        self.full_ts_range = timeline_data.ts_range
 
-        finished = False
-        while tree_iter:
-            y -= 1
-            if y == 0:
-                y = YIELD_LIMIT
-                yield True
-            if level_iter is None:
-                stop_index = level_index + 512
-                levels = self.model.get_value_range(id_level,
-                                                    level_index, stop_index)
-                level_index = stop_index
-                level_iter = iter(levels)
-            try:
-                level = level_iter.next()
-            except StopIteration:
-                level_iter = None
-                continue
-            while i > partitions[partitions_i]:
-                data.append(tuple(counts))
-                counts = [0] * MAX_LEVELS
-                partitions_i += 1
-                if partitions_i == len(partitions):
-                    finished = True
-                    break
-            if finished:
-                break
-            counts[level] += 1
-            i += 1
 
-        # Now handle the last one:
-        data.append(tuple(counts))
+class LevelDistributionSentinel (object):
+
+    """Level counts per partition.  These are computed together with the line
+    frequencies by the LineFrequencySentinel."""
+
+    def __init__(self, freq_sentinel, model):
+
+        self.freq_sentinel = freq_sentinel
+        self.model = model
+        self.data = []
+
+    def clear(self):
+
+        del self.data[:]
+
+    def process(self):
+
+        del self.data[:]
+        if self.freq_sentinel.level_data:
+            self.data.extend(self.freq_sentinel.level_data)
 
         yield False
 
@@ -444,13 +669,19 @@ class TimelineWidget (Gtk.DrawingArea):
 
         self.add_events(Gdk.EventMask.BUTTON1_MOTION_MASK |
                         Gdk.EventMask.BUTTON_PRESS_MASK |
-                        Gdk.EventMask.BUTTON_RELEASE_MASK)
+                        Gdk.EventMask.BUTTON_RELEASE_MASK |
+                        Gdk.EventMask.SCROLL_MASK)
 
         self.process = UpdateProcess(None, None)
         self.process.handle_sentinel_progress = self.__handle_sentinel_progress
         self.process.handle_sentinel_finished = self.__handle_sentinel_finished
+        self.process.handle_process_finished = self.__handle_process_finished
 
         self.model = None
+        self.cache = TimelineCache()
+        # Time range shown when zoomed in, None shows the whole log:
+        self.zoom_ts_range = None
+        self.__update_pending = False
         self.__offscreen = None
         self.__offscreen_size = (0, 0)
         self.__offscreen_dirty = (0, 0)
@@ -459,7 +690,8 @@ class TimelineWidget (Gtk.DrawingArea):
 
         try:
             self.set_tooltip_text(_("Log event histogram\n"
-                                    "Different colors represent different log-levels"))
+                                    "Different colors represent different log-levels\n"
+                                    "Scroll to zoom"))
         except AttributeError:
             # Compatibility.
             pass
@@ -480,6 +712,35 @@ class TimelineWidget (Gtk.DrawingArea):
         else:
             self.__invalidate_offscreen(self.__dist_sentinel_progress, -1)
 
+    def __handle_process_finished(self):
+
+        if not self.__update_pending:
+            return
+
+        def idle_update():
+            if self.__update_pending:
+                self.__update_pending = False
+                self.handle_lines_appended()
+            return False
+        # Not from within the process that is just finishing:
+        GObject.idle_add(idle_update)
+
+    def handle_lines_appended(self):
+
+        if self.model is None:
+            return
+
+        if self.process.is_running:
+            # Catch up when the current run is done:
+            self.__update_pending = True
+            return
+
+        # The time range grows with the new lines, which moves all partition
+        # boundaries.  The old graph stays on screen until the sentinels
+        # invalidate it:
+        self.__dist_sentinel_progress = 0
+        self.process.run()
+
     def __ensure_offscreen(self):
 
         alloc = self.get_allocation()
@@ -555,16 +816,48 @@ class TimelineWidget (Gtk.DrawingArea):
 
         if model is not None:
             self.__dist_sentinel_progress = 0
-            self.process.freq_sentinel = LineFrequencySentinel(model)
+            self.process.freq_sentinel = LineFrequencySentinel(model,
+                                                               self.cache)
             self.process.dist_sentinel = LevelDistributionSentinel(
                 self.process.freq_sentinel, model)
             width = self.get_allocation().width
-            self.process.freq_sentinel.run_for(width)
+            self.process.freq_sentinel.run_for(width, self.zoom_ts_range)
             self.process.run()
 
+    def reset(self):
+
+        self.clear()
+        self.cache.clear()
+        self.zoom_ts_range = None
+
+    def zoom(self, factor, x):
+        """Scale the shown time range by factor (zooming in for factors below
+        1), keeping the time at position x in place."""
+
+        sentinel = self.process.freq_sentinel
+        if sentinel is None or not sentinel.data:
+            return
+
+        first_ts, last_ts = sentinel.full_ts_range
+        start_ts, stop_ts = sentinel.ts_range
+        x_ts = start_ts + x * sentinel.step
+
+        # Keep at least one nanosecond per pixel:
+        min_span = self.get_allocation().width
+        span = max(int((stop_ts - start_ts) * factor), min_span)
+        if span >= last_ts - first_ts:
+            self.zoom_ts_range = None
+        else:
+            start_ts = x_ts - int((x_ts - start_ts) * factor)
+            start_ts = min(max(start_ts, first_ts), last_ts - span)
+            self.zoom_ts_range = (start_ts, start_ts + span,)
+
+        self.update(self.model)
+
     def clear(self):
 
         self.model = None
+        self.__update_pending = False
         self.process.abort()
         self.process.freq_sentinel = None
         self.process.dist_sentinel = None
@@ -817,6 +1110,17 @@ class TimelineWidget (Gtk.DrawingArea):
 
         return 64, 64  # FIXME:
 
+    def do_scroll_event(self, event):
+
+        if event.direction == Gdk.ScrollDirection.UP:
+            self.zoom(.5, int(event.x))
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            self.zoom(2., int(event.x))
+        else:
+            return False
+
+        return True
+
     def do_button_press_event(self, event):
 
         if event.button != 1:
@@ -942,9 +1246,17 @@ class AttachedWindow (object):
 
     def handle_detach_log_file(self, log_file):
 
-        self.timeline.clear()
+        self.timeline.reset()
         self.vtimeline.clear()
 
+    def handle_log_lines_appended(self):
+
+        if self.window.log_view.get_model() is None:
+            return
+
+        self.timeline.handle_lines_appended()
+        self.vtimeline.update()
+
     def handle_log_view_notify_model(self, view, gparam):
 
         model = view.get_model()
@@ -1001,18 +1313,16 @@ class AttachedWindow (object):
         if not self.timeline.process.freq_sentinel:
             return True
 
-        data = self.timeline.process.freq_sentinel.data
-        if not data:
+        partitions = self.timeline.process.freq_sentinel.partitions
+        if not partitions:
             return True
 
         if pos < 0:
             pos = 0
-        elif pos >= len(data):
-            pos = len(data) - 1
+        elif pos >= len(partitions):
+            pos = len(partitions) - 1
 
-        count = sum(data[:pos + 1])
-
-        path = (count,)
+        path = (partitions[pos],)
         self.idle_scroll_path = path
 
         if self.idle_scroll_id is None:
@@ -1076,6 +1386,11 @@ class TimelineFeature (FeatureBase):
         attached_window = self.attached_windows[window]
         attached_window.handle_detach_log_file(log_file)
 
+    def handle_log_lines_appended(self, window, log_file, start, stop):
+
+        attached_window = self.attached_windows[window]
+        attached_window.handle_log_lines_appended()
+
 
 class TimelineState (Common.GUI.StateSection):
 
@@ -81,6 +81,15 @@ class FeatureBase (object):
 
         pass
 
+    def handle_log_lines_appended(self, window, log_file, start, stop):
+        """
+        window: GstDebugViewer.GUI.window.Window
+        log_file: GstDebugViewer.Data.LogFile
+        start, stop: range of the new line indices in the log file
+        """
+
+        pass
+
     def handle_detach_window(self, window):
         """
         window: GstDebugViewer.GUI.window.Window
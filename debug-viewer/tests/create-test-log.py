@@ -1,5 +1,10 @@
 #!/usr/bin/env python
 
+"""Write a synthetic GStreamer debug log, for testing and benchmarking."""
+
+categories = ("GST_DUMMY", "GST_PADS", "GST_CAPS", "GST_EVENT",)
+
+
 def line_string (ts, pid, thread, level, category, filename, line, function,
                  object_, message):
 
@@ -11,40 +16,101 @@ def line_string (ts, pid, thread, level, category, filename, line, function,
                                                      filename, line, function,
                                                      object_, message,)
 
-def main ():
-
-    import sys
-    import os.path
-    sys.path.append (os.path.dirname (os.path.dirname (sys.argv[0])))
+def iter_lines (count, n_threads = 1, burst = 1, jitter = 0, seed = 0):
+    """Generate count log lines (without newline), written by n_threads
+    threads that log about burst lines at a time.  A line is written up to
+    jitter nanoseconds after its timestamp, so lines of different threads get
+    out of order in the file, while each thread's lines stay sorted."""
 
-    global Data
-    from GstDebugViewer import Data
+    import random
 
-    count = 100000
+    rand = random.Random (seed)
 
-    ts = 0
     pid = 12345
-    thread = int ("89abcdef", 16)
-    level = Data.debug_level_log
-    category = "GST_DUMMY"
+    first_thread = int ("89abcdef", 16)
     filename = "gstdummyfilename.c"
     file_line = 1
     function = "gst_dummy_function"
-    object_ = "dummyobj0"
-    message = "dummy message with no content"
 
     levels = (Data.debug_level_log,
               Data.debug_level_debug,
               Data.debug_level_info,)
 
+    last_ts = [0] * n_threads
+    thread_index = 0
     shift = 0
     for i in xrange (count):
 
+        if n_threads > 1 and rand.randrange (burst) == 0:
+            thread_index = rand.randrange (n_threads)
+
         ts = i * 10000
-        shift += i % (count // 100)
+        if jitter:
+            ts = max (last_ts[thread_index], ts - rand.randint (0, jitter))
+        last_ts[thread_index] = ts
+
+        shift += i % (count // 100 or 1)
         level = levels[(i + shift) % 3]
-        print line_string (ts, pid, thread, level, category, filename, file_line,
-                           function, object_, message)
+        category = categories[(i + thread_index) % len (categories)]
+        object_ = "dummyobj%i" % (thread_index,)
+        message = "dummy message number %i" % (i,)
+        yield line_string (ts, pid, first_thread + thread_index, level,
+                           category, filename, file_line, function, object_,
+                           message)
+
+def write_log (fileobj, count, **kw):
+
+    for line in iter_lines (count, **kw):
+        fileobj.write (line)
+        fileobj.write ("\n")
+
+def main ():
+
+    import sys
+    import os.path
+    from optparse import OptionParser
+
+    sys.path.append (os.path.dirname (os.path.dirname (os.path.abspath (__file__))))
+
+    global Data
+    from GstDebugViewer import Data
+
+    parser = OptionParser (usage = "%prog [options]")
+    parser.add_option ("-n", "--lines", type = "int", default = 100000,
+                       help = "number of lines to write (default: %default)")
+    parser.add_option ("-t", "--threads", type = "int", default = 1,
+                       help = "number of logging threads (default: %default)")
+    parser.add_option ("-b", "--burst", type = "int", default = 1,
+                       help = "average number of lines a thread logs before "
+                       "switching threads (default: %default)")
+    parser.add_option ("-j", "--jitter", type = "int", default = 0,
+                       help = "maximum delay in nanoseconds between the "
+                       "timestamp of a line and writing it (default: %default)")
+    parser.add_option ("-s", "--seed", type = "int", default = 0,
+                       help = "random seed (default: %default)")
+    parser.add_option ("-o", "--output", metavar = "FILE",
+                       help = "write to FILE instead of standard output")
+    options, args = parser.parse_args ()
+
+    if args:
+        parser.error ("unexpected arguments")
+    if options.threads < 1 or options.burst < 1:
+        parser.error ("thread count and burst length must be positive")
+
+    if options.output:
+        fileobj = open (options.output, "wb")
+    else:
+        fileobj = sys.stdout
+
+    try:
+        write_log (fileobj, options.lines, n_threads = options.threads,
+                   burst = options.burst, jitter = options.jitter,
+                   seed = options.seed)
+    finally:
+        if fileobj is not sys.stdout:
+            fileobj.close ()
 
 if __name__ == "__main__":
     main ()
+else:
+    from GstDebugViewer import Data
@@ -18,61 +18,278 @@
 #  You should have received a copy of the GNU General Public License along with
 #  this program.  If not, see <http://www.gnu.org/licenses/>.
 
-"""GStreamer Debug Viewer performance test program."""
+"""GStreamer Debug Viewer performance test program.
+
+Runs the data processing steps of the viewer headless (without a main loop or
+window) on a given or a synthetic log file, and prints the results as JSON.
+Throughput is given in lines per second.  Peak RSS is the maximum resident set
+size of the process so far, so it includes all preceding benchmarks."""
 
 import sys
 import os
 import os.path
-from glob import glob
 import time
 
-import gi
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
 
-from gi.repository import GObject
+from GstDebugViewer import Common, Data
+from GstDebugViewer.GUI.models import FilteredLogModel, LazyLogModel
 
-sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+def load_test_log_module ():
+
+    import imp
+
+    path = os.path.join (os.path.dirname (os.path.abspath (__file__)),
+                         "create-test-log.py")
+    return imp.load_source ("create_test_log", path)
+
+def get_peak_rss ():
+    """Return the peak resident set size of the process in KiB."""
+
+    import resource
+
+    rusage = resource.getrusage (resource.RUSAGE_SELF)
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss // 1024
+    return rusage.ru_maxrss
+
+class Benchmark (object):
 
-from GstDebugViewer import Common, Data, GUI
+    names = ("load", "fields", "lines", "model", "columns", "filter",
+             "search", "timeline",)
 
-class TestParsingPerformance (object):
+    def __init__ (self, filename, search_text, repeat = 1):
 
-    def __init__ (self, filename):
+        self.filename = filename
+        self.search_text = search_text
+        self.repeat = repeat
+        self.dispatcher = Common.Data.DefaultDispatcher ()
+        self.log_file = None
+        self.model = None
+        self.extra_results = {}
 
-        self.main_loop = GObject.MainLoop ()
-        self.log_file = Data.LogFile (filename, Common.Data.DefaultDispatcher ())
-        self.log_file.consumers.append (self)
+    def run (self, name):
+        """Run the named benchmark and return its results as a dictionary.
+        Benchmarks use the log file and model set up by the ones
+        before them in names, and set those up first if needed."""
 
-    def start (self):
+        func = getattr (self, "bench_%s" % (name,))
 
+        self.extra_results = {}
+        times = []
+        for i in range (self.repeat):
+            start_time = time.time ()
+            n_lines = func ()
+            times.append (time.time () - start_time)
+
+        best = min (times)
+        if best > 0:
+            lines_per_second = n_lines / best
+        else:
+            lines_per_second = None
+
+        result = {"name" : name,
+                  "lines" : n_lines,
+                  "seconds" : best,
+                  "lines_per_second" : lines_per_second,
+                  "peak_rss_kib" : get_peak_rss ()}
+        if self.model is not None:
+            result["row_cache"] = self.model.line_cache.get_stats ()
+        result.update (self.extra_results)
+        return result
+
+    def ensure_loaded (self):
+
+        if self.log_file is None:
+            self.bench_load ()
+
+    def ensure_model (self):
+
+        self.ensure_loaded ()
+        if self.model is None:
+            if not self.log_file.fields.is_complete ():
+                self.dispatcher (self.log_file.fields.process ())
+            self.model = LazyLogModel (self.log_file)
+
+    def bench_load (self):
+
+        self.model = None
+        self.log_file = Data.LogFile (self.filename, self.dispatcher,
+                                      use_index = False)
         self.log_file.start_loading ()
+        return len (self.log_file.line_cache.offsets)
+
+    def bench_fields (self):
 
-    def handle_load_started (self):
+        self.ensure_loaded ()
+        fields = Data.LineFields (self.log_file.fileobj,
+                                  self.log_file.line_cache)
+        self.dispatcher (fields.process ())
+        self.log_file.fields = fields
+        return len (fields)
 
-        self.start_time = time.time ()
+    def bench_lines (self):
 
-    def handle_load_finished (self):
+        self.ensure_loaded ()
+        n_lines = 0
+        for line in self.log_file.lines:
+            n_lines += 1
+        return n_lines
 
-        diff = time.time () - self.start_time
-        print "line cache built in %0.1f ms" % (diff * 1000.,)
+    def bench_model (self):
 
-        start_time = time.time ()
-        model = GUI.LazyLogModel (self.log_file)
+        self.ensure_model ()
+        model = LazyLogModel (self.log_file)
+        n_lines = 0
         for row in model:
-            pass
-        diff = time.time () - start_time
-        print "model iterated in %0.1f ms" % (diff * 1000.,)
-        print "overall time spent: %0.1f s" % (time.time () - self.start_time,)
+            n_lines += 1
+        return n_lines
 
-        import resource
-        rusage = resource.getrusage (resource.RUSAGE_SELF)
-        print "time spent in user mode: %.2f s" % (rusage.ru_utime,)
-        print "time spent in system mode: %.2f s" % (rusage.ru_stime,)
+    def bench_columns (self):
+        """Get the values of each column for all lines, one column after the
+        other, the way sorting a column or bisecting timestamps does."""
+
+        self.ensure_model ()
+        model = LazyLogModel (self.log_file)
+        n_lines = len (model.line_offsets)
+        get_value = model.on_get_value
+        columns = {}
+        for col_id, name in enumerate (model.columns[::2]):
+            start_time = time.time ()
+            for i in xrange (n_lines):
+                get_value (i, col_id)
+            columns[name[len ("COL_"):].lower ()] = time.time () - start_time
+
+        stats = model.get_parse_stats ()
+        for name, seconds in columns.iteritems ():
+            stats[name]["seconds"] = seconds
+        self.extra_results["columns"] = stats
+        return n_lines * len (columns)
+
+    def bench_filter (self):
+        """Apply the same filters using the column store, and by reading the
+        rows as it is done while the column store is incomplete."""
+
+        from GstDebugViewer.GUI.filters import CategoryFilter, DebugLevelFilter
+
+        self.ensure_model ()
+        mode = DebugLevelFilter.all_but_this
+        paths = {}
+        for path in ("columns", "rows",):
+            model = LazyLogModel (self.log_file)
+            if path == "rows":
+                model.line_fields = None
+            start_time = time.time ()
+            log_filter = FilteredLogModel (model)
+            log_filter.add_filter (DebugLevelFilter (Data.debug_level_debug,
+                                                     mode),
+                                   self.dispatcher)
+            log_filter.add_filter (CategoryFilter ("GST_DUMMY"),
+                                   self.dispatcher)
+            paths[path] = {"seconds" : time.time () - start_time,
+                           "kept_lines" : len (log_filter.line_offsets)}
+        self.extra_results["filter"] = paths
+        return 2 * len (self.model)
+
+    def bench_search (self):
+
+        from GstDebugViewer.Plugins.FindBar import SearchOperation, SearchSentinel
+
+        self.ensure_model ()
+        sentinel = SearchSentinel ()
+        sentinel.dispatcher = self.dispatcher
+        operation = SearchOperation (self.model, self.search_text)
+        sentinel.run_for (operation)
+        return len (self.model)
+
+    def bench_timeline (self):
+
+        from GstDebugViewer.Plugins.Timeline import (LineFrequencySentinel,
+                                                     LevelDistributionSentinel)
+
+        self.ensure_model ()
+        freq_sentinel = LineFrequencySentinel (self.model)
+        dist_sentinel = LevelDistributionSentinel (freq_sentinel, self.model)
+        freq_sentinel.run_for (1000)
+        self.dispatcher (freq_sentinel.process ())
+        self.dispatcher (dist_sentinel.process ())
+        return len (self.model)
 
 def main ():
 
-    if len (sys.argv) > 1:
-        test = TestParsingPerformance (sys.argv[1])
-        test.start ()
+    import json
+    import tempfile
+    from optparse import OptionParser
+
+    parser = OptionParser (usage = "%prog [options] [LOG-FILE]")
+    parser.add_option ("-b", "--benchmark", action = "append", default = [],
+                       metavar = "NAME",
+                       help = "run only this benchmark (repeatable; one of %s)"
+                       % (", ".join (Benchmark.names),))
+    parser.add_option ("-r", "--repeat", type = "int", default = 1,
+                       help = "run each benchmark this often and report the "
+                       "best time (default: %default)")
+    parser.add_option ("-n", "--lines", type = "int", default = 100000,
+                       help = "lines in the synthetic log (default: %default)")
+    parser.add_option ("-t", "--threads", type = "int", default = 4,
+                       help = "threads in the synthetic log (default: %default)")
+    parser.add_option ("--burst", type = "int", default = 20,
+                       help = "average lines a thread logs before switching "
+                       "threads in the synthetic log (default: %default)")
+    parser.add_option ("--jitter", type = "int", default = 50000,
+                       help = "maximum write delay in nanoseconds in the "
+                       "synthetic log (default: %default)")
+    parser.add_option ("--search", default = "number 4242",
+                       help = "text to search for (default: %default)")
+    parser.add_option ("-o", "--output", metavar = "FILE",
+                       help = "write the JSON results to FILE")
+    options, args = parser.parse_args ()
+
+    if len (args) > 1:
+        parser.error ("too many arguments")
+
+    temp_path = None
+    if args:
+        filename = args[0]
+        log_params = None
+    else:
+        create_test_log = load_test_log_module ()
+        fd, temp_path = tempfile.mkstemp (prefix = "gst-debug-viewer-bench",
+                                          suffix = ".log")
+        with os.fdopen (fd, "wb") as fileobj:
+            create_test_log.write_log (fileobj, options.lines,
+                                       n_threads = options.threads,
+                                       burst = options.burst,
+                                       jitter = options.jitter)
+        filename = temp_path
+        log_params = {"lines" : options.lines,
+                      "threads" : options.threads,
+                      "burst" : options.burst,
+                      "jitter" : options.jitter}
+
+    try:
+        benchmark = Benchmark (filename, options.search, options.repeat)
+        names = options.benchmark or benchmark.names
+        for name in names:
+            if name not in benchmark.names:
+                parser.error ("unknown benchmark %r" % (name,))
+
+        results = {"file" : filename if temp_path is None else None,
+                   "file_size" : os.path.getsize (filename),
+                   "synthetic" : log_params,
+                   "python" : sys.version.split ()[0],
+                   "benchmarks" : [benchmark.run (name) for name in names],
+                   "peak_rss_kib" : get_peak_rss ()}
+    finally:
+        if temp_path is not None:
+            os.unlink (temp_path)
+
+    if options.output:
+        with open (options.output, "w") as fileobj:
+            json.dump (results, fileobj, indent = 2, sort_keys = True)
+    else:
+        json.dump (results, sys.stdout, indent = 2, sort_keys = True)
+        sys.stdout.write ("\n")
 
 if __name__ == "__main__":
     main ()
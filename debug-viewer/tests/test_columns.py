@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the log view columns."""
+
+import sys
+import os
+import os.path
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import TestCase, main as test_main
+
+from GstDebugViewer import Data
+from GstDebugViewer.GUI.columns import Highlighters, MessageColumn
+from GstDebugViewer.GUI.models import LazyLogModel
+
+from test_data import LogTestCase, line_string
+
+class TestHighlighters (TestCase):
+
+    def test_version (self):
+
+        highlighters = Highlighters ()
+        find = lambda message: ()
+        self.assertEquals (highlighters.version, 0)
+
+        highlighters["a"] = find
+        highlighters["b"] = find
+        self.assertEquals (highlighters.version, 2)
+        self.assertEquals (highlighters.color_indices, {"a" : 0, "b" : 1})
+
+        # Replacing a highlighter keeps the color of its owner:
+        highlighters["a"] = lambda message: ((0, 1,),)
+        self.assertEquals (highlighters.version, 3)
+        self.assertEquals (highlighters.color_indices, {"a" : 0, "b" : 1})
+
+        # A new owner gets the lowest free color:
+        del highlighters["a"]
+        self.assertEquals (highlighters.version, 4)
+        self.assertEquals (highlighters.color_indices, {"b" : 1})
+        highlighters["c"] = find
+        highlighters["d"] = find
+        self.assertEquals (highlighters.version, 6)
+        self.assertEquals (highlighters.color_indices,
+                           {"b" : 1, "c" : 0, "d" : 2})
+
+        self.assertRaises (KeyError, highlighters.__delitem__, "a")
+        self.assertEquals (highlighters.version, 6)
+
+        highlighters.clear ()
+        self.assertEquals (highlighters.version, 7)
+        self.assertEquals (len (highlighters), 0)
+        self.assertEquals (highlighters.color_indices, {})
+
+class CellProps (object):
+
+    text = None
+    markup = None
+
+class Cell (object):
+
+    """Stands in for the cell renderer, keeping the properties that the data
+    function sets."""
+
+    def __init__ (self):
+
+        self.props = CellProps ()
+
+class TestMessageColumn (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        self.messages = ["message %i <%i>" % (i, i % 3,) for i in range (20)]
+        lines = [line_string (i, 1, Data.debug_level_info, "A", message)
+                 for i, message in enumerate (self.messages)]
+        self.log_file = self.load (self.make_log (lines))
+        self.model = LazyLogModel (self.log_file)
+
+        self.column = MessageColumn ()
+        # Messages that the highlighters were called for:
+        self.calls = []
+
+    def span (self, color_index, text):
+
+        foreground, background = self.column.color_theme.colors[color_index]
+        return ("<span foreground='%s' background='%s'>%s</span>"
+                % (foreground.hex_string (), background.hex_string (), text,))
+
+    def find (self, string):
+
+        def highlighter (message):
+            self.calls.append (message)
+            start = message.find (string)
+            if start == -1:
+                return ()
+            return ((start, start + len (string),),)
+        return highlighter
+
+    def render (self, data_func, row, model = None):
+
+        if model is None:
+            model = self.model
+        cell = Cell ()
+        data_func (None, cell, model, model.get_iter ((row,)), None)
+        return cell.props
+
+    def test_markup (self):
+
+        column = self.column
+        highlighters = column.highlighters
+        self.assertEquals (column.get_markup ("message"), None)
+
+        highlighters["a"] = self.find ("sage 1")
+        highlighters["b"] = self.find ("ess")
+        # Where the ranges overlap, the lower color index wins:
+        self.assertEquals (column.get_markup ("message 12 <0>"),
+                           "m" + self.span (1, "es") + self.span (0, "sage 1") +
+                           "2 &lt;0&gt;")
+        self.assertEquals (column.get_markup ("message 2"),
+                           "m" + self.span (1, "ess") + "age 2")
+        self.assertEquals (column.get_markup ("nothing"), None)
+
+        # Nested and adjacent ranges, and ranges past the end:
+        highlighters["c"] = lambda message: ((0, 4,), (1, 2,), (4, 100,),)
+        self.assertEquals (column.get_markup ("message 12"),
+                           self.span (2, "m") + self.span (1, "es") +
+                           self.span (0, "sage 1") + self.span (2, "2"))
+
+        del highlighters["a"]
+        self.assertEquals (column.get_markup ("message 12"),
+                           self.span (2, "m") + self.span (1, "ess") +
+                           self.span (2, "age 12"))
+
+    def test_cache (self):
+
+        column = self.column
+        column.markup_cache_size = 4
+        data_func = column.get_data_func ()
+
+        # Without highlighters, the plain text is shown:
+        props = self.render (data_func, 3)
+        self.assertEquals (props.text, "message 3 <0>")
+        self.assertEquals (props.markup, None)
+
+        column.highlighters["a"] = self.find ("<1>")
+        for row in range (4):
+            self.render (data_func, row)
+        self.assertEquals (len (self.calls), 4)
+        self.assertEquals (self.render (data_func, 1).markup,
+                           "message 1 " + self.span (0, "&lt;1&gt;"))
+        self.assertEquals (self.render (data_func, 2).markup,
+                           "message 2 &lt;2&gt;")
+        self.assertEquals (len (self.calls), 4)
+
+        # Row 0 was used least recently, and goes for row 4:
+        self.render (data_func, 4)
+        self.assertEquals (len (self.calls), 5)
+        for row in (1, 2, 3, 4,):
+            self.render (data_func, row)
+        self.assertEquals (len (self.calls), 5)
+        self.render (data_func, 0)
+        self.assertEquals (self.calls[5:], [self.messages[0]])
+
+        # Setting or removing a highlighter changes the version in the key:
+        column.highlighters["b"] = self.find ("message 4")
+        self.render (data_func, 4)
+        self.assertEquals (self.calls[6:], [self.messages[4]] * 2)
+        self.render (data_func, 4)
+        self.assertEquals (len (self.calls), 8)
+        del column.highlighters["b"]
+        self.assertEquals (self.render (data_func, 4).markup,
+                           "message 4 " + self.span (0, "&lt;1&gt;"))
+        self.assertEquals (self.calls[8:], [self.messages[4]])
+
+        # The offsets of another model refer to another file:
+        other_model = LazyLogModel (self.log_file)
+        self.render (data_func, 4, other_model)
+        self.assertEquals (len (self.calls), 10)
+        self.render (data_func, 4, other_model)
+        self.assertEquals (len (self.calls), 10)
+
+if __name__ == "__main__":
+    test_main ()
@@ -0,0 +1,815 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the data module."""
+
+import sys
+import os
+import os.path
+import shutil
+import tempfile
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import TestCase, main as test_main
+
+from GstDebugViewer import Common, Data
+
+def line_string (ts, thread, level, category, message):
+
+    return "%s %5d 0x%x %s %20s dummy.c:1:dummy:<dummy> %s\n" % (
+        Data.time_args (ts), 1234, thread, level.name.ljust (5), category,
+        message,)
+
+def write_log (filename, lines):
+
+    with open (filename, "wb") as fileobj:
+        for line in lines:
+            fileobj.write (line)
+
+class LogTestCase (TestCase):
+
+    def setUp (self):
+
+        self.temp_dir = tempfile.mkdtemp (prefix = "gst-debug-viewer-test")
+        self.old_cache_home = os.environ.get ("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = os.path.join (self.temp_dir, "cache")
+
+    def tearDown (self):
+
+        shutil.rmtree (self.temp_dir)
+        if self.old_cache_home is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = self.old_cache_home
+
+    def make_log (self, lines, name = "test.log"):
+
+        filename = os.path.join (self.temp_dir, name)
+        write_log (filename, lines)
+        return filename
+
+    def load (self, filename, **kw):
+
+        log_file = Data.LogFile (filename, Common.Data.DefaultDispatcher (),
+                                 **kw)
+        log_file.start_loading ()
+        return log_file
+
+class TestLineIndex (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        self.old_min_log_size = Data.LineIndex.min_log_size
+        Data.LineIndex.min_log_size = 0
+
+    def tearDown (self):
+
+        Data.LineIndex.min_log_size = self.old_min_log_size
+
+        LogTestCase.tearDown (self)
+
+    def test_roundtrip (self):
+
+        levels = (Data.debug_level_debug, Data.debug_level_warning,
+                  Data.debug_level_log,)
+        # Second thread lags behind, so some lines need sorting:
+        lines = []
+        for i in range (100):
+            lines.append (line_string (i * 10, 1, levels[i % 3], "A", i))
+            if i % 10 == 9:
+                lines.append (line_string (i * 10 - 55, 2, levels[0], "B", i))
+        filename = self.make_log (lines)
+
+        log_file = self.load (filename)
+        offsets = list (log_file.line_cache.offsets)
+        line_levels = list (log_file.line_cache.levels)
+        self.assertTrue (os.path.exists (filename + Data.LineIndex.suffix))
+
+        indexed_log_file = self.load (filename)
+        self.assertEquals (list (indexed_log_file.line_cache.offsets), offsets)
+        self.assertEquals (list (indexed_log_file.line_cache.levels),
+                           line_levels)
+        order = indexed_log_file.line_cache.get_file_order ()
+        self.assertEquals ([offsets[i] for i in order], sorted (offsets))
+
+    def test_stale (self):
+
+        filename = self.make_log ([line_string (i, 1, Data.debug_level_info,
+                                                "A", i)
+                                   for i in range (10)])
+        self.load (filename)
+
+        with open (filename, "ab") as fileobj:
+            fileobj.write (line_string (10, 1, Data.debug_level_info, "A", 10))
+
+        log_file = self.load (filename)
+        self.assertEquals (len (log_file.line_cache.offsets), 11)
+        self.assertEquals (log_file.line_cache.get_file_order (), None)
+
+class TestWideOffsets (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        self.old_offset_array = Data.offset_array
+
+    def tearDown (self):
+
+        Data.offset_array = self.old_offset_array
+
+        LogTestCase.tearDown (self)
+
+    def test_fallback (self):
+
+        # Used where no array typecode has 8 bytes:
+        self.assertEquals (Data._unsigned_typecode (16), None)
+
+        values = [0, 1, 2 ** 32 + 5, 2 ** 48 * 31 + 3, 2 ** 53 - 1]
+        wide = Data._WideOffsetArray (values)
+        self.assertEquals (list (wide), values)
+        self.assertEquals ([wide[i] for i in range (len (values))], values)
+        self.assertTrue (all (isinstance (value, (int, long,))
+                              for value in wide))
+        self.assertTrue (isinstance (wide[1:3], Data._WideOffsetArray))
+        self.assertEquals (list (wide[1:3]), values[1:3])
+        self.assertEquals (list (wide[::2]), values[::2])
+        wide.extend (Data._WideOffsetArray ([7]))
+        wide.append (8)
+        self.assertEquals (list (wide[-2:]), [7, 8])
+
+        lines = [line_string (i * 10 ** 9, i % 3, Data.debug_level_info,
+                              "A", i)
+                 for i in range (50)]
+        filename = self.make_log (lines)
+        expected = self.load (filename, use_index = False)
+        Data.offset_array = Data._WideOffsetArray
+        log_file = self.load (filename, use_index = False)
+
+        offsets = log_file.line_cache.offsets
+        self.assertTrue (isinstance (offsets, Data._WideOffsetArray))
+        self.assertEquals (list (offsets), list (expected.line_cache.offsets))
+        self.assertEquals (list (log_file.lines), list (expected.lines))
+        for fields in (log_file.fields, expected.fields,):
+            for x in fields.process ():
+                pass
+        self.assertEquals (list (log_file.fields.columns[0]),
+                           list (expected.fields.columns[0]))
+
+class TestSorting (LogTestCase):
+
+    def test_interleaved_threads (self):
+
+        import random
+
+        rand = random.Random ()
+        rand.seed (74205)
+        # Each thread logs in order, but the threads' output gets interleaved
+        # with random delays:
+        pending = [[] for thread in range (8)]
+        for i in range (1000):
+            pending[rand.randrange (8)].append (i)
+        lines = []
+        while any (pending):
+            thread = rand.choice ([t for t in range (8) if pending[t]])
+            for i in range (rand.randint (1, 5)):
+                if not pending[thread]:
+                    break
+                ts = pending[thread].pop (0)
+                lines.append (line_string (ts // 2, thread + 1,
+                                           Data.debug_level_info, "A", ts))
+        filename = self.make_log (lines)
+
+        log_file = self.load (filename, use_index = False)
+        messages = [int (line[-1]) for line in log_file.lines]
+        self.assertEquals (len (messages), 1000)
+        # Timestamps are ts // 2, so some of them are equal:
+        timestamps = [ts // 2 for ts in messages]
+        self.assertEquals (timestamps, sorted (timestamps))
+
+        offsets = log_file.line_cache.offsets
+        order = log_file.line_cache.get_file_order ()
+        self.assertEquals ([offsets[i] for i in order], sorted (offsets))
+
+class TestParallelLoad (LogTestCase):
+
+    def test_same_as_serial (self):
+
+        lines = []
+        for i in range (2000):
+            lines.append (line_string (i * 10, 1, Data.debug_level_log, "A", i))
+            if i % 100 == 99:
+                # Out of order line, possibly crossing a chunk boundary:
+                lines.append (line_string (i * 10 - 995, 2,
+                                           Data.debug_level_error, "B", i))
+        filename = self.make_log (lines)
+
+        serial = self.load (filename, use_index = False)
+
+        old_sizes = (Data.LineCache._parallel_min_size,
+                     Data.LineCache._parallel_chunk_size,)
+        Data.LineCache._parallel_min_size = 0
+        Data.LineCache._parallel_chunk_size = 4096
+        try:
+            parallel = self.load (filename, use_index = False)
+        finally:
+            (Data.LineCache._parallel_min_size,
+             Data.LineCache._parallel_chunk_size,) = old_sizes
+
+        self.assertEquals (list (parallel.line_cache.offsets),
+                           list (serial.line_cache.offsets))
+        self.assertEquals (list (parallel.line_cache.levels),
+                           list (serial.line_cache.levels))
+
+class TestLineFields (LogTestCase):
+
+    def test_columns (self):
+
+        levels = (Data.debug_level_debug, Data.debug_level_warning,)
+        categories = ("A", "B", "C",)
+        filename = self.make_log ([line_string (i, i % 4, levels[i % 2],
+                                                categories[i % 3], i)
+                                   for i in range (100)])
+        log_file = self.load (filename)
+
+        fields = log_file.fields
+        self.assertFalse (fields.is_complete ())
+        for i in fields.process ():
+            pass
+        self.assertTrue (fields.is_complete ())
+        self.assertEquals (len (fields), 100)
+
+        lines = [log_file.get_full_line (i) for i in range (100)]
+        indices = range (0, 100, 7)
+        # Time and thread:
+        for col_id in (0, 2,):
+            self.assertEquals (list (fields.take (col_id, indices)),
+                               [lines[i][col_id] for i in indices])
+        self.assertEquals (list (fields.take (3, indices)),
+                           [log_file.line_cache.levels[i] for i in indices])
+
+        col_id = 4  # Category.
+        category_ids = fields.take (col_id, xrange (100))
+        self.assertEquals ([fields.strings[col_id][i] for i in category_ids],
+                           [line[col_id] for line in lines])
+        self.assertEquals (fields.get_string_id (col_id, "D"), None)
+
+    def test_wide_columns (self):
+
+        # The id and message offset columns start with two bytes per item:
+        n_lines = 0x10000 + 10
+        filename = self.make_log ([line_string (i, 0, Data.debug_level_debug,
+                                                "c%i" % (i,), "message")
+                                   for i in range (n_lines - 1)] +
+                                  [line_string (n_lines, 0,
+                                                Data.debug_level_debug,
+                                                "C" * 0x10000, "last")])
+        log_file = self.load (filename)
+
+        fields = log_file.fields
+        self.assertEquals (fields.columns[4].typecode, "H")
+        self.assertEquals (fields.columns[9].typecode, "H")
+        for i in fields.process ():
+            pass
+        self.assertEquals (fields.columns[4].typecode, "I")
+        self.assertEquals (fields.columns[9].typecode, "I")
+
+        col_id = 4  # Category.
+        indices = (0, 1, 0xffff, 0x10000, n_lines - 2,)
+        self.assertEquals ([fields.strings[col_id][i]
+                            for i in fields.take (col_id, indices)],
+                           ["c%i" % (i,) for i in indices])
+        self.assertEquals (fields.get_messages ((0, n_lines - 1,)),
+                           ["message", "last"])
+
+    def test_request (self):
+
+        filename = self.make_log ([line_string (0, 0, Data.debug_level_debug,
+                                                "A", "message")])
+        log_file = self.load (filename)
+
+        fields = log_file.fields
+        requests = []
+        fields.handle_request = lambda: requests.append (len (fields))
+        self.assertFalse (fields.requested)
+        fields.request ()
+        fields.request ()
+        self.assertTrue (fields.requested)
+        self.assertEquals (requests, [0])
+
+class TestLogStatistics (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        self.old_min_log_size = Data.LineIndex.min_log_size
+        Data.LineIndex.min_log_size = 0
+
+    def tearDown (self):
+
+        Data.LineIndex.min_log_size = self.old_min_log_size
+
+        LogTestCase.tearDown (self)
+
+    def get_statistics (self, log_file):
+
+        statistics = Data.LogStatistics (log_file.fields,
+                                         log_file.line_cache.index)
+        statistics._lines_per_iteration = 7
+        # Starts before any fields are parsed, and stops right away:
+        for x in statistics.process ():
+            pass
+        self.assertEquals (statistics.n_lines, 0)
+        self.assertFalse (os.path.exists (log_file.path +
+                                          Data.LogStatistics.suffix))
+
+        # Runs again for every batch of parsed lines:
+        def resume ():
+            self.assertFalse (statistics.is_complete ())
+            for x in statistics.process ():
+                pass
+            self.assertEquals (statistics.n_lines, len (log_file.fields))
+        log_file.fields.progress_handlers.append (resume)
+        for x in log_file.fields.process ():
+            pass
+        return statistics
+
+    def test_counts (self):
+
+        levels = (Data.debug_level_debug, Data.debug_level_warning,)
+        categories = ("A", "B", "C",)
+        filename = self.make_log ([line_string (i * 100000000, i % 4,
+                                                levels[i % 2],
+                                                categories[i % 3], i)
+                                   for i in range (100)])
+        log_file = self.load (filename)
+        log_file.fields._lines_per_iteration = 10
+
+        statistics = self.get_statistics (log_file)
+        self.assertTrue (statistics.is_complete ())
+        self.assertEquals (statistics.get_counts (3),
+                           [(Data.debug_level_warning, 50,),
+                            (Data.debug_level_debug, 50,)])
+        self.assertEquals (statistics.get_counts (4),
+                           [("A", 34,), ("B", 33,), ("C", 33,)])
+        self.assertEquals (statistics.get_counts (2),
+                           [(0, 25,), (1, 25,), (2, 25,), (3, 25,)])
+        self.assertEquals (statistics.get_counts (5), [("dummy.c", 100,)])
+        self.assertEquals (statistics.rate, dict ((i, 10,) for i in range (10)))
+        self.assertEquals (statistics.get_top_call_sites (5),
+                           [(("dummy.c", 1, "dummy",), 100,)])
+
+        # Loaded from the cache:
+        self.assertTrue (os.path.exists (filename +
+                                         Data.LogStatistics.suffix))
+        cached = Data.LogStatistics (log_file.fields,
+                                     log_file.line_cache.index)
+        self.assertTrue (cached.load ())
+        self.assertEquals (cached.n_lines, 100)
+        for field in Data.LogStatistics.count_fields:
+            self.assertEquals (cached.get_counts (field),
+                               statistics.get_counts (field))
+        self.assertEquals (repr (cached.get_counts (3)[0][0]),
+                           repr (Data.debug_level_warning))
+        self.assertEquals (cached.rate, statistics.rate)
+        self.assertEquals (cached.call_sites, statistics.call_sites)
+
+class TestLineGroupIndex (LogTestCase):
+
+    def test_groups (self):
+
+        lines = []
+        for i in range (100):
+            thread = (i // 3) % 4
+            object_ = "" if i % 5 == 0 else "obj%i" % (i % 7,)
+            lines.append (line_string (i, thread, Data.debug_level_info,
+                                       "A", i).replace ("<dummy>",
+                                                        "<%s>" % (object_,)))
+        filename = self.make_log (lines)
+        log_file = self.load (filename)
+        log_file.fields._lines_per_iteration = 10
+
+        index = Data.LineGroupIndex (log_file.fields)
+        index._lines_per_iteration = 7
+        def resume ():
+            for x in index.process ():
+                pass
+        log_file.fields.progress_handlers.append (resume)
+        for x in log_file.fields.process ():
+            pass
+        self.assertTrue (index.is_complete ())
+
+        rows = [log_file.get_full_line (i) for i in range (100)]
+        for thread in range (4):
+            self.assertEquals (list (index.get_lines (2, thread)),
+                               [i for i, row in enumerate (rows)
+                                if row[2] == thread])
+        for i in range (7):
+            object_ = "obj%i" % (i,)
+            self.assertEquals (list (index.get_lines (8, object_)),
+                               [j for j, row in enumerate (rows)
+                                if row[8] == object_])
+        self.assertEquals (list (index.get_lines (8, "")), [])
+        self.assertEquals (list (index.get_lines (8, "none")), [])
+        self.assertEquals (index.get_keys (2), [0, 1, 2, 3])
+        self.assertEquals ([index.get_name (8, key)
+                            for key in index.get_keys (8)],
+                           ["obj1", "obj2", "obj3", "obj4", "obj6", "obj0",
+                            "obj5",])
+
+class TestUpdate (LogTestCase):
+
+    def test_append (self):
+
+        lines = [line_string (i, 1, Data.debug_level_info, "A", i)
+                 for i in range (30)]
+        filename = self.make_log (lines[:10])
+        log_file = self.load (filename, use_index = False)
+        self.assertEquals (log_file.update (), (10, 10,))
+
+        with open (filename, "ab") as fileobj:
+            fileobj.write ("".join (lines[10:20]))
+            # Line that is still being written:
+            fileobj.write (lines[20][:-3])
+        self.assertEquals (log_file.update (), (10, 21,))
+
+        with open (filename, "ab") as fileobj:
+            fileobj.write (lines[20][-3:])
+            fileobj.write ("".join (lines[21:]))
+        self.assertEquals (log_file.update (), (21, 30,))
+
+        self.assertEquals ([int (line[-1]) for line in log_file.lines],
+                           range (30))
+
+    def test_chunks (self):
+
+        lines = [line_string (i, 1, Data.debug_level_info, "A", i)
+                 for i in range (10, 40)]
+        filename = self.make_log (lines[:10])
+        log_file = self.load (filename, use_index = False)
+        # Scans four lines per update:
+        log_file.line_cache._update_chunk_size = 4 * len (lines[0])
+
+        with open (filename, "ab") as fileobj:
+            fileobj.write ("".join (lines[10:]))
+        self.assertEquals ([log_file.update () for i in range (6)],
+                           [(10, 14,), (14, 18,), (18, 22,), (22, 26,),
+                            (26, 30,), (30, 30,)])
+        self.assertEquals ([int (line[-1]) for line in log_file.lines],
+                           range (10, 40))
+
+    def test_sorted_lines (self):
+
+        filename = self.make_log ([line_string (i, 1, Data.debug_level_info,
+                                                "A", i)
+                                   for i in range (10)])
+        log_file = self.load (filename, use_index = False)
+        fields = log_file.fields
+        for x in fields.process ():
+            pass
+        self.assertEquals (fields.n_sorted_lines, 10)
+
+        # The appended lines are sorted among themselves, but a line with an
+        # earlier timestamp than the last one breaks the order:
+        for timestamps, n_sorted in (((21, 20,), 12,), ((15, 30,), 12,),
+                                     ((40,), 12,),):
+            with open (filename, "ab") as fileobj:
+                for ts in timestamps:
+                    fileobj.write (line_string (ts, 1, Data.debug_level_info,
+                                                "A", ts))
+            log_file.update ()
+            for x in fields.process ():
+                pass
+            self.assertEquals (fields.n_sorted_lines, n_sorted)
+        self.assertEquals (list (fields.columns[0][:12]),
+                           range (10) + [20, 21])
+
+class TestMerged (LogTestCase):
+
+    def test_merge (self):
+
+        # Two processes logging alternately, with equal timestamps at times:
+        lines_a = [line_string (i * 2, 1, Data.debug_level_info, "A",
+                                "a%i" % (i,))
+                   for i in range (50)]
+        lines_b = [line_string (i * 3, 2, Data.debug_level_warning, "B",
+                                "b%i" % (i,))
+                   for i in range (40)]
+        filenames = [self.make_log (lines_a, "a.log"),
+                     self.make_log (lines_b, "b.log")]
+        log_file = Data.MergedLogFile (filenames,
+                                       Common.Data.DefaultDispatcher ())
+        log_file.start_loading ()
+
+        self.assertEquals (log_file.get_load_progress (), 1.)
+        self.assertEquals (len (log_file.line_cache.offsets), 90)
+        lines = [log_file.get_full_line (i) for i in range (90)]
+        expected = sorted ([(i * 2, 0, "a%i" % (i,),) for i in range (50)] +
+                           [(i * 3, 1, "b%i" % (i,),) for i in range (40)])
+        self.assertEquals ([(line[0], line[2] - 1, line[-1].rstrip (),)
+                            for line in lines], expected)
+        levels = (Data.debug_level_info, Data.debug_level_warning,)
+        self.assertEquals (list (log_file.line_cache.levels),
+                           [levels[line[2] - 1] for line in lines])
+        self.assertEquals ([line[-1] for line in log_file.lines],
+                           [line[-1] for line in lines])
+
+        fields = log_file.fields
+        for i in fields.process ():
+            pass
+        self.assertEquals (list (fields.take (0, xrange (90))),
+                           [line[0] for line in lines])
+        self.assertEquals (list (fields.take (2, xrange (90))),
+                           [line[2] for line in lines])
+
+        with open (filenames[1], "ab") as fileobj:
+            fileobj.write (line_string (200, 2, Data.debug_level_info, "B",
+                                        "b40"))
+        self.assertEquals (log_file.update (), (90, 91,))
+        self.assertEquals (log_file.get_full_line (90)[-1], "b40\n")
+
+class TestLineExport (LogTestCase):
+
+    def test_subset (self):
+
+        from StringIO import StringIO
+
+        lines = [line_string (i, 1, Data.debug_level_info, "A", i)
+                 for i in range (100)]
+        # Last line without a newline:
+        lines[-1] = lines[-1][:-1]
+        filename = self.make_log (lines)
+        log_file = self.load (filename)
+
+        offsets = log_file.line_cache.offsets
+        indices = range (0, 20) + range (25, 60, 3) + range (70, 100)
+        line_export = Data.LineExport (log_file.fileobj,
+                                       [offsets[i] for i in reversed (indices)])
+        # Small enough to split runs of lines and batches:
+        line_export.buffer_size = 200
+        line_export._lines_per_iteration = 7
+        out = StringIO ()
+        for x in line_export.process (out):
+            pass
+
+        self.assertTrue (line_export.is_complete ())
+        self.assertEquals (out.getvalue (),
+                           "".join ([lines[i] for i in indices]) + "\n")
+
+class TestCompressed (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+        self.old_block_size = Data.CompressedFile.block_size
+        # Small blocks, so that lines cross block boundaries:
+        Data.CompressedFile.block_size = 1000
+
+        self.lines = [line_string (i, 1 + i % 3, Data.debug_level_info, "A",
+                                   "message %i" % (i,))
+                      for i in range (500)]
+        self.filename = self.make_log (self.lines)
+
+    def tearDown (self):
+
+        Data.CompressedFile.block_size = self.old_block_size
+        LogTestCase.tearDown (self)
+
+    def assertSameAsPlain (self, filename, use_index = False):
+
+        plain = self.load (self.filename, use_index = False)
+        log_file = self.load (filename, use_index = use_index)
+
+        self.assertTrue (isinstance (log_file.fileobj, Data.CompressedFile))
+        self.assertEquals (list (log_file.line_cache.offsets),
+                           list (plain.line_cache.offsets))
+        self.assertEquals (list (log_file.line_cache.levels),
+                           list (plain.line_cache.levels))
+        self.assertEquals (list (log_file.lines), list (plain.lines))
+        for i in (0, 7, 499, 250, 3,):
+            self.assertEquals (log_file.get_full_line (i),
+                               plain.get_full_line (i))
+        return log_file
+
+    def test_gzip (self):
+
+        import gzip
+
+        filename = self.filename + ".gz"
+        with open (filename, "wb") as fileobj:
+            # Two members, like written by parallel compressors:
+            for part in (self.lines[:123], self.lines[123:],):
+                member = gzip.GzipFile (fileobj = fileobj, mode = "wb")
+                member.write ("".join (part))
+                member.close ()
+
+        log_file = self.assertSameAsPlain (filename)
+
+        data = log_file.fileobj
+        text = "".join (self.lines)
+        self.assertEquals (len (data), len (text))
+        self.assertEquals (data[995:1010], text[995:1010])
+        needle = self.lines[42][-20:]
+        self.assertEquals (data.find (needle), text.find (needle))
+        self.assertEquals (data.find ("no such text"), -1)
+
+    def test_gzip_index (self):
+
+        import gzip
+
+        filename = self.filename + ".gz"
+        fileobj = gzip.open (filename, "wb")
+        fileobj.write ("".join (self.lines))
+        fileobj.close ()
+
+        old_min_size = Data.LineIndex.min_log_size
+        Data.LineIndex.min_log_size = 0
+        try:
+            self.assertSameAsPlain (filename, use_index = True)
+            # Second load uses the index and only rebuilds the block index:
+            self.assertSameAsPlain (filename, use_index = True)
+        finally:
+            Data.LineIndex.min_log_size = old_min_size
+
+    def test_zstd (self):
+
+        try:
+            import zstandard
+        except ImportError:
+            return
+
+        filename = self.filename + ".zst"
+        compressor = zstandard.ZstdCompressor ()
+        with open (filename, "wb") as fileobj:
+            # Many small frames allow random access:
+            for i in range (0, len (self.lines), 50):
+                fileobj.write (compressor.compress (
+                    "".join (self.lines[i:i + 50])))
+
+        self.assertSameAsPlain (filename)
+
+class TestMessageIndex (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        words = ("pad", "caps", "Buffer", "event", "query",)
+        self.messages = ["%s %s %i" % (words[i % 5], words[i % 3], i,)
+                         for i in range (300)]
+        filename = self.make_log ([line_string (i, 1, Data.debug_level_info,
+                                                "A", message)
+                                   for i, message in enumerate (self.messages)])
+        self.log_file = self.load (filename)
+
+    def assertCandidates (self, index, string):
+
+        candidates = index.get_candidates ([string])
+        matches = [i for i, message in enumerate (self.messages)
+                   if string.lower () in message.lower ()]
+        self.assertEquals (list (candidates), sorted (candidates))
+        self.assertEquals ([i for i in candidates if i in matches], matches)
+
+    def test_candidates (self):
+
+        fields = self.log_file.fields
+        fields._lines_per_iteration = 100
+        index = Data.MessageIndex (fields)
+        # Stops when it caught up with the fields:
+        for x in index.process ():
+            pass
+        self.assertEquals (index.n_lines, 0)
+        self.assertEquals (index.get_candidates (["caps"]), None)
+
+        progress = []
+        def resume ():
+            for x in index.process ():
+                pass
+            progress.append (index.n_lines)
+        fields.progress_handlers.append (resume)
+        for x in fields.process ():
+            pass
+        self.assertEquals (progress, [100, 200, 300])
+        self.assertTrue (index.is_complete ())
+
+        for string in ("caps", "buffer pad", "event caps 1", "query",):
+            self.assertCandidates (index, string)
+        candidates = index.get_candidates (["caps 12"])
+        self.assertTrue (len (candidates) < 100)
+        self.assertEquals (list (index.get_candidates (["no such"])), [])
+        self.assertEquals (index.get_candidates (["ab"]), None)
+
+        self.assertEquals (Data.regex_literals (r"Buffer p\w+ \d+7"),
+                           ["Buffer p", " ", "7"])
+        self.assertEquals (Data.regex_literals ("caps|pad"), [])
+        self.assertEquals (list (index.get_regex_candidates (r"vent \w+ 29$")),
+                           list (index.get_candidates (["vent ", " 29"])))
+
+    def test_append (self):
+
+        fields = self.log_file.fields
+        index = Data.MessageIndex (fields)
+        for x in fields.process ():
+            pass
+        for x in index.process ():
+            pass
+
+        filename = self.log_file.path
+        with open (filename, "ab") as fileobj:
+            for i in range (300, 310):
+                message = "appended %i" % (i,)
+                self.messages.append (message)
+                fileobj.write (line_string (i, 1, Data.debug_level_info, "A",
+                                            message))
+        self.log_file.update ()
+        self.assertFalse (index.is_complete ())
+        for x in fields.process ():
+            pass
+        for x in index.process ():
+            pass
+        self.assertTrue (index.is_complete ())
+        self.assertEquals (index.n_lines, 310)
+        self.assertCandidates (index, "appended")
+        self.assertCandidates (index, "pad")
+
+class TestLogLine (TestCase):
+
+    def test_parse_prefix (self):
+
+        for ts, thread in ((0, 1,), (123456789012, 0x7f3a2c001e40,),
+                           (10 * 3600 * Data.SECOND + 5, 0xabc,),):
+            line = line_string (ts, thread, Data.debug_level_warning, "A",
+                                "message")
+            prefix = line[:Data.LogLine.prefix_size]
+            self.assertEquals (Data.LogLine.parse_prefix (prefix),
+                               Data.LogLine.parse_full (line)[:3])
+
+        colored = "\x1b[33m0:00:00.000000001\x1b[00m  1234 0x1 WARN A x\n"
+        self.assertEquals (Data.LogLine.parse_prefix (colored), None)
+        self.assertEquals (Data.LogLine.parse_prefix ("garbage\n"), None)
+
+class TestRowCache (TestCase):
+
+    def test_eviction (self):
+
+        cache = Data.RowCache (budget = 0)
+        capacity = cache.capacity
+        for offset in range (capacity):
+            cache[offset] = [offset]
+        self.assertEquals (len (cache), capacity)
+
+        # Rows in use and pinned rows survive a pass that streams through:
+        cache.pin ([1, 2])
+        self.assertEquals (cache.get (0), [0])
+        for offset in range (capacity, 3 * capacity):
+            self.assertEquals (cache.get (offset), None)
+            cache[offset] = [offset]
+            cache.get (0)
+        self.assertEquals (len (cache), capacity)
+        for offset in (0, 1, 2,):
+            self.assertTrue (offset in cache)
+        self.assertEquals (cache[3 * capacity - 1], [3 * capacity - 1])
+
+        stats = cache.get_stats ()
+        self.assertEquals (stats["misses"], 2 * capacity)
+        self.assertEquals (stats["hits"], 2 * capacity + 1)
+
+        # Grows rather than evicting a pinned row:
+        cache.clear ()
+        offsets = range (2 * capacity)
+        cache.pin (offsets)
+        for offset in offsets:
+            cache[offset] = [offset]
+        self.assertEquals (len (cache), 2 * capacity)
+        self.assertTrue (all (offset in cache for offset in offsets))
+        cache.pin ([])
+        cache[2 * capacity] = [2 * capacity]
+        self.assertEquals (len (cache), 2 * capacity)
+
+        cache.clear ()
+        self.assertEquals (len (cache), 0)
+        self.assertFalse (0 in cache)
+
+if __name__ == "__main__":
+    test_main ()
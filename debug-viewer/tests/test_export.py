@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for exporting from the command line."""
+
+import sys
+import os
+import os.path
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import main as test_main
+
+from StringIO import StringIO
+
+from GstDebugViewer import Common, Data, Main
+from GstDebugViewer.GUI.export import export, get_filters
+
+from test_data import LogTestCase, line_string
+
+class TestExport (LogTestCase):
+
+    levels = (Data.debug_level_error, Data.debug_level_warning,
+              Data.debug_level_info, Data.debug_level_debug,
+              Data.debug_level_trace,)
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        self.lines = [line_string (i * 10, 1, self.levels[i % 5], "A",
+                                   "message %i" % (i,))
+                      for i in range (100)]
+        self.filename = self.make_log (self.lines)
+        self.out_filename = os.path.join (self.temp_dir, "out.log")
+
+    def run_export (self, args, **options):
+        """Handle the options like the command line parser does after parsing
+        them, and run the export."""
+
+        options["export"] = self.out_filename
+        parser = Main.OptionParser (options)
+        parser.handle_parse_complete (args)
+        options["main"] (options)
+
+        with open (self.out_filename, "rb") as fileobj:
+            return fileobj.readlines ()
+
+    def assertLevel (self, level_name, n_levels):
+
+        self.assertEquals (self.run_export ([self.filename],
+                                            level = level_name),
+                           [line for i, line in enumerate (self.lines)
+                            if i % 5 < n_levels])
+
+    def test_level (self):
+
+        self.assertLevel ("ERROR", 1)
+        self.assertLevel ("warn", 2)
+        self.assertLevel ("TRACE", 5)
+        self.assertEquals (self.run_export ([self.filename]), self.lines)
+
+    def test_fields (self):
+
+        # Only the filters on other fields than the level need the column
+        # store:
+        dispatcher = Common.Data.DefaultDispatcher ()
+        warnings = [line for i, line in enumerate (self.lines) if i % 5 < 2]
+        for options, expected, parsed in (
+                ({}, self.lines, False,),
+                ({"level" : Data.debug_level_warning}, warnings, False,),
+                ({"level" : Data.debug_level_warning, "category" : "A"},
+                 warnings, True,),
+                ({"category" : "B"}, [], True,),):
+            log_file = self.load (self.filename)
+            fileobj = StringIO ()
+            self.assertEquals (export (log_file, get_filters (options),
+                                       fileobj, dispatcher),
+                               len (expected))
+            self.assertEquals (log_file.fields.is_complete (), parsed)
+            self.assertEquals (fileobj.getvalue (), "".join (expected))
+
+    def test_merged (self):
+
+        # The lines of both files alternate in the merged log:
+        other_lines = [line_string (i * 10 + 5, 2, Data.debug_level_info,
+                                    "B", "other %i" % (i,))
+                       for i in range (100)]
+        other_filename = self.make_log (other_lines, "other.log")
+        expected = []
+        for line, other_line in zip (self.lines, other_lines):
+            expected.extend ((line, other_line,))
+
+        self.assertEquals (self.run_export ([self.filename, other_filename]),
+                           expected)
+        self.assertEquals (self.run_export ([self.filename, other_filename],
+                                            category = "B"),
+                           other_lines)
+
+if __name__ == "__main__":
+    test_main ()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the filters."""
+
+import sys
+import os
+import os.path
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import main as test_main
+
+from GstDebugViewer import Data
+from GstDebugViewer.GUI.filters import (CategoryFilter,
+                                        DebugLevelFilter,
+                                        FilenameFilter,
+                                        MessageFilter,
+                                        ObjectFilter,
+                                        ThreadFilter,
+                                        TimeRangeFilter,)
+from GstDebugViewer.GUI.models import LogModelBase
+
+from test_data import LogTestCase, line_string
+
+class TestFilters (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        levels = (Data.debug_level_debug, Data.debug_level_warning,
+                  Data.debug_level_log,)
+        categories = ("A", "B", "C", "D",)
+        lines = [line_string (i * 10, i % 5, levels[i % 3],
+                              categories[i % 4], "message %i" % (i,))
+                 for i in range (200)]
+        self.log_file = self.load (self.make_log (lines))
+        for i in self.log_file.fields.process ():
+            pass
+        self.rows = [self.get_row (i) for i in range (200)]
+
+    def get_row (self, line_index):
+
+        row = self.log_file.get_full_line (line_index)
+        return row.complete (self.log_file.line_cache.levels[line_index],
+                             row[LogModelBase.COL_MESSAGE])
+
+    def assertBatch (self, filter):
+
+        batch_func = filter.get_batch_func (self.log_file.fields)
+        indices = range (1, 200, 3)
+        self.assertEquals (list (batch_func (indices)),
+                           [filter.filter_func (self.rows[i]) for i in indices])
+
+    def assertFilter (self, filter):
+
+        expected = [i for i in range (200) if filter.filter_func (self.rows[i])]
+        select_func = filter.get_select_func (self.log_file.fields)
+        self.assertEquals (select_func (xrange (200)), expected)
+        self.assertEquals (select_func (range (1, 200, 3)),
+                           [i for i in expected if i % 3 == 1])
+        return expected
+
+    def test_batch (self):
+
+        self.assertBatch (CategoryFilter ("A"))
+        self.assertBatch (CategoryFilter ("A", True))
+        self.assertBatch (CategoryFilter ("nonexistent", True))
+        self.assertBatch (ObjectFilter ("dummy"))
+        self.assertBatch (FilenameFilter ("dummy.c", True))
+        self.assertBatch (DebugLevelFilter (Data.debug_level_warning))
+        self.assertBatch (DebugLevelFilter (Data.debug_level_debug,
+                                            DebugLevelFilter.this_and_above))
+
+    def test_simple (self):
+
+        self.assertEquals (len (self.assertFilter (CategoryFilter ("A"))), 150)
+        self.assertEquals (len (self.assertFilter (CategoryFilter ("A", True))),
+                           50)
+        self.assertFilter (CategoryFilter ("nonexistent", True))
+        self.assertFilter (DebugLevelFilter (Data.debug_level_warning))
+        self.assertFilter (DebugLevelFilter (Data.debug_level_debug,
+                                             DebugLevelFilter.this_and_above))
+        self.assertEquals (len (self.assertFilter (ThreadFilter (3, True))), 40)
+        self.assertEquals (self.assertFilter (TimeRangeFilter (100, 200)),
+                           range (10, 20))
+        self.assertEquals (self.assertFilter (TimeRangeFilter (stop = 30)),
+                           range (3))
+        self.assertEquals (self.assertFilter (MessageFilter ("e 1[0-9]$")),
+                           range (10, 20))
+
+    def test_compound (self):
+
+        self.assertFilter (CategoryFilter ("A") & ThreadFilter (2) &
+                           DebugLevelFilter (Data.debug_level_warning) &
+                           TimeRangeFilter (500, 1500) &
+                           ~MessageFilter ("7"))
+        self.assertFilter (CategoryFilter ("A", True) |
+                           ThreadFilter (2, True) |
+                           MessageFilter ("9$"))
+        self.assertFilter (~(CategoryFilter ("B") |
+                             TimeRangeFilter (stop = 1000)) &
+                           ThreadFilter (4))
+
+if __name__ == "__main__":
+    test_main ()
@@ -30,11 +30,16 @@ sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
 from unittest import TestCase, main as test_main
 
 from GstDebugViewer import Common, Data
-from GstDebugViewer.GUI.filters import CategoryFilter, Filter
+from GstDebugViewer.GUI.filters import (CategoryFilter,
+                                        DebugLevelFilter,
+                                        Filter,)
 from GstDebugViewer.GUI.models import (FilteredLogModel,
+                                       LazyLogModel,
                                        LogModelBase,
-                                       RangeFilteredLogModel,
-                                       SubRange,)
+                                       SubRange,
+                                       combine_masks,)
+
+from test_data import LogTestCase, line_string
 
 class TestSubRange (TestCase):
 
@@ -70,6 +75,16 @@ class TestSubRange (TestCase):
         sr = SubRange (l, 5, 15)
         self.assertEquals (list (sr), range (5, 15))
 
+class TestCombineMasks (TestCase):
+
+    def test_combine (self):
+
+        masks = [bytearray ([1, 0, 1, 1]), bytearray ([1, 1, 0, 1])]
+        self.assertEquals (combine_masks (masks), bytearray ([1, 0, 0, 1]))
+        self.assertEquals (combine_masks (masks[:1]), masks[0])
+        self.assertEquals (combine_masks ([bytearray (), bytearray ()]),
+                           bytearray ())
+
 class Model (LogModelBase):
 
     def __init__ (self):
@@ -80,7 +95,7 @@ class Model (LogModelBase):
             self.line_offsets.append (i * 100)
             self.line_levels.append (Data.debug_level_debug)
 
-    def ensure_cached (self, line_offset):
+    def get_line (self, line_offset):
 
         pid = line_offset // 100
         if pid % 2 == 0:
@@ -90,14 +105,27 @@ class Model (LogModelBase):
 
         line_fmt = ("0:00:00.000000000 %5i 0x0000000 DEBUG "
                     "%20s dummy.c:1:dummy: dummy")
-        line_str = line_fmt % (pid, category,)
-        log_line = Data.LogLine.parse_full (line_str)
+        return line_fmt % (pid, category,)
+
+    def ensure_cached (self, line_offset):
+
+        log_line = Data.LogLine.parse_full (self.get_line (line_offset))
         self.line_cache[line_offset] = log_line
 
     def access_offset (self, line_offset):
 
         return ""
 
+    def access_prefix (self, line_offset):
+
+        return self.get_line (line_offset)[:Data.LogLine.prefix_size]
+
+    def read_rows (self, offsets, levels, messages = True):
+
+        for offset, level in zip (offsets, levels):
+            self.ensure_cached (offset)
+            yield self.line_cache[offset].complete (level, "")
+
 class IdentityFilter (Filter):
 
     def __init__ (self):
@@ -111,350 +139,289 @@ class RandomFilter (Filter):
     def __init__ (self, seed):
 
         import random
-        rand = random.Random ()
-        rand.seed (seed)
         def filter_func (row):
+            # Same decision for a row every time it is filtered:
+            rand = random.Random ("%i %i" % (seed, row[Model.COL_PID],))
             return rand.choice ((True, False,))
         self.filter_func = filter_func
 
 class TestDynamicFilter (TestCase):
 
-    def test_unset_filter_rerange (self):
+    def test_set_range (self):
 
-        full_model = Model ()
-        ranged_model = RangeFilteredLogModel (full_model)
-        # FIXME: Call to .reset should not be needed.
-        ranged_model.reset ()
-        filtered_model = FilteredLogModel (ranged_model)
+        filtered_model = FilteredLogModel (Model ())
         row_list = self.__row_list
+        dispatcher = Common.Data.DefaultDispatcher ()
 
-        self.assertEquals (row_list (full_model), range (20))
-        self.assertEquals (row_list (ranged_model), range (20))
         self.assertEquals (row_list (filtered_model), range (20))
 
-        ranged_model.set_range (5, 16)
-        filtered_model.super_model_changed_range ()
-
-        self.assertEquals (row_list (ranged_model), range (5, 16))
+        filtered_model.set_range (5, 16, dispatcher)
         self.assertEquals (row_list (filtered_model), range (5, 16))
-
         self.assertEquals ([filtered_model.line_index_from_super (i)
-                            for i in range (11)],
-                           range (11))
-        self.assertEquals ([filtered_model.line_index_to_super (i)
-                            for i in range (11)],
-                           range (11))
-        self.assertEquals ([filtered_model.line_index_from_top (i)
                             for i in range (5, 16)],
                            range (11))
-        self.assertEquals ([filtered_model.line_index_to_top (i)
+        self.assertEquals ([filtered_model.line_index_to_super (i)
                             for i in range (11)],
                            range (5, 16))
 
-    def test_identity_filter_rerange (self):
+        filtered_model.set_range (0, 20, dispatcher)
+        self.assertEquals (row_list (filtered_model), range (20))
+
+    def test_identity_filter_range (self):
 
-        full_model = Model ()
-        ranged_model = RangeFilteredLogModel (full_model)
-        # FIXME: Call to .reset should not be needed.
-        ranged_model.reset ()
-        filtered_model = FilteredLogModel (ranged_model)
+        filtered_model = FilteredLogModel (Model ())
         row_list = self.__row_list
+        dispatcher = Common.Data.DefaultDispatcher ()
 
-        self.assertEquals (row_list (full_model), range (20))
-        self.assertEquals (row_list (ranged_model), range (20))
+        filtered_model.add_filter (IdentityFilter (), dispatcher)
         self.assertEquals (row_list (filtered_model), range (20))
 
-        filtered_model.add_filter (IdentityFilter (),
-                                   Common.Data.DefaultDispatcher ())
-        ranged_model.set_range (5, 16)
-        filtered_model.super_model_changed_range ()
-
-        self.assertEquals (row_list (ranged_model), range (5, 16))
+        filtered_model.set_range (5, 16, dispatcher)
         self.assertEquals (row_list (filtered_model), range (5, 16))
-
-        self.assertEquals ([filtered_model.line_index_from_super (i)
-                            for i in range (11)],
-                           range (11))
         self.assertEquals ([filtered_model.line_index_to_super (i)
                             for i in range (11)],
-                           range (11))
-        self.assertEquals ([filtered_model.line_index_from_top (i)
-                            for i in range (5, 16)],
-                           range (11))
-        self.assertEquals ([filtered_model.line_index_to_top (i)
-                            for i in range (11)],
                            range (5, 16))
 
-    def test_filtered_range_refilter_skip (self):
-
-        full_model = Model ()
-        ranged_model = RangeFilteredLogModel (full_model)
-        # FIXME: Call to .reset should not be needed.
-        ranged_model.reset ()
-        filtered_model = FilteredLogModel (ranged_model)
+    def test_filtered_range (self):
 
+        filtered_model = FilteredLogModel (Model ())
         row_list = self.__row_list
+        dispatcher = Common.Data.DefaultDispatcher ()
 
-        filtered_model.add_filter (CategoryFilter ("EVEN"),
-                                   Common.Data.DefaultDispatcher ())
-        self.__dump_model (filtered_model, "filtered")
-
+        filtered_model.add_filter (CategoryFilter ("EVEN"), dispatcher)
+        self.assertEquals (filtered_model.filter_masks, [None])
         self.assertEquals (row_list (filtered_model), range (1, 20, 2))
         self.assertEquals ([filtered_model.line_index_from_super (i)
                             for i in range (1, 20, 2)],
                            range (10))
-        self.assertEquals ([filtered_model.line_index_to_super (i)
-                            for i in range (10)],
-                           range (1, 20, 2))
-        self.assertEquals ([filtered_model.line_index_from_top (i)
-                            for i in range (1, 20, 2)],
-                           range (10))
-        self.assertEquals ([filtered_model.line_index_to_top (i)
-                            for i in range (10)],
-                           range (1, 20, 2))
 
-        ranged_model.set_range (1, 20)
-        self.__dump_model (ranged_model, "ranged (1, 20)")
-        filtered_model.super_model_changed_range ()
-        self.__dump_model (filtered_model, "filtered range")
+        # Restricting:
+        filtered_model.set_range (5, 16, dispatcher)
+        self.assertEquals (row_list (filtered_model), range (5, 16, 2))
+        filtered_model.set_range (7, 13, dispatcher)
+        self.assertEquals (row_list (filtered_model), range (7, 13, 2))
 
-        self.assertEquals ([filtered_model.line_index_from_super (i)
-                            for i in range (0, 19, 2)],
-                           range (10))
-        self.assertEquals ([filtered_model.line_index_to_super (i)
-                            for i in range (10)],
-                           range (0, 19, 2))
-        self.assertEquals ([filtered_model.line_index_from_top (i)
-                            for i in range (1, 20, 2)],
-                           range (10))
-        self.assertEquals ([filtered_model.line_index_to_top (i)
-                            for i in range (10)],
-                           range (1, 20, 2))
+        # Widening on both ends:
+        filtered_model.set_range (2, 18, dispatcher)
+        self.assertEquals (row_list (filtered_model), range (3, 18, 2))
 
-        ranged_model.set_range (2, 20)
-        self.__dump_model (ranged_model, "ranged (2, 20)")
-        filtered_model.super_model_changed_range ()
-        self.__dump_model (filtered_model, "filtered range")
+        # Moving to a range that does not overlap the current one:
+        filtered_model.set_range (2, 6, dispatcher)
+        self.assertEquals (row_list (filtered_model), [3, 5])
+        filtered_model.set_range (12, 18, dispatcher)
+        self.assertEquals (row_list (filtered_model), [13, 15, 17])
 
-        self.assertEquals (row_list (filtered_model), range (3, 20, 2))
-        self.assertEquals ([filtered_model.line_index_from_super (i)
-                            for i in range (1, 18, 2)],
-                           range (9))
-        self.assertEquals ([filtered_model.line_index_to_super (i)
-                            for i in range (9)],
-                           range (1, 18, 2))
-        self.assertEquals ([filtered_model.line_index_from_top (i)
-                            for i in range (3, 20, 2)],
-                           range (9))
-        self.assertEquals ([filtered_model.line_index_to_top (i)
-                            for i in range (9)],
-                           range (3, 20, 2))
-
-    def test_filtered_range_refilter (self):
-
-        full_model = Model ()
-        ranged_model = RangeFilteredLogModel (full_model)
-        # FIXME: Call to .reset should not be needed.
-        ranged_model.reset ()
-        filtered_model = FilteredLogModel (ranged_model)
+        # Overlapping on one end:
+        filtered_model.set_range (9, 14, dispatcher)
+        self.assertEquals (row_list (filtered_model), [9, 11, 13])
 
-        row_list = self.__row_list
-        rows = row_list (full_model)
-        rows_ranged = row_list (ranged_model)
-        rows_filtered = row_list (filtered_model)
-
-        self.__dump_model (full_model, "full model")
-        ## self.__dump_model (ranged_model, "ranged model")
-        ## self.__dump_model (filtered_model, "filtered model")
-
-        self.assertEquals (rows, rows_ranged)
-        self.assertEquals (rows, rows_filtered)
-
-        self.assertEquals ([ranged_model.line_index_from_super (i)
-                            for i in range (20)],
-                           range (20))
-        self.assertEquals ([ranged_model.line_index_to_super (i)
-                            for i in range (20)],
-                           range (20))
-        self.assertEquals ([ranged_model.line_index_from_top (i)
-                            for i in range (20)],
-                           range (20))
-        self.assertEquals ([ranged_model.line_index_to_top (i)
-                            for i in range (20)],
-                           range (20))
+        filtered_model.set_range (0, 20, dispatcher)
+        self.assertEquals (row_list (filtered_model), range (1, 20, 2))
 
-        self.assertEquals ([filtered_model.line_index_from_super (i)
-                            for i in range (20)],
-                           range (20))
-        self.assertEquals ([filtered_model.line_index_to_super (i)
-                            for i in range (20)],
-                           range (20))
-        self.assertEquals ([filtered_model.line_index_from_top (i)
-                            for i in range (20)],
-                           range (20))
-        self.assertEquals ([filtered_model.line_index_to_top (i)
-                            for i in range (20)],
-                           range (20))
+    def test_random_filtered_range (self):
 
-        ranged_model.set_range (5, 16)
-        self.__dump_model (ranged_model, "ranged model (5, 16)")
-        filtered_model.super_model_changed_range ()
+        filtered_model = FilteredLogModel (Model ())
+        row_list = self.__row_list
+        dispatcher = Common.Data.DefaultDispatcher ()
 
-        rows_ranged = row_list (ranged_model)
-        self.assertEquals (rows_ranged, range (5, 16))
+        filtered_model.add_filter (RandomFilter (538295943), dispatcher)
+        random_rows = row_list (filtered_model)
 
-        self.__dump_model (filtered_model, "filtered model (nofilter, 5, 15)")
+        for start, stop in ((10, 20), (0, 10), (5, 15), (3, 19), (0, 20),):
+            filtered_model.set_range (start, stop, dispatcher)
+            self.assertEquals (row_list (filtered_model),
+                               [x for x in random_rows if start <= x < stop])
 
-        rows_filtered = row_list (filtered_model)
-        self.assertEquals (rows_ranged, rows_filtered)
+    def test_append_full_range (self):
 
-        self.assertEquals ([ranged_model.line_index_from_super (i)
-                            for i in range (5, 16)],
-                           range (11))
-        self.assertEquals ([ranged_model.line_index_to_super (i)
-                            for i in range (11)],
-                           range (5, 16))
-        self.assertEquals ([ranged_model.line_index_from_top (i)
-                            for i in range (5, 16)],
-                           range (11))
-        self.assertEquals ([ranged_model.line_index_to_top (i)
-                            for i in range (11)],
-                           range (5, 16))
+        model = Model ()
+        filtered_model = FilteredLogModel (model)
+        row_list = self.__row_list
+        dispatcher = Common.Data.DefaultDispatcher ()
 
-        self.assertEquals ([filtered_model.line_index_from_super (i)
-                            for i in range (11)],
-                           range (11))
-        self.assertEquals ([filtered_model.line_index_to_super (i)
-                            for i in range (11)],
-                           range (11))
-        self.assertEquals ([filtered_model.line_index_from_top (i)
-                            for i in range (5, 16)],
-                           range (11))
-        self.assertEquals ([filtered_model.line_index_to_top (i)
-                            for i in range (11)],
-                           range (5, 16))
+        filtered_model.add_filter (IdentityFilter (), dispatcher)
+        filtered_model.set_range (0, 20, dispatcher)
 
-        filtered_model.add_filter (CategoryFilter ("EVEN"),
-                                   Common.Data.DefaultDispatcher ())
-        rows_filtered = row_list (filtered_model)
-        self.assertEquals (rows_filtered, range (5, 16, 2))
+        for i in range (20, 25):
+            model.line_offsets.append (i * 100)
+            model.line_levels.append (Data.debug_level_debug)
+        self.assertEquals (filtered_model.handle_super_lines_appended (20, 25),
+                           (20, 25,))
+        self.assertEquals (row_list (filtered_model), range (25))
 
-        self.__dump_model (filtered_model, "filtered model")
+    def test_remove_filter (self):
 
-        self.assertEquals ([filtered_model.line_index_from_super (i)
-                            for i in range (0, 11, 2)],
-                           range (6))
-        self.assertEquals ([filtered_model.line_index_from_top (i)
-                            for i in range (5, 16, 2)],
-                           range (6))
-
-        ranged_model.set_range (7, 13)
-        self.__dump_model (ranged_model, "ranged model (7, 13)")
-        filtered_model.super_model_changed_range ()
-
-        self.assertEquals (row_list (ranged_model), range (7, 13))
-        self.assertEquals ([ranged_model.line_index_from_super (i)
-                            for i in range (7, 13)],
-                           range (6))
-        self.assertEquals ([ranged_model.line_index_to_super (i)
-                            for i in range (6)],
-                           range (7, 13))
-        self.assertEquals ([ranged_model.line_index_from_top (i)
-                            for i in range (7, 13)],
-                           range (6))
-        self.assertEquals ([ranged_model.line_index_to_top (i)
-                            for i in range (6)],
-                           range (7, 13))
-
-        self.__dump_model (filtered_model, "filtered model (ranged 7, 12)")
-        self.assertEquals ([filtered_model.line_index_from_super (i)
-                            for i in range (0, 6, 2)],
-                           range (3))
-        self.assertEquals ([filtered_model.line_index_to_super (i)
-                            for i in range (3)],
-                           range (0, 6, 2))
-        self.assertEquals ([filtered_model.line_index_from_top (i)
-                            for i in range (7, 12, 2)],
-                           range (3))
-        self.assertEquals ([filtered_model.line_index_to_top (i)
-                            for i in range (3)],
-                           range (7, 12, 2))
-
-        rows_filtered = row_list (filtered_model)
-        self.assertEquals (rows_filtered, range (7, 13, 2))
-
-    def test_random_filtered_range_refilter (self):
-
-        full_model = Model ()
-        ranged_model = RangeFilteredLogModel (full_model)
-        # FIXME: Call to .reset should not be needed.
-        ranged_model.reset ()
-        filtered_model = FilteredLogModel (ranged_model)
+        filtered_model = FilteredLogModel (Model ())
         row_list = self.__row_list
+        dispatcher = Common.Data.DefaultDispatcher ()
 
-        self.assertEquals (row_list (full_model), range (20))
-        self.assertEquals (row_list (ranged_model), range (20))
-        self.assertEquals (row_list (filtered_model), range (20))
-
-        filtered_model.add_filter (RandomFilter (538295943),
-                                   Common.Data.DefaultDispatcher ())
+        category_filter = CategoryFilter ("EVEN")
+        random_filter = RandomFilter (538295943)
+        filtered_model.add_filter (random_filter, dispatcher)
         random_rows = row_list (filtered_model)
+        filtered_model.add_filter (category_filter, dispatcher)
+        self.assertEquals (row_list (filtered_model),
+                           [x for x in random_rows if x % 2 == 1])
 
-        self.__dump_model (filtered_model)
-        ranged_model.set_range (10, 20)
-        self.__dump_model (ranged_model, "ranged_model (10, 20)")
-        self.assertEquals (row_list (ranged_model), range (10, 20))
-        filtered_model.super_model_changed_range ()
-        self.__dump_model (filtered_model)
-        self.assertEquals (row_list (filtered_model), [x for x in range (10, 20) if x in random_rows])
-
-        ranged_model.set_range (0, 20)
-        self.assertEquals (row_list (ranged_model), range (0, 20))
-
-        ranged_model = RangeFilteredLogModel (full_model)
-        # FIXME: Call to .reset should not be needed.
-        ranged_model.reset ()
-        filtered_model = FilteredLogModel (ranged_model)
-        filtered_model.add_filter (RandomFilter (538295943),
-                                   Common.Data.DefaultDispatcher ())
-        self.__dump_model (filtered_model, "filtered model")
-        self.assertEquals (row_list (filtered_model), random_rows)
+        filtered_model.set_range (5, 16, dispatcher)
+        filtered_model.remove_filter (category_filter, dispatcher)
+        self.assertEquals (filtered_model.filters, [random_filter])
+        self.assertEquals (row_list (filtered_model),
+                           [x for x in random_rows if 5 <= x < 16])
 
-        ranged_model.set_range (0, 10)
-        self.__dump_model (ranged_model, "ranged model (0, 10)")
-        filtered_model.super_model_changed_range ()
-        self.assertEquals (row_list (ranged_model), range (0, 10))
-        self.__dump_model (filtered_model)
-        self.assertEquals (row_list (filtered_model), [x for x in range (0, 10) if x in random_rows])
+        filtered_model.remove_filter (random_filter, dispatcher)
+        self.assertEquals (row_list (filtered_model), range (5, 16))
+
+        filtered_model.set_range (0, 20, dispatcher)
+        self.assertEquals (row_list (filtered_model), range (20))
 
     def __row_list (self, model):
 
         return [row[Model.COL_PID] for row in model]
 
-    def __dump_model (self, model, comment = None):
+class TestMaskedFilter (LogTestCase):
 
-        # TODO: Provide a command line option to turn this on and off.
+    def setUp (self):
 
-        return
+        LogTestCase.setUp (self)
 
-        if not hasattr (model, "super_model"):
-            # Top model.
-            print "\t(%s)" % ("|".join ([str (i).rjust (2) for i in self.__row_list (model)]),),
-        else:
-            top_model = model.super_model
-            if hasattr (top_model, "super_model"):
-                top_model = top_model.super_model
-            top_indices = self.__row_list (top_model)
-            positions = self.__row_list (model)
-            output = ["  "] * len (top_indices)
-            for i, position in enumerate (positions):
-                output[position] = str (i).rjust (2)
-            print "\t(%s)" % ("|".join (output),),
-
-        if comment is None:
-            print
-        else:
-            print comment
+        levels = (Data.debug_level_debug, Data.debug_level_warning,
+                  Data.debug_level_log,)
+        categories = ("A", "B",)
+        lines = [line_string (i * 10, i % 3, levels[i % 3],
+                              categories[i % 2], "message %i" % (i,))
+                 for i in range (100)]
+        log_file = self.load (self.make_log (lines))
+        for i in log_file.fields.process ():
+            pass
+        self.model = LazyLogModel (log_file)
+
+    def test_add_remove (self):
+
+        filtered_model = FilteredLogModel (self.model)
+        dispatcher = Common.Data.DefaultDispatcher ()
+
+        category_filter = CategoryFilter ("A")
+        level_filter = DebugLevelFilter (Data.debug_level_warning)
+        filtered_model.add_filter (category_filter, dispatcher)
+        filtered_model.add_filter (level_filter, dispatcher)
+        self.assertFalse (None in filtered_model.filter_masks)
+        self.assertEquals (list (filtered_model.super_index),
+                           [i for i in range (100)
+                            if i % 2 == 1 and i % 3 != 1])
+
+        filtered_model.remove_filter (category_filter, dispatcher)
+        self.assertEquals (list (filtered_model.super_index),
+                           [i for i in range (100) if i % 3 != 1])
+
+        filtered_model.remove_filter (level_filter, dispatcher)
+        self.assertEquals (list (filtered_model.super_index), range (100))
+
+    def test_set_range (self):
+
+        filtered_model = FilteredLogModel (self.model)
+        dispatcher = Common.Data.DefaultDispatcher ()
+
+        filtered_model.add_filter (CategoryFilter ("A"), dispatcher)
+        self.assertFalse (None in filtered_model.filter_masks)
+
+        for start, stop in ((10, 30), (20, 25), (50, 70), (40, 60),
+                            (0, 100),):
+            filtered_model.set_range (start, stop, dispatcher)
+            self.assertEquals (list (filtered_model.super_index),
+                               range (start + 1 - start % 2, stop, 2))
+
+    def test_request_fields (self):
+
+        # Filters that can use the column store ask for it while it is not
+        # complete yet:
+        lines = [line_string (0, 0, Data.debug_level_debug, "A", "message")]
+        log_file = self.load (self.make_log (lines, "other.log"))
+        filtered_model = FilteredLogModel (LazyLogModel (log_file))
+        self.assertFalse (log_file.fields.requested)
+        filtered_model.add_filter (CategoryFilter ("A"),
+                                   Common.Data.DefaultDispatcher ())
+        self.assertEquals (filtered_model.filter_masks, [None])
+        self.assertTrue (log_file.fields.requested)
+
+    def test_set_range_rows (self):
+
+        # Without a column store, widening the range filters the rows that
+        # come into view:
+        self.model.line_fields = None
+        filtered_model = FilteredLogModel (self.model)
+        dispatcher = Common.Data.DefaultDispatcher ()
+
+        filtered_model.add_filter (CategoryFilter ("A"), dispatcher)
+        self.assertEquals (filtered_model.filter_masks, [None])
+
+        for start, stop in ((40, 60), (30, 70), (20, 65), (10, 90),
+                            (0, 100),):
+            filtered_model.set_range (start, stop, dispatcher)
+            self.assertEquals (list (filtered_model.super_index),
+                               range (start + 1 - start % 2, stop, 2))
+            self.assertEquals (list (filtered_model.line_offsets),
+                               [self.model.line_offsets[i]
+                                for i in filtered_model.super_index])
+
+    def test_abort_set_range (self):
+
+        self.model.line_fields = None
+        filtered_model = FilteredLogModel (self.model)
+        filtered_model._rows_chunk_lines = 10
+        dispatcher = Common.Data.DefaultDispatcher ()
+        filtered_model.add_filter (CategoryFilter ("A"), dispatcher)
+        filtered_model.set_range (40, 60, dispatcher)
+
+        processes = []
+        class StepDispatcher (Common.Data.Dispatcher):
+            def __call__ (self, iterator):
+                processes.append (iterator)
+
+        # Widening filters the lines that come into view in a process:
+        filtered_model.set_range (0, 100, StepDispatcher ())
+        self.assertEquals (list (filtered_model.super_index),
+                           range (41, 60, 2))
+        self.assertTrue (processes[0].next ())
+        self.assertEquals (filtered_model.get_filter_progress (), 10 / 80.)
+        self.assertRaises (ValueError, filtered_model.set_range, 0, 100,
+                           dispatcher)
+
+        filtered_model.abort_process ()
+        self.assertEquals (list (filtered_model.super_index),
+                           range (41, 60, 2))
+
+        # The range is restored as well:
+        filtered_model.set_range (0, 100, dispatcher)
+        self.assertEquals (list (filtered_model.super_index),
+                           range (1, 100, 2))
+
+    def test_chunked_rows (self):
+
+        # Without a column store, filters read the rows.  The results of the
+        # chunks must be merged in order:
+        self.model.line_fields = None
+        dispatcher = Common.Data.DefaultDispatcher ()
+
+        results = []
+        for rows_chunk_lines in (1000, 7,):
+            filtered_model = FilteredLogModel (self.model)
+            filtered_model._rows_chunk_lines = rows_chunk_lines
+
+            category_filter = CategoryFilter ("A")
+            level_filter = DebugLevelFilter (Data.debug_level_warning)
+            filtered_model.add_filter (category_filter, dispatcher)
+            filtered_model.add_filter (level_filter, dispatcher)
+            self.assertEquals (filtered_model.filter_masks, [None, None])
+            both = list (filtered_model.super_index)
+            filtered_model.remove_filter (category_filter, dispatcher)
+            results.append ((both, list (filtered_model.super_index),))
+
+        self.assertEquals (results[0], results[1])
+        self.assertEquals (results[1],
+                           ([i for i in range (100)
+                             if i % 2 == 1 and i % 3 != 1],
+                            [i for i in range (100) if i % 3 != 1]))
 
 if __name__ == "__main__":
     test_main ()
@@ -0,0 +1,660 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the plugins."""
+
+import sys
+import os
+import os.path
+from zlib import crc32
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+import re
+from bisect import bisect_right
+from random import Random
+from unittest import TestCase, main as test_main
+
+from GstDebugViewer import Common, Data
+from GstDebugViewer.GUI.filters import CategoryFilter, DebugLevelFilter
+from GstDebugViewer.GUI.models import FilteredLogModel, LazyLogModel
+from GstDebugViewer.Plugins.ColorizeRows import CategoryColorSentinel
+from GstDebugViewer.Plugins.FindBar import (FindBarFeature,
+                                            SearchOperation,
+                                            SearchSentinel,
+                                            map_lines_to_rows,)
+from GstDebugViewer.Plugins.Swimlanes import (get_lane_spans,
+                                              get_pixel_bounds,
+                                              get_tail_columns)
+from GstDebugViewer.Plugins.Timeline import (MAX_LEVELS,
+                                             TimelineCache,
+                                             TimelineData,)
+
+from gi.repository import Gtk
+
+from test_data import LogTestCase, line_string
+
+class TestCategoryColors (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        self.categories = ("A", "GST_PADS", "GST_CAPS", "",)
+        lines = [line_string (i, 1, Data.debug_level_info,
+                              self.categories[i % 4], "message %i" % (i,))
+                 for i in range (100)]
+        self.log_file = self.load (self.make_log (lines))
+        self.log_file.fields._lines_per_iteration = 10
+
+        self.sentinel = CategoryColorSentinel ()
+        self.sentinel.dispatcher = Common.Data.DefaultDispatcher ()
+        self.sentinel._lines_per_iteration = 30
+
+    def get_color (self, category):
+
+        if not category:
+            return 0
+
+        n_colors = len (self.sentinel.palette) - 1
+        return 1 + (crc32 (category) & 0xffffffff) % n_colors
+
+    def test_colors (self):
+
+        sentinel = self.sentinel
+        fields = self.log_file.fields
+        self.assertEquals (len (sentinel.palette), 9)
+        self.assertEquals (sentinel.palette[0], (None, None,))
+
+        # Stops until the fields of the lines are parsed:
+        sentinel.run_for (self.log_file)
+        self.assertEquals (len (sentinel.colors), 0)
+        self.assertFalse (sentinel.is_complete ())
+
+        # Continues from the progress of the fields process:
+        progress = []
+        fields.progress_handlers.append (
+            lambda: progress.append (len (sentinel.colors)))
+        for x in fields.process ():
+            pass
+        self.assertEquals (progress, [0, 0, 30, 30, 30, 60, 60, 60, 90, 100])
+        self.assertTrue (sentinel.is_complete ())
+
+        self.assertEquals (list (sentinel.colors),
+                           [self.get_color (self.categories[i % 4])
+                            for i in range (100)])
+        category_ids = [fields.get_string_id (4, category)
+                        for category in self.categories]
+        self.assertEquals ([sentinel.category_colors[i] for i in category_ids],
+                           map (self.get_color, self.categories))
+
+        sentinel.abort ()
+        self.assertEquals (len (fields.progress_handlers), 1)
+
+class TestSearchOperation (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        words = ("pad", "caps", "Buffer", "buffer", "event", "a(b", "PAD",)
+        rand = Random (3131)
+        self.messages = [" ".join (rand.choice (words)
+                                   for j in range (rand.randrange (1, 4)))
+                         for i in range (200)]
+        lines = [line_string (i, 1, Data.debug_level_info, "A", message)
+                 for i, message in enumerate (self.messages)]
+        self.log_file = self.load (self.make_log (lines))
+        self.model = LazyLogModel (self.log_file)
+
+    def get_matches (self, search_text, mode, case_sensitive):
+
+        if case_sensitive:
+            messages = self.messages
+        else:
+            messages = [message.lower () for message in self.messages]
+            search_text = search_text.lower ()
+
+        if mode == SearchOperation.regex:
+            match = lambda message: re.search (search_text, message)
+        elif mode == SearchOperation.literal:
+            match = lambda message: search_text in message
+        elif mode == SearchOperation.any_term:
+            match = lambda message: any (term in message
+                                         for term in search_text.split ())
+        else:
+            match = lambda message: all (term in message
+                                         for term in search_text.split ())
+
+        return [i for i, message in enumerate (messages) if match (message)]
+
+    def search (self, search_text, mode, case_sensitive, index = None):
+
+        operation = SearchOperation (self.model, search_text, mode,
+                                     case_sensitive, index)
+        sentinel = SearchSentinel ()
+        sentinel.dispatcher = Common.Data.DefaultDispatcher ()
+        sentinel._lines_per_iteration = 30
+        sentinel.run_for (operation)
+        self.assertTrue (operation.is_complete ())
+        return list (operation.matches)
+
+    def assertModes (self, index = None):
+
+        for search_text, mode in (("pad", SearchOperation.literal,),
+                                  ("pad caps", SearchOperation.literal,),
+                                  ("a(b", SearchOperation.literal,),
+                                  (r"\bbuffer\b", SearchOperation.regex,),
+                                  ("caps|PAD", SearchOperation.regex,),
+                                  (r"^pad \w+$", SearchOperation.regex,),
+                                  ("event a(b", SearchOperation.any_term,),
+                                  ("caps", SearchOperation.any_term,),
+                                  ("pad Buffer", SearchOperation.all_terms,),
+                                  ("a(b event pad",
+                                   SearchOperation.all_terms,),):
+            for case_sensitive in (True, False,):
+                self.assertEquals (self.search (search_text, mode,
+                                                case_sensitive, index),
+                                   self.get_matches (search_text, mode,
+                                                     case_sensitive))
+
+    def test_modes (self):
+
+        # Gets the messages from the model until the column store is
+        # complete:
+        self.assertFalse (self.log_file.fields.is_complete ())
+        self.assertModes ()
+
+        for x in self.log_file.fields.process ():
+            pass
+        self.assertModes ()
+
+        index = Data.MessageIndex (self.log_file.fields)
+        for x in index.process ():
+            pass
+        self.assertTrue (index.is_complete ())
+        self.assertModes (index)
+
+    def test_match_func (self):
+
+        message = "Buffer pad buffer caps PAD"
+        for search_text, mode, case_sensitive, spans in (
+                ("buffer", SearchOperation.literal, True, [(11, 17,)],),
+                ("buffer", SearchOperation.literal, False,
+                 [(0, 6,), (11, 17,)],),
+                ("pad caps", SearchOperation.literal, True, [],),
+                ("caps pad", SearchOperation.any_term, True,
+                 [(7, 10,), (18, 22,)],),
+                ("caps event", SearchOperation.all_terms, True, [],),
+                ("caps PAD", SearchOperation.all_terms, True,
+                 [(18, 22,), (23, 26,)],),
+                (r"p\w*", SearchOperation.regex, False,
+                 [(7, 10,), (20, 22,), (23, 26,)],),
+                # Empty matches are not highlighted:
+                ("x*", SearchOperation.regex, True, [],),):
+            operation = SearchOperation (self.model, search_text, mode,
+                                         case_sensitive)
+            self.assertEquals (list (operation.match_func (message)), spans)
+
+    def test_invalid_regex (self):
+
+        self.assertRaises (re.error, SearchOperation, self.model, "a(b",
+                           SearchOperation.regex)
+        # The other modes take the text literally:
+        for mode in (SearchOperation.literal, SearchOperation.any_term,
+                     SearchOperation.all_terms,):
+            self.assertEquals (self.search ("a(b", mode, True),
+                               self.get_matches ("a(b", mode, True))
+
+class LogView (object):
+
+    """Stands in for the log view of the window, showing n_visible rows
+    around the row that it scrolled to last."""
+
+    def __init__ (self, model, n_visible = 10):
+
+        self.model = model
+        self.n_visible = n_visible
+        self.start = None
+        self.selected = None
+
+    def get_model (self):
+
+        return self.model
+
+    def get_visible_range (self):
+
+        if self.start is None:
+            return None
+        stop = min (self.start + self.n_visible, len (self.model)) - 1
+        return (Gtk.TreePath ((self.start,)), Gtk.TreePath ((stop,)),)
+
+    def scroll_to_cell (self, path, use_align = False, row_align = 0.):
+
+        self.start = max (path[0] - self.n_visible // 2, 0)
+
+    def get_selection (self):
+
+        return self
+
+    def select_path (self, path):
+
+        self.selected = path[0]
+
+class FindBar (object):
+
+    """Stands in for the find bar widget, keeping the status that it
+    shows."""
+
+    status = None
+
+    def status_no_match_found (self):
+
+        self.status = "no match"
+
+    def status_searching (self):
+
+        self.status = "searching"
+
+    def status_match_position (self, position, count):
+
+        self.status = (position, count,)
+
+    def status_match_count (self, count):
+
+        self.status = (None, count,)
+
+    def clear_status (self):
+
+        self.status = None
+
+class TestFindBarNavigation (LogTestCase):
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        # Every fifth line matches, the filter hides the even lines:
+        lines = [line_string (i, 1, Data.debug_level_info, "AB"[i % 2],
+                              ("other", "match",)[i % 5 == 0])
+                 for i in range (100)]
+        self.log_file = self.load (self.make_log (lines))
+        for x in self.log_file.fields.process ():
+            pass
+        self.model = LazyLogModel (self.log_file)
+        self.filtered_model = FilteredLogModel (self.model)
+        self.dispatcher = Common.Data.DefaultDispatcher ()
+
+        feature = FindBarFeature (None)
+        feature.sentinel.dispatcher = self.dispatcher
+        feature.log_view = LogView (self.filtered_model)
+        feature.bar = FindBar ()
+        feature.operation = SearchOperation (self.model, "match")
+        feature.sentinel.run_for (feature.operation)
+        self.feature = feature
+
+    def assertSensitive (self, sensitive):
+
+        for name in ("goto-next-search-result",
+                     "goto-previous-search-result",):
+            action = self.feature.action_group.get_action (name)
+            self.assertEquals (action.props.sensitive, sensitive)
+
+    def assertMatch (self, forward, row, position):
+
+        feature = self.feature
+        feature.goto_match (forward)
+        self.assertEquals (feature.log_view.selected, row)
+        self.assertEquals (feature.bar.status, (position, 20,))
+
+    def test_map_lines_to_rows (self):
+
+        line_indices = (0, 1, 5, 10, 15, 98, 99,)
+        self.assertEquals (list (map_lines_to_rows (self.model,
+                                                    line_indices)),
+                           list (line_indices))
+        self.assertEquals (list (map_lines_to_rows (self.filtered_model,
+                                                    line_indices)),
+                           list (line_indices))
+
+        self.filtered_model.add_filter (CategoryFilter ("A"),
+                                        self.dispatcher)
+        # The even lines map to the row of the next odd line, but are hidden:
+        rows = map_lines_to_rows (self.filtered_model, line_indices)
+        self.assertEquals (list (rows), [0, 2, 7, 49])
+        self.assertTrue (map_lines_to_rows (self.filtered_model, (99,),
+                                            rows) is rows)
+        self.assertEquals (list (rows), [0, 2, 7, 49, 49])
+
+        self.filtered_model.set_range (20, 60, self.dispatcher)
+        self.assertEquals (list (map_lines_to_rows (self.filtered_model,
+                                                    range (100))),
+                           range (20))
+
+    def test_navigation (self):
+
+        feature = self.feature
+        self.assertTrue (feature.operation.is_complete ())
+        self.assertEquals (len (feature.operation.matches), 20)
+        self.assertSensitive (True)
+
+        # Starts from the first visible match:
+        feature.log_view.start = 30
+        self.assertMatch (True, 30, 7)
+        self.assertMatch (True, 35, 8)
+        self.assertMatch (False, 30, 7)
+
+        # Wraps around at either end:
+        feature.log_view.start = 90
+        self.assertMatch (True, 90, 19)
+        self.assertMatch (True, 95, 20)
+        self.assertMatch (True, 0, 1)
+        self.assertMatch (False, 95, 20)
+        self.assertSensitive (True)
+
+    def test_filter_change (self):
+
+        feature = self.feature
+        feature.log_view.start = 0
+        self.assertMatch (True, 0, 1)
+        self.assertMatch (True, 5, 2)
+        self.assertMatch (True, 10, 3)
+
+        # Line 10 is hidden now, so the position is not known:
+        self.filtered_model.add_filter (CategoryFilter ("A"),
+                                        self.dispatcher)
+        self.assertEquals (list (feature.get_match_rows ()),
+                           range (2, 50, 5))
+        feature.update_status ()
+        self.assertEquals (feature.bar.status, (None, 10,))
+
+        # Continues with the next match that is visible:
+        feature.log_view.start = 3
+        feature.goto_match (True)
+        self.assertEquals (feature.log_view.selected, 7)
+        self.assertEquals (feature.current_match, 15)
+        self.assertEquals (feature.bar.status, (2, 10,))
+        feature.goto_match (False)
+        self.assertEquals (feature.log_view.selected, 2)
+        self.assertEquals (feature.bar.status, (1, 10,))
+        feature.goto_match (False)
+        self.assertEquals (feature.log_view.selected, 47)
+        self.assertEquals (feature.bar.status, (10, 10,))
+
+        # Without matches, there is nowhere to go:
+        feature.clear_matches ()
+        feature.operation = SearchOperation (self.model, "no such")
+        feature.sentinel.run_for (feature.operation)
+        self.assertEquals (len (feature.get_match_rows ()), 0)
+        self.assertEquals (feature.bar.status, "no match")
+        self.assertSensitive (False)
+
+class TestSwimlanes (TestCase):
+
+    def get_spans (self, times, line_indices, start_ts, stop_ts, width):
+
+        columns = sorted (set (min ((times[i] - start_ts) * width //
+                                    (stop_ts - start_ts), width - 1)
+                               for i in line_indices
+                               if start_ts <= times[i] <= stop_ts))
+        spans = []
+        for x in columns:
+            if spans and spans[-1][1] == x - 1:
+                spans[-1] = (spans[-1][0], x,)
+            else:
+                spans.append ((x, x,))
+        return spans
+
+    def test_unsorted_tail (self):
+
+        rand = Random (4242)
+        times = sorted (rand.randrange (1200) for i in range (200))
+        # Lines appended in follow mode, not in timestamp order:
+        times += [rand.randrange (1200) for i in range (20)]
+        n_sorted = 200
+        while times[n_sorted - 1] <= times[n_sorted]:
+            n_sorted += 1
+
+        for start_ts, stop_ts, width in ((0, 1200, 12,), (100, 600, 50,),
+                                         (0, 1000, 1000,),):
+            bounds = get_pixel_bounds (times, start_ts, stop_ts, width,
+                                       n_sorted)
+            self.assertEquals (len (bounds), width + 1)
+            for step in (1, 3, 7,):
+                line_indices = range (step - 1, len (times), step)
+                tail_columns = get_tail_columns (times, line_indices,
+                                                 n_sorted, start_ts, stop_ts,
+                                                 width)
+                self.assertEquals (get_lane_spans (line_indices, bounds,
+                                                   tail_columns),
+                                   self.get_spans (times, line_indices,
+                                                   start_ts, stop_ts, width))
+
+class TimelineTestCase (LogTestCase):
+
+    levels = (Data.debug_level_error, Data.debug_level_warning,
+              Data.debug_level_info, Data.debug_level_debug,
+              Data.debug_level_log,)
+
+    n_lines = 300
+    max_ts = 3000
+
+    def setUp (self):
+
+        LogTestCase.setUp (self)
+
+        rand = Random (1717)
+        self.times = sorted (rand.randrange (1, self.max_ts)
+                             for i in range (self.n_lines))
+        self.line_levels = [rand.choice (self.levels) for ts in self.times]
+        self.categories = ["AB"[ts % 2] for ts in self.times]
+        lines = [line_string (ts, 1, level, category, "message %i" % (ts,))
+                 for ts, level, category in zip (self.times,
+                                                 self.line_levels,
+                                                 self.categories)]
+        self.log_file = self.load (self.make_log (lines))
+
+    def get_data (self, model):
+
+        data = TimelineData (model)
+        for x in data.process ():
+            pass
+        return data
+
+    def count_histogram (self, line_indices, n_partitions, start_ts,
+                         stop_ts, bucket_width = None):
+        """Count the lines of each partition and level one by one, like
+        TimelineData.get_histogram returns them.  If bucket_width is given,
+        the partitions start and end at bucket boundaries, like the sums of
+        a pyramid level with buckets of that width."""
+
+        times = [self.times[i] for i in line_indices]
+        levels = [self.line_levels[i] for i in line_indices]
+        first_ts = times[0]
+        if start_ts is None or start_ts < first_ts:
+            start_ts = first_ts
+        if stop_ts is None or stop_ts > times[-1]:
+            stop_ts = times[-1]
+
+        step = int (float (stop_ts - start_ts) / float (n_partitions))
+        if step <= 0:
+            return (step, [], [], [],)
+
+        # Partition i holds the timestamps from edges[i] up to, but not
+        # including edges[i + 1].  The last partition takes the rest, up to
+        # and including stop_ts:
+        edges = [start_ts + i * step for i in range (n_partitions)]
+        edges.append (stop_ts + 1)
+        if bucket_width is not None:
+            edges = [first_ts + (ts - first_ts) // bucket_width * bucket_width
+                     for ts in edges[:-1]]
+            edges.append (first_ts + ((stop_ts - first_ts) // bucket_width +
+                                      1) * bucket_width)
+
+        freq_data = [0] * n_partitions
+        dist_data = [[0] * MAX_LEVELS for i in range (n_partitions)]
+        for ts, level in zip (times, levels):
+            if not edges[0] <= ts < edges[-1]:
+                continue
+            i = bisect_right (edges, ts) - 1
+            freq_data[i] += 1
+            dist_data[i][level] += 1
+
+        end = len ([ts for ts in times if ts < edges[0]])
+        partitions = []
+        for count in freq_data:
+            end += count
+            partitions.append (end)
+
+        return (step, partitions, freq_data, map (tuple, dist_data),)
+
+    def assertHistogram (self, data, line_indices, n_partitions,
+                         start_ts = None, stop_ts = None,
+                         bucket_width = None):
+
+        step, partitions, freq_data, dist_data = data.get_histogram (
+            n_partitions, start_ts, stop_ts)
+        self.assertEquals ((step, list (partitions), freq_data, dist_data,),
+                           self.count_histogram (line_indices, n_partitions,
+                                                 start_ts, stop_ts,
+                                                 bucket_width))
+
+class TestTimelineData (TimelineTestCase):
+
+    def test_histogram (self):
+
+        data = self.get_data (LazyLogModel (self.log_file))
+        self.assertTrue (data.is_complete ())
+        self.assertEquals (data.ts_range, (self.times[0], self.times[-1],))
+
+        # Count every partition from the timestamps:
+        data.min_partition_buckets = 1 << 30
+        line_indices = range (len (self.times))
+        for args in ((1,), (7,), (300,), (40, 500, 800,), (100, 1000, 1100,),
+                     (10, 1000, 1005,), (25, None, 1500,), (25, 1500,),
+                     (10, 0, 10000,),):
+            self.assertHistogram (data, line_indices, *args)
+
+    def test_filtered (self):
+
+        for x in self.log_file.fields.process ():
+            pass
+        model = FilteredLogModel (LazyLogModel (self.log_file))
+        model.add_filter (CategoryFilter ("A"),
+                          Common.Data.DefaultDispatcher ())
+
+        data = self.get_data (model)
+        data.min_partition_buckets = 1 << 30
+        line_indices = [i for i, category in enumerate (self.categories)
+                        if category == "B"]
+        for args in ((1,), (13,), (200,), (20, 300, 2000,),):
+            self.assertHistogram (data, line_indices, *args)
+
+class TestTimelineCache (TimelineTestCase):
+
+    def test_filter_change (self):
+
+        for x in self.log_file.fields.process ():
+            pass
+        model = FilteredLogModel (LazyLogModel (self.log_file))
+        dispatcher = Common.Data.DefaultDispatcher ()
+        cache = TimelineCache ()
+        self.assertEquals (cache.max_states, 2)
+
+        data = cache.get (model)
+        self.assertTrue (cache.get (model) is data)
+
+        category_filter = CategoryFilter ("A")
+        model.add_filter (category_filter, dispatcher)
+        filtered_data = cache.get (model)
+        self.assertFalse (filtered_data is data)
+        self.assertTrue (cache.get (model) is filtered_data)
+        self.assertEquals (len (cache.states), 2)
+        for x in filtered_data.process ():
+            pass
+        self.assertEquals (len (filtered_data.times),
+                           self.categories.count ("B"))
+
+        # A third state evicts the least recently used one:
+        model.add_filter (DebugLevelFilter (Data.debug_level_info),
+                          dispatcher)
+        level_data = cache.get (model)
+        self.assertEquals (len (cache.states), 2)
+        self.assertEquals ([entry[-1] for entry in cache.states.values ()],
+                           [filtered_data, level_data])
+
+        # Without filters again, the model has the rows of the first state,
+        # but that was evicted:
+        model.remove_filter (category_filter, dispatcher)
+        model.remove_filter (model.filters[0], dispatcher)
+        self.assertFalse (cache.get (model) is data)
+        self.assertEquals (len (cache.states), 2)
+
+        cache.clear ()
+        self.assertEquals (len (cache.states), 0)
+
+class TestTimelinePyramid (TimelineTestCase):
+
+    n_lines = 2000
+    max_ts = 10 ** 7
+
+    def get_bucket_width (self, data, step):
+        """Return the width of the buckets that get_histogram sums up for
+        partitions of the given step, or None if it counts the lines."""
+
+        n_buckets = step // (data.bucket_width * data.min_partition_buckets)
+        if n_buckets == 0:
+            return None
+        level = min (n_buckets.bit_length () - 1, len (data.pyramid) - 1)
+        return data.bucket_width << level
+
+    def test_sweep (self):
+
+        data = self.get_data (LazyLogModel (self.log_file))
+        self.assertEquals (len (data.bucket_bounds), data.n_base_buckets + 1)
+        self.assertEquals (len (data.pyramid),
+                           data.n_base_buckets.bit_length ())
+
+        line_indices = range (self.n_lines)
+        first_ts, last_ts = data.ts_range
+        rand = Random (2323)
+        ranges = [(None, None,), (first_ts, last_ts,),
+                  (first_ts + 1, last_ts - 1,), (0, self.max_ts * 2,)]
+        for i in range (20):
+            start_ts, stop_ts = sorted (rand.randrange (first_ts, last_ts)
+                                        for j in range (2))
+            ranges.append ((start_ts, stop_ts,))
+
+        levels_used = set ()
+        for start_ts, stop_ts in ranges:
+            for n_partitions in (1, 2, 3, 10, 64, 100, 333, 1000, 4096,):
+                step = data.get_histogram (n_partitions, start_ts,
+                                           stop_ts)[0]
+                bucket_width = self.get_bucket_width (data, step)
+                levels_used.add (bucket_width)
+                self.assertHistogram (data, line_indices, n_partitions,
+                                      start_ts, stop_ts, bucket_width)
+
+        # Both exact counts and several pyramid levels were compared:
+        self.assertTrue (None in levels_used)
+        self.assertTrue (len (levels_used) > 5)
+
+if __name__ == "__main__":
+    test_main ()